@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Revision History:
+#      16.10.2026: Created "analyzeVideoBenchmark.py" to measure the running time of the video analysis building blocks.
+
+import os
+import sys
+import json
+import platform
+import tempfile
+import argparse
+import contextlib
+from time import perf_counter, strftime
+
+import ffmpeg
+import numpy
+import imageio as iio
+
+import videoAnalyzeRateOfChange
+import videoAnalysisHelpers
+
+
+class SkipBenchmarkResults:
+    def __init__( self, name ):
+        self.name = name
+        self.framesRead = 0
+        self.framesSkipped = 0
+        self.duration = 0.0
+
+
+def PrintSkipBenchmarkResults( results ):
+    print( "{0:32}{1:>10}{2:>10}{3:>10}{4:>16}".format( results.name, \
+        "%.2fs" % results.duration, str( results.framesRead ), str( results.framesSkipped ), \
+        "%i fps" % int( ( results.framesRead + results.framesSkipped ) / results.duration ) ) )
+
+
+# Reads one frame, then skips frameSkip frames, until the end of the video file
+def Benchmark_SkipFrames( name, createIterator, frameSkip ):
+    results = SkipBenchmarkResults( name )
+
+    timerStart = perf_counter()
+    videoIter = createIterator()
+    try:
+        videoIter.ReadNextFrame()
+        results.framesRead += 1
+        while True:
+            indexBeforeSkip = videoIter.CurrentIndex()
+            landingIndex = videoIter.SkipFrames( frameSkip )
+            videoIter.ReadNextFrame()
+            results.framesSkipped += landingIndex - indexBeforeSkip
+            results.framesRead += 1
+    except Exception:
+        # end of file
+        pass
+    videoIter.Close()
+    results.duration = perf_counter() - timerStart
+
+    return results
+
+
+def RunSkipBenchmarks( videoPathName, frameSkip ):
+    videoMeta = ffmpeg.probe( videoPathName )[ "streams" ]
+    width, height = videoMeta[ 0 ][ 'width' ], videoMeta[ 0 ][ 'height' ]
+    frameRatePair = videoMeta[ 0 ][ 'avg_frame_rate' ].split( '/' )
+    frameRate = float( frameRatePair[ 0 ] ) / float( frameRatePair[ 1 ] )
+
+    print()
+    print( "Skipping %i frames after every frame read, %s (%ix%i, %.2f fps):" % (frameSkip, videoPathName, width, height, frameRate) )
+    print( "{0:32}{1:>10}{2:>10}{3:>10}{4:>16}".format( "Iterator", "Time", "Read", "Skipped", "Frames covered" ) )
+
+    benchmarks = [
+        ( "imageio, set_image_index", lambda: videoAnalyzeRateOfChange.ImageIOVideoIterator( videoPathName, frameRate ) ),
+        ( "ffmpeg pipe, discard", lambda: videoAnalyzeRateOfChange.FFmpegPipeVideoIterator( \
+            videoPathName, width, height, True, frameRate, 0 ) ),
+        ( "ffmpeg pipe, seek", lambda: videoAnalyzeRateOfChange.FFmpegPipeVideoIterator( \
+            videoPathName, width, height, True, frameRate, 1 ) ),
+        ( "ffmpeg pipe gray, discard", lambda: videoAnalyzeRateOfChange.FFmpegPipeVideoIterator( \
+            videoPathName, width, height, False, frameRate, 0 ) ),
+        ( "ffmpeg pipe gray, seek", lambda: videoAnalyzeRateOfChange.FFmpegPipeVideoIterator( \
+            videoPathName, width, height, False, frameRate, 1 ) ) ]
+
+    for (name, createIterator) in benchmarks:
+        PrintSkipBenchmarkResults( Benchmark_SkipFrames( name, createIterator, frameSkip ) )
+
+
+# Synthetic clips: a smooth random background, and a square crossing it during the 2 second slots drawn as moving,
+# in proportion motionDensity. Frames are generated from fixed seeds, so the clips only depend on the encoder version.
+class SyntheticClip:
+    kSlotDuration = 2
+
+    def __init__( self, name, width, height, frameRate, duration, motionDensity ):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.frameRate = frameRate
+        self.duration = duration
+        self.motionDensity = motionDensity
+
+    def FileName( self ):
+        return "%s_%ix%i_%ifps_%is_%03i.mp4" % (self.name, self.width, self.height, self.frameRate, self.duration, int( self.motionDensity * 100 ))
+
+    def Frames( self ):
+        randomGenerator = numpy.random.default_rng( 2022 )
+        grid = randomGenerator.integers( 40, 216, (9, 16, 3), dtype = numpy.uint8 )
+        background = numpy.repeat( numpy.repeat( grid, -(-self.height // 9), axis = 0 ), -(-self.width // 16), axis = 1 )
+        background = numpy.ascontiguousarray( background[ :self.height, :self.width ] )
+        slotFrames = self.kSlotDuration * self.frameRate
+        movingSlots = randomGenerator.random( -(-self.duration // self.kSlotDuration) ) < self.motionDensity
+
+        squareSize = self.height // 6
+        position = 0
+        for i in range( self.duration * self.frameRate ):
+            if movingSlots[ i // slotFrames ]:
+                position = (position + max( 1, self.width // (2 * self.frameRate) )) % (self.width - squareSize)
+            frame = background.copy()
+            top = (self.height - squareSize) // 2
+            frame[ top:top + squareSize, position:position + squareSize ] = 255 - frame[ top:top + squareSize, position:position + squareSize ]
+            yield frame
+
+    # Returns the path of the clip, written to clipFolder unless it is already there
+    def Write( self, clipFolder ):
+        clipPath = os.path.join( clipFolder, self.FileName() )
+        if not os.path.isfile( clipPath ):
+            temporaryPath = os.path.join( clipFolder, videoAnalyzeRateOfChange.kTempFilePrefix + self.FileName() )
+            videoWriter = iio.get_writer( temporaryPath, fps = self.frameRate, macro_block_size = 1 )
+            for frame in self.Frames():
+                videoWriter.append_data( frame )
+            videoWriter.close()
+            os.rename( temporaryPath, clipPath )
+        return clipPath
+
+
+kSyntheticClips = [
+    SyntheticClip( "static", 640, 360, 30, 20, 0.0 ),
+    SyntheticClip( "sparse", 640, 360, 30, 20, 0.2 ),
+    SyntheticClip( "dense", 640, 360, 30, 20, 1.0 ),
+    SyntheticClip( "sparse", 1280, 720, 30, 10, 0.2 ),
+    SyntheticClip( "sparse", 1280, 720, 60, 10, 0.2 ),
+    SyntheticClip( "sparse", 1920, 1080, 30, 5, 0.2 ) ]
+
+# Stages of the analysis, with their time accumulator in AlgorithmPerformanceResults
+kAnalysisStages = [ ("fetch", "frameFetchingAccumulator"), ("prep", "framePrepAccumulator"), ("roc", "rocAnalysisAccumulator"), \
+    ("encode", "outputWritingAccumulator") ]
+
+
+# Frames and MiB (of decoded RGB frames) per second of a stage
+def StageThroughput( frameCount, frameBytes, duration ):
+    if duration <= 0:
+        return { "seconds": duration, "frames": frameCount, "framesPerSecond": None, "MiBPerSecond": None }
+    return { "seconds": duration, "frames": frameCount, "framesPerSecond": frameCount / duration, \
+        "MiBPerSecond": frameCount * frameBytes / (1024.0 * 1024.0 * duration) }
+
+
+# Runs the rate of change analysis of the clip, with the output encoded on the analysis thread unless analyzerArgs
+# set encoderQueueFrames, so that the encode stage measures the encoding.
+def Benchmark_SyntheticClip( clip, clipPath, analyzerArgs ):
+    with tempfile.TemporaryDirectory() as outputFolder:
+        args = argparse.Namespace( **dict( vars( analyzerArgs ), destFolder = outputFolder ) )
+        rocAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( args, clip.name )
+        algPerformanceResults = videoAnalyzeRateOfChange.AlgorithmPerformanceResults()
+
+        # the analysis messages go to a log, not to the results
+        with open( os.path.join( outputFolder, "log.txt" ), 'w' ) as logFile, contextlib.redirect_stdout( logFile ):
+            timerStart = perf_counter()
+            rocAnalyzer.AddVideoFileToAnalysis( clipPath, videoAnalysisHelpers.Logger(), algPerformanceResults )
+            algPerformanceResults.outputWritingAccumulator.OnStartTimer()
+            rocAnalyzer.FinishAnalysis()
+            algPerformanceResults.outputWritingAccumulator.OnStopTimer()
+            duration = perf_counter() - timerStart
+
+    frameBytes = clip.width * clip.height * 3
+    framesCovered = algPerformanceResults.totalFramesProcessed + algPerformanceResults.totalFramesSkipped
+    stageFrames = { "fetch": algPerformanceResults.totalFramesProcessed, "prep": algPerformanceResults.totalFramesProcessed, \
+        "roc": algPerformanceResults.totalFramesProcessed, "encode": rocAnalyzer.totalFrameOutputCount }
+    return { "clip": clip.FileName(), "width": clip.width, "height": clip.height, "frameRate": clip.frameRate, \
+        "duration": clip.duration, "motionDensity": clip.motionDensity, \
+        "framesProcessed": algPerformanceResults.totalFramesProcessed, "framesSkipped": algPerformanceResults.totalFramesSkipped, \
+        "framesTriggered": algPerformanceResults.totalFramesTriggered, "analysisAborted": algPerformanceResults.analysisAborted, \
+        "total": StageThroughput( framesCovered, frameBytes, duration ), \
+        "stages": { stage: StageThroughput( stageFrames[ stage ], frameBytes, getattr( algPerformanceResults, accumulator ).accumulator ) \
+            for (stage, accumulator) in kAnalysisStages } }
+
+
+def PrintSyntheticBenchmarkResults( results, previousResults = None ):
+    previousClips = {}
+    if not previousResults is None:
+        previousClips = { r[ "clip" ]: r for r in previousResults[ "clips" ] }
+    def FormatRate( rate, previousRate ):
+        if rate is None:
+            return "-"
+        if previousRate is None:
+            return "%.1f" % rate
+        return "%.1f (%.2fx)" % (rate, rate / previousRate)
+
+    print()
+    print( "{0:36}{1:>18}".format( "Clip, frames/s", "total" ) + "".join( "{0:>18}".format( stage ) for (stage, accumulator) in kAnalysisStages ) )
+    for r in results[ "clips" ]:
+        previous = previousClips.get( r[ "clip" ] )
+        line = "{0:36}{1:>18}".format( r[ "clip" ], FormatRate( r[ "total" ][ "framesPerSecond" ], \
+            None if previous is None else previous[ "total" ][ "framesPerSecond" ] ) )
+        for (stage, accumulator) in kAnalysisStages:
+            line += "{0:>18}".format( FormatRate( r[ "stages" ][ stage ][ "framesPerSecond" ], \
+                None if previous is None else previous[ "stages" ][ stage ][ "framesPerSecond" ] ) )
+        print( line )
+
+
+def RunSyntheticBenchmarks( clipFolder, analyzerArgs, clipNames = None ):
+    if not os.path.exists( clipFolder ):
+        os.makedirs( clipFolder )
+    results = { "date": strftime( '%Y.%m.%d %H:%M:%S' ), "machine": platform.machine(), "processor": platform.processor(), \
+        "cpuCount": os.cpu_count(), "python": platform.python_version(), "numpy": numpy.__version__, \
+        "analyzerArgs": vars( analyzerArgs ), "clips": [] }
+    for clip in kSyntheticClips:
+        if not clipNames is None and len( set( clipNames ) & { clip.name, clip.FileName(), os.path.splitext( clip.FileName() )[ 0 ] } ) == 0:
+            continue
+        print( "Analyzing %s..." % clip.FileName() )
+        results[ "clips" ].append( Benchmark_SyntheticClip( clip, clip.Write( clipFolder ), analyzerArgs ) )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument( "videoFile", nargs = "?", default = None,
+        help = "path to the video file used for the iterator benchmarks. Without it, the synthetic clips are analyzed" )
+    parser.add_argument( "--frameSkip", type = int, nargs = "+", default = [ 8, 16, 30 ],
+        help = "frame skip counts to benchmark. Default: %(default)s" )
+    parser.add_argument( "--clipFolder", type = str, default = os.path.join( tempfile.gettempdir(), "rocBenchmarkClips" ),
+        help = "folder the synthetic clips are written to, and reused from. Default: %(default)s" )
+    parser.add_argument( "--clips", type = str, nargs = "+", default = None,
+        help = "synthetic clips to analyze, by name (e.g. sparse) or file name. Default: all" )
+    parser.add_argument( "--jsonOutput", type = str, default = None,
+        help = "file the synthetic benchmark results are saved to, as JSON. Default: standard output" )
+    parser.add_argument( "--compare", type = str, default = None,
+        help = "JSON results of a previous run, to print the speedups against" )
+    parser.add_argument( "--videoDecoder", choices = [ videoAnalyzeRateOfChange.kVideoDecoderImageIO, videoAnalyzeRateOfChange.kVideoDecoderFFmpegPipe ],
+        default = videoAnalyzeRateOfChange.kVideoDecoderImageIO, help = "video decoding backend. Default: %(default)s" )
+    parser.add_argument( "--skipPolicy", choices = [ videoAnalyzeRateOfChange.kSkipPolicyFixed, videoAnalyzeRateOfChange.kSkipPolicyAdaptive ],
+        default = videoAnalyzeRateOfChange.kSkipPolicyFixed, help = "how frames are skipped while nothing triggers. Default: %(default)s" )
+    parser.add_argument( "--encoderQueueFrames", type = int, default = 0,
+        help = "output frames waiting to be encoded on a separate thread. Default: %(default)s, so that encoding is measured" )
+
+    args = parser.parse_args()
+
+    if not args.videoFile is None:
+        for frameSkip in args.frameSkip:
+            RunSkipBenchmarks( args.videoFile, frameSkip )
+        sys.exit( 0 )
+
+    analyzerArgs = argparse.Namespace( videoDecoder = args.videoDecoder, skipPolicy = args.skipPolicy, \
+        encoderQueueFrames = args.encoderQueueFrames, verboseRunningTime = False )
+    results = RunSyntheticBenchmarks( args.clipFolder, analyzerArgs, args.clips )
+    previousResults = None
+    if not args.compare is None:
+        with open( args.compare ) as f:
+            previousResults = json.load( f )
+    PrintSyntheticBenchmarkResults( results, previousResults )
+    if args.jsonOutput is None:
+        print( json.dumps( results, indent = 2 ) )
+    else:
+        with open( args.jsonOutput, 'w' ) as f:
+            json.dump( results, f, indent = 2 )
@@ -7,12 +7,23 @@
 #      16.01.2022 voicua: Created "analyzeVideoUnitTest.py" to test algorithms used in the analyzeVideo script.
 
 import os
+import sys
+import json
+import pstats
 import argparse
+import tempfile
+import threading
+import tracemalloc
+from time import perf_counter
 
 import numpy
+import psutil
+import ffmpeg
 
 import videoAnalyzeRateOfChange
 import videoAnalysisHelpers
+import audioAnalyze
+import processVideos
 
 
 unitTestDataPath = "../UnitTestData/"
@@ -38,7 +49,801 @@ def Test_CalculateDifferenceCoefficient( stats ):
     newFrame = numpy.array( [[0, 0, 0, 0], [0, 0, 60, 0], [0, 0, 0, 0], [0, 0, 0, 0]], dtype=numpy.int16 )
     expectedResult = 2
     Call_CalculateDifferenceCoefficient( baseFrame, newFrame, expectedResult, stats )
-    
+
+
+def Test_CalculateTileDifferenceCoefficients( stats ):
+    PrintTitle( "Running test for the tile difference coefficients" )
+
+    # 3 columns x 2 rows of tiles on a 5x7 frame: the last row and column of tiles take the remaining pixels
+    baseFrame = numpy.zeros( (5, 7), dtype=numpy.int16 )
+    newFrame = numpy.zeros( (5, 7), dtype=numpy.int16 )
+    newFrame[ 0, 0 ] = 255
+    newFrame[ 1, 5 ] = 255
+    newFrame[ 4, 6 ] = 255
+    newFrame[ 4, 3 ] = 255
+    tileCoefficients = numpy.zeros( (2, 3), numpy.int32 )
+    expectedTiles = numpy.array( [[1, 0, 1], [0, 1, 1]], numpy.int32 )
+
+    res = videoAnalyzeRateOfChange.CalculateDifferenceCoefficient( baseFrame, newFrame, tileCoefficients )
+    print( "Tile Difference Coefficients Obtained = " + str( tileCoefficients.tolist() ) )
+    if res != 4 or not numpy.array_equal( tileCoefficients, expectedTiles ):
+        stats.numErrors += 1
+        print( "         Error! Expected result was: " + str( expectedTiles.tolist() ) )
+
+    # A local change triggers on its tile only
+    previousTiles = numpy.full( (4, 4), 100, numpy.int32 )
+    newTiles = previousTiles.copy()
+    newTiles[ 2, 1 ] += 400
+    if videoAnalyzeRateOfChange.MotionDerivativeDetected( 1600, 2000 ) or \
+            not videoAnalyzeRateOfChange.MotionDerivativeDetected( 1600, 2000, videoAnalyzeRateOfChange.kMinChange, previousTiles, newTiles ):
+        stats.numErrors += 1
+        print( "         Error! Local motion should only trigger with tile coefficients" )
+
+
+def Test_ScreeningCandidateDetected( stats ):
+    PrintTitle( "Running test for the coarse screening" )
+
+    # A 60x60 object appearing on a 480x640 frame: the full resolution test triggers, so the screening must flag a candidate
+    baseFrame = numpy.zeros( (480, 640), dtype=numpy.int16 )
+    newFrame = baseFrame.copy()
+    newFrame[ 200:260, 300:360 ] = 255
+    fullCoefficient = videoAnalyzeRateOfChange.CalculateDifferenceCoefficient( baseFrame, newFrame.copy() )
+    for screeningFactor in [ 4, 8 ]:
+        screeningCoefficient = videoAnalyzeRateOfChange.CalculateDifferenceCoefficient( \
+            baseFrame[ ::screeningFactor, ::screeningFactor ], newFrame[ ::screeningFactor, ::screeningFactor ].copy() )
+        print( "Factor %i: screening coefficient %i, full resolution coefficient %i" % (screeningFactor, screeningCoefficient, fullCoefficient) )
+        if not videoAnalyzeRateOfChange.MotionDerivativeDetected( 0, fullCoefficient ) or \
+                not videoAnalyzeRateOfChange.ScreeningCandidateDetected( 0, screeningCoefficient, videoAnalyzeRateOfChange.kMinChange, screeningFactor ):
+            stats.numErrors += 1
+            print( "         Error! The screening should flag the frame as a candidate" )
+
+    # Thresholds scale with the factor: a change of 40 pixels on a plane decimated by 8 stands for 2560 pixels,
+    # a change of 10 pixels (640) stays under kScreeningMargin * kMinChange
+    if not videoAnalyzeRateOfChange.ScreeningCandidateDetected( 100, 140, videoAnalyzeRateOfChange.kMinChange, 8 ) or \
+            videoAnalyzeRateOfChange.ScreeningCandidateDetected( 100, 110, videoAnalyzeRateOfChange.kMinChange, 8 ):
+        stats.numErrors += 1
+        print( "         Error! Screening thresholds do not scale with the factor" )
+
+
+# Frames filled with their index, for testing iterator wrappers
+class CountingVideoIterator:
+    def __init__( self, frameCount ):
+        self.frameCount = frameCount
+        self.currentIndex = 0
+        self.framesRead = 0
+
+    def ReadNextFrame( self ):
+        if self.currentIndex >= self.frameCount:
+            raise IndexError( "No more frames" )
+        self.currentIndex += 1
+        self.framesRead += 1
+        return numpy.full( (2, 2, 3), self.currentIndex - 1, numpy.uint8 )
+
+    def SkipFrames( self, count ):
+        self.currentIndex += count
+        return self.currentIndex
+
+    def CurrentIndex( self ):
+        return self.currentIndex
+
+    def CurrentLuminancePlane( self ):
+        return None
+
+    def ReusesFrameBuffers( self ):
+        return False
+
+    def Close( self ):
+        pass
+
+
+def Test_RewindingVideoIterator( stats ):
+    PrintTitle( "Running test for the rewinding video iterator" )
+
+    countingIter = CountingVideoIterator( 200 )
+    videoIter = videoAnalyzeRateOfChange.RewindingVideoIterator( countingIter, 16 )
+    videoIter.ReadNextFrame()
+    videoIter.SkipFrames( 10 )      # fits in the ring: decoded into it
+    videoIter.ReadNextFrame()
+    rewoundCount = videoIter.Rewind( 11 )
+    replayedFrames = [ int( videoIter.ReadNextFrame()[ 0, 0, 0 ] ) for i in range( 11 ) ]
+    videoIter.SkipFrames( 100 )     # does not fit: skipped by the wrapped iterator, the ring is emptied
+    landingFrame = int( videoIter.ReadNextFrame()[ 0, 0, 0 ] )
+    print( "Rewound %i frames, replayed %s, frames decoded: %i" % (rewoundCount, str( replayedFrames ), countingIter.framesRead) )
+    if rewoundCount != 11 or replayedFrames != list( range( 1, 12 ) ) or landingFrame != 112 or \
+            countingIter.framesRead != 13 or videoIter.Rewind( 5 ) != 1:
+        stats.numErrors += 1
+        print( "         Error! Unexpected frames returned by the rewinding iterator" )
+
+
+# Skipping lands on the exact frame in a variable frame rate stream (30 fps for a second, then 15 fps), where seeking to
+# the timestamp the average frame rate gives does not.
+def Test_VariableFrameRateSkip( stats ):
+    PrintTitle( "Running test for skipping frames in a variable frame rate video" )
+
+    kSkipCount = 60
+    with tempfile.TemporaryDirectory() as folder:
+        videoPathName = os.path.join( folder, "variableFrameRate.mp4" )
+        ffmpeg.input( "testsrc=size=160x120:rate=30", f = "lavfi", t = 4 ) \
+            .filter( "setpts", "if(lt(N,30),N,30+(N-30)*2)/(30*TB)" ).output( videoPathName, vsync = "vfr", g = 30 ).run( quiet = True )
+        videoMeta = videoAnalysisHelpers.VideoMetadata( videoAnalysisHelpers.ProbeVideoFile( videoPathName ) )
+
+        landingFrames = []
+        for (frameRate, minimumSeekSkip) in ((None, 1), (videoMeta.frameRate, 1), (None, kSkipCount + 1)):
+            videoIter = videoAnalyzeRateOfChange.FFmpegPipeVideoIterator( videoPathName, 160, 120, False, frameRate, minimumSeekSkip )
+            if minimumSeekSkip > kSkipCount:
+                for i in range( kSkipCount ):
+                    videoIter.ReadNextFrame()
+            else:
+                videoIter.SkipFrames( kSkipCount )
+            landingFrames.append( videoIter.ReadNextFrame().copy() )
+            videoIter.Close()
+        imageIOIter = videoAnalyzeRateOfChange.ImageIOVideoIterator( videoPathName )
+        imageIOIter.SkipFrames( kSkipCount )
+        imageIOLanding = imageIOIter.ReadNextFrame()
+        for i in range( 10 ):
+            imageIOIter.ReadNextFrame()
+        imageIOIter.Close()
+        imageIOIter = videoAnalyzeRateOfChange.ImageIOVideoIterator( videoPathName )
+        imageIOExpected = [ imageIOIter.ReadNextFrame() for i in range( kSkipCount + 1 ) ][ -1 ]
+        imageIOIter.Close()
+
+    discardLanded = numpy.array_equal( landingFrames[ 0 ], landingFrames[ 2 ] )
+    seekLanded = numpy.array_equal( landingFrames[ 1 ], landingFrames[ 2 ] )
+    imageIOLanded = numpy.array_equal( imageIOLanding, imageIOExpected )
+    print( "Frame rate %s real, %s average, constant: %s. Landed on frame %i: discarding %s, seeking %s, imageio %s" % \
+        (videoMeta.rFrameRateText, videoMeta.frameRateText, videoMeta.constantFrameRate, kSkipCount, discardLanded, seekLanded, imageIOLanded) )
+    if videoMeta.constantFrameRate or not discardLanded or seekLanded or not imageIOLanded:
+        stats.numErrors += 1
+        print( "         Error! Expected a variable frame rate, skipped exactly without a frame rate, and the average rate seek to miss" )
+
+
+# An exception in the frame loop stops the decoder process and the prefetching thread, and closing twice is harmless
+def Test_VideoIteratorClosedOnFailure( stats ):
+    PrintTitle( "Running test for closing the video iterator when the analysis fails" )
+
+    with tempfile.TemporaryDirectory() as folder:
+        videoPathName = os.path.join( folder, "testPattern.mp4" )
+        ffmpeg.input( "testsrc=size=160x120:rate=30", f = "lavfi", t = 2 ).output( videoPathName ).run( quiet = True )
+        args = argparse.Namespace( destFolder = folder, videoDecoder = videoAnalyzeRateOfChange.kVideoDecoderFFmpegPipe, \
+            prefetchFrames = 4, verboseRunningTime = False )
+        rocAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( args, "failing" )
+        threadsBefore = set( threading.enumerate() )
+
+        preparedFrames = []
+        prepareComparison = rocAnalyzer.PrepareComparison
+        def FailingPrepareComparison( frame, luminancePlane = None ):
+            preparedFrames.append( frame.shape )
+            if len( preparedFrames ) > 5:
+                raise RuntimeError( "Frame preparation failed" )
+            return prepareComparison( frame, luminancePlane )
+        rocAnalyzer.PrepareComparison = FailingPrepareComparison
+
+        try:
+            rocAnalyzer.AddVideoFileToAnalysis( videoPathName, videoAnalysisHelpers.Logger() )
+            stats.numErrors += 1
+            print( "         Error! The failure of the frame preparation was not raised" )
+        except RuntimeError as e:
+            print( "Analysis failed: %s" % e )
+        remainingProcesses = [ p.name() for p in psutil.Process().children() ]
+        remainingThreads = [ t.name for t in set( threading.enumerate() ) - threadsBefore if t.is_alive() ]
+
+        videoIter = videoAnalyzeRateOfChange.FFmpegPipeVideoIterator( videoPathName, 160, 120 )
+        videoIter.ReadNextFrame()
+        videoIter.Close()
+        videoIter.Close()
+
+    print( "Remaining decoder processes: %s, threads: %s" % (remainingProcesses, remainingThreads) )
+    if len( remainingProcesses ) != 0 or len( remainingThreads ) != 0:
+        stats.numErrors += 1
+        print( "         Error! The video iterator was not closed" )
+
+
+# Runs a skip policy over frameCount frames, where motion is detected from frame motionStart on, until the first trigger
+# is taken into account. Any frame can be stepped back to. Returns the triggering frame and the number of frames analyzed.
+def RunSkipPolicy( skipPolicy, frameCount, motionStart ):
+    currentIndex = 0
+    framesAnalyzed = 0
+    while currentIndex < frameCount:
+        frameIndex = skipPolicy.NextFrameIndex( currentIndex )
+        framesAnalyzed += 1
+        currentIndex = frameIndex + 1
+        if skipPolicy.OnFrameAnalyzed( frameIndex, frameIndex >= motionStart, 0 ) and frameIndex >= motionStart:
+            return (frameIndex, framesAnalyzed)
+    return (None, framesAnalyzed)
+
+def Test_SkipPolicies( stats ):
+    PrintTitle( "Running test for the frame skip policies" )
+
+    kMotionStart = 1000
+    for skipPolicy in [ videoAnalyzeRateOfChange.FixedStepSkipPolicy(), videoAnalyzeRateOfChange.AdaptiveSkipPolicy() ]:
+        (triggerIndex, framesAnalyzed) = RunSkipPolicy( skipPolicy, 2000, kMotionStart )
+        print( "%s skip policy: first trigger at frame %s, %i frames analyzed" % (skipPolicy.name, str( triggerIndex ), framesAnalyzed) )
+        if triggerIndex != kMotionStart or skipPolicy.frameSkip != 0:
+            stats.numErrors += 1
+            print( "         Error! The policy should step back to the first triggering frame, and stop skipping" )
+
+
+# Recorded signals replayed with the recorded thresholds trigger as the recorded analysis. With other thresholds,
+# frames compared to another base than recorded are reported as approximated.
+def Test_ReplayFrameSignals( stats ):
+    PrintTitle( "Running test for the replay of recorded frame signals" )
+
+    # motion at frame 100: 5000 pixels change by 40 against the frames before it. Frames are recorded and trigger
+    # as in an analysis without frame skipping. Small blocks, so the triggering frames end blocks.
+    signalBlockRows = videoAnalyzeRateOfChange.kSignalBlockRows
+    videoAnalyzeRateOfChange.kSignalBlockRows = 33
+    with tempfile.TemporaryDirectory() as folder:
+        recorder = videoAnalyzeRateOfChange.FrameSignalRecorder( os.path.join( folder, "test.signals.npy" ), 30.0 )
+        videoAnalyzeRateOfChange.kSignalBlockRows = signalBlockRows
+        difference = numpy.zeros( (100, 100), numpy.uint8 )
+        (baseIndex, baseCoefficient) = (1, -1)
+        for frameIndex in range( 2, 201 ):
+            difference[ :50, : ] = 40 if baseIndex < 100 and frameIndex >= 100 else 0
+            coefficient = numpy.count_nonzero( difference )
+            recorder.RecordFrame( frameIndex, baseIndex, baseCoefficient, frameIndex - 1, difference, coefficient )
+            if videoAnalyzeRateOfChange.MotionDerivativeDetected( baseCoefficient, coefficient ):
+                recorder.MarkTriggered()
+                (baseIndex, baseCoefficient) = (frameIndex, coefficient)
+        recorder.Close()
+        signals = numpy.load( recorder.signalPath )
+
+    recordedTriggers = signals[ 'frameIndex' ][ signals[ 'triggered' ] ].tolist()
+    print( "Recorded %i frames, triggers %s" % (len( signals ), str( recordedTriggers )) )
+    if len( signals ) != 199 or signals[ 'frameIndex' ][ -1 ] != 200 or recordedTriggers != [ 2, 100, 101 ]:
+        stats.numErrors += 1
+        print( "         Error! Expected 199 frames recorded, up to frame 200, triggers [2, 100, 101]" )
+
+    replays = [ (32, 1500, [ 2, 100, 101 ], 0), (48, 1500, [ 2 ], 100), (32, 6000, [ 2 ], 100) ]
+    for (luminanceThreshold, minChange, expectedTriggers, expectedApproximations) in replays:
+        skipPolicy = videoAnalyzeRateOfChange.FixedStepSkipPolicy()
+        skipPolicy.kMaxFrameSkip = 0
+        (triggeredFrames, approximatedFrames, analysisAborted) = videoAnalyzeRateOfChange.ReplayFrameSignals( signals, \
+            skipPolicy, minChange, luminanceThreshold )
+        print( "Luminance threshold %i, min change %i: triggers %s, %i frames approximated" \
+            % (luminanceThreshold, minChange, str( triggeredFrames ), approximatedFrames) )
+        if triggeredFrames != expectedTriggers or approximatedFrames != expectedApproximations or analysisAborted:
+            stats.numErrors += 1
+            print( "         Error! Expected triggers %s, %i frames approximated" % (str( expectedTriggers ), expectedApproximations) )
+
+
+# The analysis of a frame (luminance plane, difference with the base, count of changed pixels) must not allocate
+# any plane once the buffers are in place.
+def Test_AnalysisAllocations( stats ):
+    PrintTitle( "Running test for the allocations of the frame analysis" )
+
+    randomGenerator = numpy.random.default_rng( 2022 )
+    frames = [ randomGenerator.integers( 0, 256, (1080, 1920, 3), dtype = numpy.uint8 ) for i in range( 3 ) ]
+    analyzerArgs = argparse.Namespace( destFolder = ".", luminanceMethod = videoAnalyzeRateOfChange.kLuminanceMethodFixedPoint )
+    rocAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( analyzerArgs, "allocations" )
+    tracker = videoAnalysisHelpers.AllocationTracker()
+
+    def AnalyzeFrames( frameCount ):
+        for i in range( frameCount ):
+            comparison = rocAnalyzer.PrepareComparison( frames[ i % len( frames ) ] )
+            if rocAnalyzer.baseOfComparison is None or i % 2 == 0:
+                rocAnalyzer.baseOfComparison = comparison    # a trigger: the comparison buffers alternate
+            else:
+                videoAnalyzeRateOfChange.CalculateDifferenceCoefficient( rocAnalyzer.baseOfComparison, comparison, \
+                    None, rocAnalyzer.differenceScratch )
+
+    AnalyzeFrames( 4 )  # the buffers are allocated by the first frames
+    tracker.StartTracking()
+    AnalyzeFrames( 20 )
+    tracker.TakeSnapshot()
+    tracemalloc.stop()
+    tracker.PrintStats()
+
+    # a 1080p plane is 2 MiB; only small objects (array views, scalars) may be allocated per frame
+    if tracker.allocated > 4096 or tracker.peak > 64 * 1024:
+        stats.numErrors += 1
+        print( "         Error! The frame analysis allocates memory" )
+        videoAnalysisHelpers.TraceMallocSnapshot()
+
+
+# The highlight must only touch the changed pixels, for any opacity, and the same renderer must handle frames
+# of different resolutions.
+def Test_DiffOverlayRenderer( stats ):
+    PrintTitle( "Running test for the diff overlay renderer" )
+
+    opaqueRenderer = videoAnalyzeRateOfChange.DiffOverlayRenderer()
+    blendingRenderer = videoAnalyzeRateOfChange.DiffOverlayRenderer( (255, 0, 0), 128 )
+    for shape in [ (120, 160, 3), (48, 64, 3), (120, 160, 3) ]:
+        changedPixels = numpy.zeros( shape[ :2 ], bool )
+        changedPixels[ 10:20, 5:30 ] = True
+        frame = numpy.full( shape, 100, numpy.uint8 )
+
+        opaqueFrame = opaqueRenderer.Render( frame.copy(), changedPixels )
+        blendedFrame = blendingRenderer.Render( frame.copy(), changedPixels )
+        onlyDiffsFrame = opaqueRenderer.Render( frame.copy(), changedPixels, True )
+        print( "%s: opaque %s, blended %s" % (str( shape[ :2 ] ), str( opaqueFrame[ 10, 5 ] ), str( blendedFrame[ 10, 5 ] )) )
+
+        if not numpy.array_equal( opaqueFrame[ changedPixels ], numpy.tile( [ 255, 0, 0 ], (250, 1) ) ) or \
+           not numpy.array_equal( blendedFrame[ changedPixels ], numpy.tile( [ 178, 50, 50 ], (250, 1) ) ) or \
+           not numpy.all( onlyDiffsFrame[ changedPixels ] == opaqueFrame[ changedPixels ] ):
+            stats.numErrors += 1
+            print( "         Error! The changed pixels are not highlighted correctly" )
+        if numpy.any( opaqueFrame[ ~changedPixels ] != 100 ) or numpy.any( blendedFrame[ ~changedPixels ] != 100 ) or \
+           numpy.any( onlyDiffsFrame[ ~changedPixels ] != 0 ):
+            stats.numErrors += 1
+            print( "         Error! The unchanged pixels were modified" )
+
+
+# Closing the encoder writes all the pending output, cancelling it drops the frames still queued.
+# Errors of the encoder thread are raised to the analysis.
+def Test_AsyncFrameEncoder( stats ):
+    PrintTitle( "Running test for the asynchronous frame encoder" )
+
+    frame = numpy.full( (48, 64, 3), 100, numpy.uint8 )
+    with tempfile.TemporaryDirectory() as folder:
+        imagePaths = [ os.path.join( folder, "closed_%i.png" % i ) for i in range( 5 ) ]
+        encoder = videoAnalyzeRateOfChange.AsyncFrameEncoder( 2 )
+        for imagePath in imagePaths:
+            encoder.WriteImage( imagePath, frame )
+        encoder.Close()
+        writtenCount = len( [ p for p in imagePaths if os.path.isfile( p ) ] )
+        print( "Closed encoder: %i of %i images written" % (writtenCount, len( imagePaths )) )
+        if writtenCount != len( imagePaths ):
+            stats.numErrors += 1
+            print( "         Error! Closing the encoder must write all pending frames" )
+
+        # the encoder thread is held until the encoder is cancelled, with frames still queued
+        encoderGate = threading.Event()
+        encoder = videoAnalyzeRateOfChange.AsyncFrameEncoder( 4 )
+        encoder.Submit( encoderGate.wait )
+        imagePaths = [ os.path.join( folder, "cancelled_%i.png" % i ) for i in range( 3 ) ]
+        for imagePath in imagePaths:
+            encoder.WriteImage( imagePath, frame )
+        threading.Timer( 0.1, encoderGate.set ).start()
+        encoder.Cancel()
+        writtenCount = len( [ p for p in imagePaths if os.path.isfile( p ) ] )
+        print( "Cancelled encoder: %i of %i images written" % (writtenCount, len( imagePaths )) )
+        if writtenCount != 0:
+            stats.numErrors += 1
+            print( "         Error! Cancelling the encoder must drop the pending frames" )
+
+        encoder = videoAnalyzeRateOfChange.AsyncFrameEncoder( 2 )
+        encoder.WriteImage( os.path.join( folder, "missingFolder", "frame.png" ), frame )
+        try:
+            encoder.Close()
+            stats.numErrors += 1
+            print( "         Error! The failure of the encoder thread was not reported" )
+        except Exception as e:
+            print( "Encoder error reported: %s" % type( e ).__name__ )
+
+
+# The number of slots of the spool follows the frame shape (half of them in each bank), frames are read back unchanged,
+# and a spool emptied by an aborted analysis can take frames of another shape.
+def Test_MappedFrameSpool( stats ):
+    PrintTitle( "Running test for the memory-mapped frame spool" )
+
+    randomGenerator = numpy.random.default_rng( 2022 )
+    with tempfile.TemporaryDirectory() as folder:
+        frameSpool = videoAnalyzeRateOfChange.MappedFrameSpool( 10 * 48 * 64 * 3, folder )
+        for shape in [ (48, 64, 3), (96, 128, 3) ]:
+            frames = []
+            while not frameSpool.Full():
+                frames.append( randomGenerator.integers( 0, 256, shape, dtype = numpy.uint8 ) )
+                frameSpool.Append( 100 + len( frames ), frames[ -1 ] )
+            spooledFrames = frameSpool.Frames()
+            print( "%s frames: %i slots" % (str( shape[ :2 ] ), len( spooledFrames )) )
+            if len( spooledFrames ) != 10 * 48 * 64 * 3 // frames[ 0 ].nbytes // 2 or \
+               [ frameIndex for (frameIndex, frame) in spooledFrames ] != list( range( 101, 101 + len( frames ) ) ) or \
+               not all( numpy.array_equal( frame, frames[ i ] ) for (i, (frameIndex, frame)) in enumerate( spooledFrames ) ):
+                stats.numErrors += 1
+                print( "         Error! The spooled frames do not match the frames appended" )
+            frameSpool.Clear()
+        frameSpool.Close()
+
+
+# While the encoder is held, the analysis goes on detecting frames into the other bank of the spool, and only waits
+# when it comes back to the bank of the frames being encoded. The output gets all the frames.
+def Test_FrameSpoolEncoderOverlap( stats ):
+    PrintTitle( "Running test for the overlap of the frame spool and the encoder" )
+
+    frames = [ numpy.full( (128, 256, 3), i, numpy.uint8 ) for i in range( 60 ) ]
+    with tempfile.TemporaryDirectory() as folder:
+        args = argparse.Namespace( destFolder = folder, frameSpoolBudget = 1, verboseRunningTime = False )
+        rocAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( args, "overlap" )
+        rocAnalyzer.sourceName = "overlap.mp4"
+        rocAnalyzer.frameEncoder = videoAnalyzeRateOfChange.AsyncFrameEncoder( len( frames ) + 1 )
+        encoderGate = threading.Event()
+        encodedFrames = []
+        writeVideoFrame = rocAnalyzer.frameEncoder.WriteVideoFrame
+        def HeldWriteVideoFrame( frame ):
+            encoderGate.wait()
+            encodedFrames.append( int( videoAnalyzeRateOfChange.DecodeFrame( frame )[ 0, 0, 0 ] ) )
+            writeVideoFrame( frame )
+        rocAnalyzer.frameEncoder.WriteVideoFrame = HeldWriteVideoFrame
+
+        detectedCount = [ 0 ]
+        def DetectFrames():
+            for (i, frame) in enumerate( frames ):
+                rocAnalyzer.BufferDetectedFrame( i + 1, frame, 1000, i / 30.0 )
+                detectedCount[ 0 ] = i + 1
+        analysisThread = threading.Thread( target = DetectFrames )
+        analysisThread.start()
+        analysisThread.join( 1.0 )
+        heldCount = detectedCount[ 0 ]
+        bankSize = rocAnalyzer.frameSpool.bankSlotCount
+        encoderGate.set()
+        analysisThread.join()
+        rocAnalyzer.FlushVideoData()
+        rocAnalyzer.FinishAnalysis()
+
+    print( "Frames detected while the encoder was held: %i (banks of %i frames), frames encoded: %i" % \
+        (heldCount, bankSize, len( encodedFrames )) )
+    if heldCount != 30 + bankSize or encodedFrames != list( range( len( frames ) ) ):
+        stats.numErrors += 1
+        print( "         Error! Expected the analysis to fill one more bank while 30 frames were encoded, and all frames in order" )
+
+
+# Compressed frames decode to the frames appended, in any order, also after the spool is cleared
+def Test_CompressedFrameSpool( stats ):
+    PrintTitle( "Running test for the compressed frame spool" )
+
+    randomGenerator = numpy.random.default_rng( 2022 )
+    background = randomGenerator.integers( 0, 256, (120, 160, 3), dtype = numpy.uint8 )
+    frames = []
+    for i in range( 6 ):
+        frames.append( background.copy() )
+        frames[ -1 ][ 10 * i:10 * i + 20, 20:60 ] = 255 - frames[ -1 ][ 10 * i:10 * i + 20, 20:60 ]
+
+    frameSpool = videoAnalyzeRateOfChange.CompressedFrameSpool( 1024 * 1024 )
+    spooledFrames = []
+    for i in range( len( frames ) ):
+        frameSpool.Append( i, frames[ i ] )
+        if i == 2:
+            spooledFrames += frameSpool.Frames()
+            frameSpool.Clear()
+    spooledFrames += frameSpool.Frames()
+    print( "Compressed frame size: %i bytes, %i bytes raw" % (frameSpool.spooledBytes / 3, frames[ 0 ].nbytes) )
+
+    decodingOrder = [ 4, 0, 1, 2, 5, 3, 3 ]
+    if not all( numpy.array_equal( videoAnalyzeRateOfChange.DecodeFrame( spooledFrames[ i ][ 1 ] ), frames[ i ] ) for i in decodingOrder ):
+        stats.numErrors += 1
+        print( "         Error! The decoded frames do not match the frames appended" )
+
+
+def Test_DetectionIndex( stats ):
+    PrintTitle( "Running test for the detection index" )
+
+    with tempfile.TemporaryDirectory() as folder:
+        analyzerArgs = argparse.Namespace( destFolder = folder )
+        frameRate = 30.0
+
+        # a range analysis spools its frames, which are added to the session output from frame 11
+        rangeAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( analyzerArgs, "range" )
+        rangeAnalyzer.outputSpoolPath = os.path.join( folder, "range.spool" )
+        rangeAnalyzer.sourceName = "copy.mp4"
+        for i in range( 12 ):
+            frameIndex = 5 * i + 1
+            rangeAnalyzer.BufferDetectedFrame( frameIndex, numpy.full( (48, 64, 3), 10 * i, numpy.uint8 ), 1000 + i, \
+                (frameIndex - 1) / frameRate )
+        rangeAnalyzer.FlushVideoData()
+        rangeAnalyzer.FinishAnalysis()
+
+        rocAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( analyzerArgs, "session" )
+        rocAnalyzer.AddSpooledFrames( rangeAnalyzer.outputSpoolPath, 11, "source.mp4" )
+        rocAnalyzer.FinishAnalysis()
+
+        indexPath = os.path.join( folder, "session" + videoAnalyzeRateOfChange.kDetectionIndexSuffix )
+        if not os.path.isfile( indexPath ) or os.path.isfile( os.path.join( folder, "range" + videoAnalyzeRateOfChange.kDetectionIndexSuffix ) ):
+            stats.numErrors += 1
+            print( "         Error! The index must be saved for the session output only" )
+            return
+        index = videoAnalyzeRateOfChange.LoadDetectionIndex( indexPath )
+        print( "Index rows: %i, output frames: %s" % (len( index ), index[ 'outputFrame' ].tolist()) )
+        expectedFrames = [ 5 * i + 1 for i in range( 2, 12 ) ]
+        if index[ 'frameIndex' ].tolist() != expectedFrames or index[ 'outputFrame' ].tolist() != list( range( 10 ) ) or \
+                index[ 'diffCoefficient' ].tolist() != list( range( 1002, 1012 ) ) or \
+                not numpy.allclose( index[ 'timestamp' ], (numpy.array( expectedFrames ) - 1) / frameRate ) or \
+                any( n != b"source.mp4" for n in index[ 'sourceFile' ] ):
+            stats.numErrors += 1
+            print( "         Error! The index does not match the frames output" )
+        del index
+
+
+def Test_FileFingerprint( stats ):
+    PrintTitle( "Running test for the file fingerprint" )
+
+    randomGenerator = numpy.random.default_rng( 2022 )
+    content = randomGenerator.integers( 0, 256, 4 * 1024 * 1024, dtype = numpy.uint8 ).tobytes()
+    with tempfile.TemporaryDirectory() as folder:
+        filePaths = [ os.path.join( folder, name ) for name in ("original.mp4", "renamed.mp4", "changed.mp4", "longer.mp4") ]
+        changedContent = bytearray( content )
+        changedContent[ -1 ] ^= 1
+        for (filePath, fileContent) in zip( filePaths, (content, content, changedContent, content + b"\0") ):
+            with open( filePath, 'wb' ) as f:
+                f.write( fileContent )
+        fingerprints = [ videoAnalysisHelpers.GetFileFingerprint( filePath ) for filePath in filePaths ]
+
+    print( "Fingerprints: %s" % ", ".join( fingerprints ) )
+    if fingerprints[ 0 ] != fingerprints[ 1 ] or len( set( fingerprints ) ) != 3:
+        stats.numErrors += 1
+        print( "         Error! Fingerprints must depend on the content and size of the files only" )
+
+
+# A file analyzed with some arguments and constants is found in the cache only with the same ones
+def Test_AnalysisCache( stats ):
+    PrintTitle( "Running test for the analysis cache" )
+
+    with tempfile.TemporaryDirectory() as folder:
+        filePath = os.path.join( folder, "test.mp4" )
+        with open( filePath, 'wb' ) as f:
+            f.write( b"\1" * 1000 )
+        args = argparse.Namespace( highlightDiffs = False, onlyDiffs = False )
+        analysisCache = processVideos.AnalysisCache( folder, args )
+        analysisCache.AddResult( (filePath, 0, 1000), False )
+        analysisCache.Commit( None )
+        analysisCache.Close()
+
+        statuses = []
+        minChange = videoAnalyzeRateOfChange.kMinChange
+        for (highlightDiffs, minChangeOffset) in ((False, 0), (True, 0), (False, 100)):
+            videoAnalyzeRateOfChange.kMinChange = minChange + minChangeOffset
+            analysisCache = processVideos.AnalysisCache( folder, argparse.Namespace( highlightDiffs = highlightDiffs, onlyDiffs = False ) )
+            statuses.append( analysisCache.GetStatus( filePath ) )
+            analysisCache.Close()
+        videoAnalyzeRateOfChange.kMinChange = minChange
+
+        # an unchanged file is not read again, a renamed one is
+        fingerprintCounter = [ 0 ]
+        getFileFingerprint = videoAnalysisHelpers.GetFileFingerprint
+        def CountingGetFileFingerprint( filePath ):
+            fingerprintCounter[ 0 ] += 1
+            return getFileFingerprint( filePath )
+        videoAnalysisHelpers.GetFileFingerprint = CountingGetFileFingerprint
+        try:
+            analysisCache = processVideos.AnalysisCache( folder, args )
+            statuses.append( analysisCache.GetStatus( filePath ) )
+            analysisCache.Close()
+            os.rename( filePath, filePath + ".renamed.mp4" )
+            analysisCache = processVideos.AnalysisCache( folder, args )
+            statuses.append( analysisCache.GetStatus( filePath + ".renamed.mp4" ) )
+            analysisCache.Close()
+        finally:
+            videoAnalysisHelpers.GetFileFingerprint = getFileFingerprint
+
+    print( "Cached status: %s, with highlighted differences: %s, with another minimum change: %s" % tuple( statuses[ 0:3 ] ) )
+    print( "Cached status unchanged: %s, renamed: %s, files read: %i" % (statuses[ 3 ], statuses[ 4 ], fingerprintCounter[ 0 ]) )
+    if statuses[ 0:3 ] != [ "analyzed", None, None ]:
+        stats.numErrors += 1
+        print( "         Error! Changing an argument or a constant of the analysis must invalidate the cached result" )
+    if statuses[ 3: ] != [ "analyzed", "analyzed" ] or fingerprintCounter[ 0 ] != 1:
+        stats.numErrors += 1
+        print( "         Error! Only the renamed file must be read, and found by its fingerprint" )
+
+
+def Test_JobMetrics( stats ):
+    PrintTitle( "Running test for the job metrics export" )
+
+    # two files, analyzed in ranges: the range latencies add up, and survive the perf counters reset
+    fileResults = []
+    for durations in ([ 0.001, 0.002, 0.5 ], [ 0.002, 30.0 ]):
+        algPerformanceResults = videoAnalyzeRateOfChange.AlgorithmPerformanceResults()
+        rangePerformanceResults = videoAnalyzeRateOfChange.AlgorithmPerformanceResults()
+        rangePerformanceResults.totalFramesProcessed = len( durations )
+        for d in durations:
+            rangePerformanceResults.stageLatencies[ "roc" ].Observe( d )
+        rangePerformanceResults.ResetPerfCounters()
+        videoAnalyzeRateOfChange.RateOfChangeAnalyzer.AddRangePerformanceResults( None, algPerformanceResults, rangePerformanceResults )
+        fileResults.append( algPerformanceResults )
+
+    with tempfile.TemporaryDirectory() as folder:
+        jobMetrics = videoAnalysisHelpers.JobMetrics( folder )
+        for algPerformanceResults in fileResults:
+            jobMetrics.AddCounter( "frames_processed_total", algPerformanceResults.totalFramesProcessed )
+            jobMetrics.MergeStageLatencies( algPerformanceResults.stageLatencies )
+            jobMetrics.Export( dict( event = "file" ) )
+        with open( jobMetrics.jsonLinesPath ) as f:
+            records = [ json.loads( line ) for line in f ]
+        with open( jobMetrics.prometheusPath ) as f:
+            prometheusLines = f.read().splitlines()
+
+    rocLatencies = jobMetrics.stageLatencies[ "roc" ]
+    print( "roc stage: %i tasks, %.3f s, p50 %s s, p99 %s s" % \
+        (rocLatencies.count, rocLatencies.sum, rocLatencies.Quantile( 0.5 ), rocLatencies.Quantile( 0.99 )) )
+    expectedLines = [ "roc_frames_processed_total 5", 'roc_stage_latency_seconds_count{stage="roc"} 5', \
+        'roc_stage_latency_seconds_bucket{stage="roc",le="0.00256"} 3', 'roc_stage_latency_seconds_bucket{stage="roc",le="+Inf"} 5' ]
+    if rocLatencies.count != 5 or abs( rocLatencies.sum - 30.505 ) > 1e-9 or rocLatencies.Quantile( 0.5 ) != 0.00256 or \
+            len( records ) != 2 or any( not l in prometheusLines for l in expectedLines ):
+        stats.numErrors += 1
+        print( "         Error! Expected 5 roc tasks, median bucket 0.00256 s, 2 JSON lines and: %s" % ", ".join( expectedLines ) )
+
+
+def Test_VideoMetadataStore( stats ):
+    PrintTitle( "Running test for the video metadata store" )
+
+    # audio stream first, no frame count in the container index
+    probeResult = { "streams": [ { "codec_type": "audio", "duration": "10.000000" }, \
+        { "codec_type": "video", "width": 1920, "height": 1080, "avg_frame_rate": "30000/1001", "duration": "10.010000", \
+            "nb_read_packets": "300", "tags": { "creation_time": "2022-01-16T10:20:30.000000Z" } } ], \
+        "format": { "duration": "10.010000" } }
+    videoMeta = videoAnalysisHelpers.VideoMetadata( probeResult )
+    print( "Metadata: %ix%i, %.3f fps, %.2f s, %i frames, created %s" % (videoMeta.width, videoMeta.height, videoMeta.frameRate, \
+        videoMeta.duration, videoMeta.frameCount, videoMeta.creationTime) )
+    if (videoMeta.width, videoMeta.height, videoMeta.frameCount, videoMeta.creationTime) != (1920, 1080, 300, 1642328430) or \
+            abs( videoMeta.frameRate - 29.97 ) > 0.001 or videoMeta.duration != 10.01:
+        stats.numErrors += 1
+        print( "         Error! Expected 1920x1080, 29.970 fps, 10.01 s, 300 frames, created 1642328430" )
+
+    # entries are found again by the same path, size and modification time only
+    with tempfile.TemporaryDirectory() as folder:
+        storePath = os.path.join( folder, videoAnalysisHelpers.kVideoMetadataFileName )
+        filePath = os.path.join( folder, "test.mp4" )
+        with open( filePath, 'wb' ) as f:
+            f.write( b"\0" * 1000 )
+        metadataStore = videoAnalysisHelpers.VideoMetadataStore( storePath )
+        metadataStore.Add( filePath, videoMeta )
+        metadataStore.Close()
+
+        metadataStore = videoAnalysisHelpers.VideoMetadataStore( storePath )
+        found = [ not metadataStore.Lookup( filePath ) is None ]
+        os.utime( filePath, (0, 0) )
+        found.append( not metadataStore.Lookup( filePath ) is None )
+        failures = metadataStore.ProbeAll( [ os.path.join( folder, "missing.mp4" ) ] )
+        metadataStore.Close()
+
+    print( "Found after reopening: %s, after a change: %s, probing failures: %i" % (found[ 0 ], found[ 1 ], len( failures )) )
+    if found != [ True, False ] or len( failures ) != 1:
+        stats.numErrors += 1
+        print( "         Error! Expected the entry to be found only before the file changed, and the missing file to fail" )
+
+
+# A parallel job whose source file cannot be copied returns an aborted result, with its log, instead of raising
+def Test_FailedVideoFileJob( stats ):
+    PrintTitle( "Running test for a failed parallel analysis job" )
+
+    with tempfile.TemporaryDirectory() as folder:
+        args = argparse.Namespace( destFolder = folder, verboseRunningTime = False )
+        try:
+            result = processVideos.AnalyzeVideoFileJob( ("missing.mp4", 0, 1000), args )
+        except Exception as e:
+            stats.numErrors += 1
+            print( "         Error! The job raised %s" % type( e ).__name__ )
+            return
+        logWritten = os.path.isfile( os.path.join( folder, "missing.mp4.txt" ) )
+
+    print( "Aborted: %s, spool: %s, log written: %s" % (result.algPerformanceResults.analysisAborted, result.spoolPath, logWritten) )
+    if not result.algPerformanceResults.analysisAborted or not result.spoolPath is None or not logWritten:
+        stats.numErrors += 1
+        print( "         Error! Expected an aborted result without spooled frames, and the log of the file" )
+
+
+class LeakedFrame:
+    def __init__( self ):
+        self.pixels = numpy.zeros( (64, 64), numpy.uint8 )
+
+def Test_AnalysisProfiler( stats ):
+    PrintTitle( "Running test for the analysis profiler" )
+
+    leakedFrames = []
+    with tempfile.TemporaryDirectory() as folder:
+        profiler = videoAnalysisHelpers.AnalysisProfiler( sampleInterval = 0 )
+        profiler.StartFile( os.path.join( folder, "test.mp4" ), "test.mp4" )
+        profiler.EnableCpuProfile()
+        for i in range( 3 ):
+            leakedFrames += [ LeakedFrame() for j in range( 100 ) ]
+            profiler.Sample( "step %i" % i )
+        profiler.DisableCpuProfile()
+        profiler.FinishFile()
+        profiler.Close()
+        with open( os.path.join( folder, "test.mp4" + videoAnalysisHelpers.kProfileReportSuffix ) ) as f:
+            report = f.read()
+        profiledFunctions = [ function[ 2 ] for function in \
+            pstats.Stats( os.path.join( folder, "test.mp4" + videoAnalysisHelpers.kProfileStatsSuffix ) ).stats ]
+
+    leakLine = "analyzeVideoUnitTest.py:%i" % (LeakedFrame.__init__.__code__.co_firstlineno + 1)
+    objectGrowth = report[ report.index( "Object count growth over the file" ) : ].splitlines()[ 1 ]
+    print( "Memory samples: %i, first object count growth: %s" % (report.count( "Memory sample at" ), " ".join( objectGrowth.split() )) )
+    if report.count( "Memory sample at" ) != 3 or not leakLine in report or not "LeakedFrame" in objectGrowth or \
+            not "300" in objectGrowth or not "__init__" in profiledFunctions:
+        stats.numErrors += 1
+        print( "         Error! Expected 3 memory samples, with %s, 300 LeakedFrame objects, and a profile of LeakedFrame.__init__" % leakLine )
+
+
+def Test_SpectrogramAnalyzer( stats ):
+    PrintTitle( "Running test for the streaming spectrogram" )
+
+    # noise, a 3 kHz tone from 5 s to 12 s, and a 21 kHz burst from 14 s to 16 s. A 21 ms burst at 21 kHz is centered
+    # on the boundary of two windows, where only the window overlapping them both sees it.
+    sampleRate = audioAnalyze.kSpectrogramSampleRate
+    randomGenerator = numpy.random.default_rng( 2022 )
+    t = numpy.arange( 20 * sampleRate ) / float( sampleRate )
+    samples = randomGenerator.normal( 0, 300, len( t ) )
+    samples += 3000 * numpy.sin( 2 * numpy.pi * 3000 * t ) * ((t >= 5) & (t < 12))
+    samples += 8000 * numpy.sin( 2 * numpy.pi * 21000 * t ) * ((t >= 14) & (t < 16))
+    shortBurstStart = 200 * audioAnalyze.kSpectrogramWindow - 512
+    samples[ shortBurstStart:shortBurstStart + 1024 ] += 4000 * numpy.sin( 2 * numpy.pi * 21000 * t[ :1024 ] )
+    samples = samples.astype( numpy.int16 )
+
+    with tempfile.TemporaryDirectory() as folder:
+        spectrogramAnalyzer = audioAnalyze.SpectrogramAnalyzer( os.path.join( folder, "test" ) )
+        for i in range( 0, len( samples ), 12345 ):
+            spectrogramAnalyzer.ProcessSamples( samples[ i:i + 12345 ] )
+        spectrogramAnalyzer.Finish()
+        spectrogram = numpy.load( os.path.join( folder, "test" + audioAnalyze.kSpectrogramSuffix ), mmap_mode = 'r' )
+        bands = numpy.load( os.path.join( folder, "test" + audioAnalyze.kAudioBandsSuffix ), mmap_mode = 'r' )
+        (spectrogramShape, bandsShape) = (spectrogram.shape, bands.shape)
+        del spectrogram, bands
+
+    events = spectrogramAnalyzer.events
+    print( "Spectrogram: %s, bands: %s" % (spectrogramShape, bandsShape) )
+    print( "Narrowband events: %s" % [ (round( e[ 0 ], 1 ), round( e[ 1 ], 1 ), e[ 2 ]) for e in events[ "narrowband" ] ] )
+    print( "Ultrasonic events: %s" % [ (round( e[ 0 ], 1 ), round( e[ 1 ], 1 )) for e in events[ "ultrasonic" ] ] )
+    windowCount = (len( samples ) - audioAnalyze.kSpectrogramWindow) // audioAnalyze.kSpectrogramHop + 1
+    if spectrogramShape != (windowCount, audioAnalyze.kSpectrogramBins) or bandsShape != (windowCount, len( audioAnalyze.kAudioBands )):
+        stats.numErrors += 1
+        print( "         Error! The saved arrays must have a row per window" )
+    def Matches( event, start, end, frequency ):
+        return abs( event[ 0 ] - start ) < 0.1 and abs( event[ 1 ] - end ) < 0.1 and abs( event[ 2 ] - frequency ) < 30
+    if len( events[ "narrowband" ] ) != 2 or not Matches( events[ "narrowband" ][ 0 ], 5, 12, 3000 ) or \
+            not Matches( events[ "narrowband" ][ 1 ], 14, 16, 21000 ):
+        stats.numErrors += 1
+        print( "         Error! The tones must be detected once, at their frequency" )
+    shortBurstTime = (shortBurstStart + 512) / float( sampleRate )
+    if len( events[ "ultrasonic" ] ) != 2 or not Matches( events[ "ultrasonic" ][ 0 ], shortBurstTime, shortBurstTime, audioAnalyze.kUltrasonicEdge ) or \
+            not Matches( events[ "ultrasonic" ][ 1 ], 14, 16, audioAnalyze.kUltrasonicEdge ):
+        stats.numErrors += 1
+        print( "         Error! The ultrasonic bursts must be detected" )
+
+    # a failing analysis leaves the saved arrays readable, with the rows written until it failed
+    with tempfile.TemporaryDirectory() as folder:
+        spectrogramAnalyzer = audioAnalyze.SpectrogramAnalyzer( os.path.join( folder, "failed" ) )
+        def FailingDetectUltrasonicEdge( edgeLevels ):
+            raise ValueError( "Detection failed" )
+        spectrogramAnalyzer.DetectUltrasonicEdge = FailingDetectUltrasonicEdge
+        audioAnalysis = audioAnalyze.AudioAnalysis( videoAnalysisHelpers.Logger(), spectrogramAnalyzer )
+        audioAnalysis.Start( [ sys.executable, "-c", "import sys; sys.stdout.buffer.write( bytes( 4 * %i * 2 ) )" % sampleRate ] )
+        audioAnalysis.Wait()
+        try:
+            failedShape = numpy.load( os.path.join( folder, "failed" + audioAnalyze.kSpectrogramSuffix ) ).shape
+        except ValueError:
+            failedShape = None
+    print( "Spectrogram saved by the failed analysis: %s" % (failedShape,) )
+    if audioAnalysis.error is None or failedShape != (audioAnalyze.kSpectrogramBatch, audioAnalyze.kSpectrogramBins):
+        stats.numErrors += 1
+        print( "         Error! Expected the error reported, and the rows of the first batch saved" )
+
+
+def Test_FixedPointLuminanceKernel( stats ):
+    PrintTitle( "Running test for the fixed point luminance kernel" )
+
+    # random frames, the extremes of every channel, and a resolution which is not a multiple of anything
+    randomGenerator = numpy.random.default_rng( 2022 )
+    frames = [ randomGenerator.integers( 0, 256, (1080, 1920, 3), dtype = numpy.uint8 ) for i in range( 3 ) ]
+    frames += [ numpy.full( (1080, 1920, 3), color, numpy.uint8 ) for color in \
+        ((0, 0, 0), (255, 255, 255), (255, 0, 0), (0, 255, 0), (0, 0, 255), (127, 128, 129)) ]
+    frames.append( randomGenerator.integers( 0, 256, (481, 641, 3), dtype = numpy.uint8 ) )
+    kernel = videoAnalyzeRateOfChange.FixedPointLuminanceKernel()
+
+    mismatches = 0
+    for frame in frames:
+        out = numpy.empty( frame.shape[ 0:2 ], numpy.uint8 )
+        expected = videoAnalyzeRateOfChange.PrepareFrameForAnalysis( frame )
+        obtained = videoAnalyzeRateOfChange.PrepareFrameForAnalysis( frame, kernel, out )
+        if not obtained is out or not numpy.array_equal( expected, obtained ):
+            mismatches += 1
+    print( "Frames differing from the PIL luminance: %i of %i" % (mismatches, len( frames )) )
+    if mismatches > 0:
+        stats.numErrors += 1
+        print( "         Error! Fixed point luminance differs from PIL luminance" )
+
+    # Per frame running time, on a 1080p frame, for information only: it depends on the machine
+    kNumRuns = 50
+    frame = frames[ 0 ]
+    out = numpy.empty( (1080, 1920), numpy.uint8 )
+    pilDuration = kernelDuration = float( "inf" )
+    for i in range( kNumRuns ):
+        timerStart = perf_counter()
+        videoAnalyzeRateOfChange.PrepareFrameForAnalysis( frame )
+        pilDuration = min( pilDuration, perf_counter() - timerStart )
+        timerStart = perf_counter()
+        videoAnalyzeRateOfChange.PrepareFrameForAnalysis( frame, kernel, out )
+        kernelDuration = min( kernelDuration, perf_counter() - timerStart )
+    print( "1080p frame preparation: PIL %.2f ms, fixed point %.2f ms, speedup %.2fx" % \
+        (1000.0 * pilDuration, 1000.0 * kernelDuration, pilDuration / kernelDuration) )
+
 
 def PrintPerf( results ):
     spaceSuffix = "    "
@@ -94,6 +899,28 @@ print()
 
 stats = TestStatistics()
 Test_CalculateDifferenceCoefficient( stats )
+Test_CalculateTileDifferenceCoefficients( stats )
+Test_ScreeningCandidateDetected( stats )
+Test_RewindingVideoIterator( stats )
+Test_VariableFrameRateSkip( stats )
+Test_VideoIteratorClosedOnFailure( stats )
+Test_SkipPolicies( stats )
+Test_ReplayFrameSignals( stats )
+Test_AnalysisAllocations( stats )
+Test_DiffOverlayRenderer( stats )
+Test_AsyncFrameEncoder( stats )
+Test_MappedFrameSpool( stats )
+Test_FrameSpoolEncoderOverlap( stats )
+Test_CompressedFrameSpool( stats )
+Test_DetectionIndex( stats )
+Test_FileFingerprint( stats )
+Test_AnalysisCache( stats )
+Test_JobMetrics( stats )
+Test_FailedVideoFileJob( stats )
+Test_AnalysisProfiler( stats )
+Test_VideoMetadataStore( stats )
+Test_SpectrogramAnalyzer( stats )
+Test_FixedPointLuminanceKernel( stats )
 
 parser = argparse.ArgumentParser()
 parser.add_argument( "--destFolder", type = str, default = ".",
@@ -104,6 +931,8 @@ parser.add_argument( "--highlightDiffs", action="store_true",
     help="if enabled highlights the pixel difference in the output" )
 parser.add_argument( "--onlyDiffs", action="store_true",
     help="if enabled only the differences are output" )
+parser.add_argument( "--luminanceMethod", type = str, default = videoAnalyzeRateOfChange.kLuminanceMethodPIL,
+    help="luminance calculation used for frame preparation" )
 
 args = parser.parse_args( "" )
 
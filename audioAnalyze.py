@@ -9,34 +9,312 @@
 import os
 import argparse
 import subprocess
+import tempfile
+import threading
+from time import perf_counter
 
 import ffmpeg
+import numpy
 
 import videoAnalysisHelpers
 
+# Streaming spectrogram (see SpectrogramAnalyzer): mono PCM is read from ffmpeg at kSpectrogramSampleRate, and
+# transformed by windows of kSpectrogramWindow samples, kSpectrogramBatch windows at once. Windows start every
+# kSpectrogramHop samples: with the 50% overlap, every sample is near the middle of a window, where the Hann window
+# does not attenuate it, so short bursts are not missed.
+kSpectrogramSampleRate = 48000
+kSpectrogramWindow = 2048
+kSpectrogramHop = kSpectrogramWindow // 2
+kSpectrogramBatch = 64
+kSpectrogramBins = 256          # bins saved per window, each the mean power of consecutive FFT bins
+kSpectrogramFloor = -120.0      # dB relative to full scale of the lowest saved level. Levels are saved in 0.5 dB steps.
+kSpectrogramSuffix = ".spectrogram.npy"
+kAudioBandsSuffix = ".bands.npy"
+kAudioBands = ( (20, 300), (300, 2000), (2000, 8000), (8000, 16000), (16000, 18000), (18000, 24000) )    # Hz
 
-def runAudioAnalysis( videoPathLocation, outputName, logger, args ):
+# Narrowband anomalies: FFT bins louder than the neighbouring bins by kNarrowbandProminence dB, during at least
+# kNarrowbandDuration seconds. Bins within kNarrowbandSpread of a bin are not its neighbours, as they hold its leakage.
+kNarrowbandProminence = 20.0
+kNarrowbandDuration = 1.0
+kNarrowbandNeighbours = 16
+kNarrowbandSpread = 2
+kNarrowbandMinLevel = -90.0     # dB relative to full scale. Quieter bins are not considered.
+
+# Ultrasonic edge anomalies: the energy of the band above kUltrasonicEdge Hz rising kUltrasonicProminence dB above its
+# running average, over kUltrasonicAverageDuration seconds
+kUltrasonicEdge = 18000
+kUltrasonicProminence = 15.0
+kUltrasonicAverageDuration = 10.0
+
+kMaxAudioEvents = 1000          # anomalies kept per file. The others are only counted.
+
+
+# Windowed FFT spectrogram of a stream of samples, computed by batches of windows, in constant memory.
+# Saves, one row per window:
+#   <outputPath>.spectrogram.npy: kSpectrogramBins levels (uint8, 0.5 dB steps above kSpectrogramFloor), from 0 Hz
+#       to half the sample rate
+#   <outputPath>.bands.npy: the energy of each of kAudioBands, in dB relative to full scale (float32)
+# and detects narrowband and ultrasonic edge anomalies. Events are (start, end, frequency, prominence), in seconds,
+# Hz and dB; end is None for events in progress.
+class SpectrogramAnalyzer:
+    def __init__( self, outputPath, sampleRate = kSpectrogramSampleRate ):
+        self.sampleRate = sampleRate
+        self.hopDuration = kSpectrogramHop / float( sampleRate )     # time between the starts of consecutive windows
+        self.window = numpy.hanning( kSpectrogramWindow ).astype( numpy.float32 )
+        # a full scale sine is at 0 dB
+        self.powerScale = 1.0 / (32768.0 * self.window.sum() / 2.0) ** 2
+        # samples of a batch of windows. The samples the last window shares with the next one are kept for the next batch.
+        self.batchSamples = numpy.zeros( (kSpectrogramBatch - 1) * kSpectrogramHop + kSpectrogramWindow, numpy.float32 )
+        self.overlapCount = kSpectrogramWindow - kSpectrogramHop
+        self.sampleCount = 0    # samples in the batch
+        self.windowCount = 0    # windows analyzed before the batch
+
+        binCount = kSpectrogramWindow // 2 + 1
+        binFrequencies = numpy.arange( binCount ) * sampleRate / float( kSpectrogramWindow )
+        self.bandBins = [ (numpy.searchsorted( binFrequencies, low ), numpy.searchsorted( binFrequencies, high )) for (low, high) in kAudioBands ]
+        self.edgeBins = numpy.searchsorted( binFrequencies, kUltrasonicEdge )
+
+        self.spectrogramWriter = videoAnalysisHelpers.StreamingArrayWriter( outputPath + kSpectrogramSuffix, numpy.uint8, (kSpectrogramBins,) )
+        self.bandsWriter = videoAnalysisHelpers.StreamingArrayWriter( outputPath + kAudioBandsSuffix, numpy.float32, (len( kAudioBands ),) )
+
+        self.narrowbandWindows = numpy.zeros( binCount, numpy.int32 )   # consecutive windows each bin was prominent
+        self.narrowbandEvents = {}  # events in progress, by bin
+        self.ultrasonicAverage = None
+        self.ultrasonicEvent = None
+        self.events = { "narrowband": [], "ultrasonic": [] }
+        self.eventCount = 0
+
+    # samples: int16 mono samples, in any number
+    def ProcessSamples( self, samples ):
+        while len( samples ) > 0:
+            count = min( len( samples ), len( self.batchSamples ) - self.sampleCount )
+            self.batchSamples[ self.sampleCount:self.sampleCount + count ] = samples[ :count ]
+            self.sampleCount += count
+            samples = samples[ count: ]
+            if self.sampleCount == len( self.batchSamples ):
+                self.ProcessBatch( self.BatchWindows() )
+                self.batchSamples[ :self.overlapCount ] = self.batchSamples[ -self.overlapCount: ]
+                self.sampleCount = self.overlapCount
+
+    # The last samples, less than a window, are not analyzed
+    def Finish( self ):
+        self.ProcessBatch( self.BatchWindows() )
+        self.sampleCount = 0
+        self.Close()
+
+    # Closes the saved arrays, with the rows written so far. Called by Finish, and when the analysis fails.
+    def Close( self ):
+        self.spectrogramWriter.Close()
+        self.bandsWriter.Close()
+
+    # "Private" methods:
+
+    # The complete windows of the batch, as views of its samples
+    def BatchWindows( self ):
+        if self.sampleCount < kSpectrogramWindow:
+            return self.batchSamples[ :0 ].reshape( 0, kSpectrogramWindow )
+        windows = numpy.lib.stride_tricks.sliding_window_view( self.batchSamples[ :self.sampleCount ], kSpectrogramWindow )
+        return windows[ ::kSpectrogramHop ]
+
+    def ProcessBatch( self, windows ):
+        if len( windows ) == 0:
+            return
+        power = numpy.abs( numpy.fft.rfft( windows * self.window, axis = 1 ) ) ** 2 * self.powerScale
+        levels = 10.0 * numpy.log10( power + 1e-20 )
+
+        spectrogram = 10.0 * numpy.log10( power[ :, 1: ].reshape( len( windows ), kSpectrogramBins, -1 ).mean( axis = 2 ) + 1e-20 )
+        self.spectrogramWriter.AppendRows( numpy.clip( (spectrogram - kSpectrogramFloor) * 2.0, 0, 255 ).astype( numpy.uint8 ) )
+        bands = numpy.stack( [ power[ :, low:high ].sum( axis = 1 ) for (low, high) in self.bandBins ], axis = 1 )
+        self.bandsWriter.AppendRows( 10.0 * numpy.log10( bands + 1e-20 ) )
+
+        self.DetectNarrowband( power, levels )
+        self.DetectUltrasonicEdge( 10.0 * numpy.log10( power[ :, self.edgeBins: ].sum( axis = 1 ) + 1e-20 ) )
+        self.windowCount += len( windows )
+
+    # Mean power of the neighbours of each bin, from running sums along the frequencies
+    def NeighbourLevels( self, power ):
+        binCount = power.shape[ 1 ]
+        sums = numpy.zeros( (power.shape[ 0 ], binCount + 1), numpy.float64 )
+        numpy.cumsum( power, axis = 1, out = sums[ :, 1: ] )
+        bins = numpy.arange( binCount )
+        def RangeSum( first, last ):
+            first = numpy.clip( first, 0, binCount )
+            last = numpy.clip( last, 0, binCount )
+            return (sums[ :, last ] - sums[ :, first ], last - first)
+        (outerSum, outerCount) = RangeSum( bins - kNarrowbandNeighbours, bins + kNarrowbandNeighbours + 1 )
+        (innerSum, innerCount) = RangeSum( bins - kNarrowbandSpread, bins + kNarrowbandSpread + 1 )
+        return 10.0 * numpy.log10( (outerSum - innerSum) / numpy.maximum( outerCount - innerCount, 1 ) + 1e-20 )
+
+    # A tone is detected on the bin where it peaks, not on the bins holding its leakage
+    def DetectNarrowband( self, power, levels ):
+        prominence = levels - self.NeighbourLevels( power )
+        prominent = (prominence > kNarrowbandProminence) & (levels > kNarrowbandMinLevel)
+        for shift in range( 1, kNarrowbandSpread + 1 ):
+            prominent[ :, shift: ] &= levels[ :, shift: ] >= levels[ :, :-shift ]
+            prominent[ :, :-shift ] &= levels[ :, :-shift ] > levels[ :, shift: ]
+        minWindows = max( 1, int( round( kNarrowbandDuration / self.hopDuration ) ) )
+        for w in range( len( prominent ) ):
+            self.narrowbandWindows = (self.narrowbandWindows + 1) * prominent[ w ]
+            time = (self.windowCount + w) * self.hopDuration
+            for b in numpy.flatnonzero( self.narrowbandWindows == minWindows ):
+                self.narrowbandEvents[ b ] = self.AddEvent( "narrowband", time - (minWindows - 1) * self.hopDuration, \
+                    float( b * self.sampleRate ) / kSpectrogramWindow, float( prominence[ w, b ] ) )
+            for b in [ b for b in self.narrowbandEvents if self.narrowbandWindows[ b ] == 0 ]:
+                self.EndEvent( self.narrowbandEvents.pop( b ), time )
+
+    def DetectUltrasonicEdge( self, edgeLevels ):
+        averageWeight = min( 1.0, self.hopDuration / kUltrasonicAverageDuration )
+        for w in range( len( edgeLevels ) ):
+            if self.ultrasonicAverage is None:
+                self.ultrasonicAverage = edgeLevels[ w ]
+            time = (self.windowCount + w) * self.hopDuration
+            prominence = edgeLevels[ w ] - self.ultrasonicAverage
+            if prominence > kUltrasonicProminence and self.ultrasonicEvent is None:
+                self.ultrasonicEvent = self.AddEvent( "ultrasonic", time, kUltrasonicEdge, float( prominence ) )
+            elif prominence <= kUltrasonicProminence and not self.ultrasonicEvent is None:
+                self.EndEvent( self.ultrasonicEvent, time )
+                self.ultrasonicEvent = None
+            self.ultrasonicAverage += averageWeight * (edgeLevels[ w ] - self.ultrasonicAverage)
+
+    # Returns the event, or None past kMaxAudioEvents
+    def AddEvent( self, kind, start, frequency, prominence ):
+        self.eventCount += 1
+        if self.eventCount > kMaxAudioEvents:
+            return None
+        event = [ start, None, frequency, prominence ]
+        self.events[ kind ].append( event )
+        return event
+
+    def EndEvent( self, event, end ):
+        if not event is None:
+            event[ 1 ] = end
+
+
+# Audio extraction running in an ffmpeg process, while the caller does other work with the file. With a
+# SpectrogramAnalyzer, the samples are analyzed as ffmpeg outputs them.
+# Wait() must be called before the logger is closed. duration is the running time of the extraction,
+# waitDuration the time spent in Wait() for it to finish.
+class AudioAnalysis:
+    def __init__( self, logger, spectrogramAnalyzer = None ):
+        self.logger = logger
+        self.spectrogramAnalyzer = spectrogramAnalyzer
+        self.process = None
+        self.outputFile = None
+        self.watcher = None
+        self.error = None
+        self.startTime = perf_counter()
+        self.endTime = self.startTime
+        self.duration = 0.0
+        self.waitDuration = 0.0
+        self.done = False
+
+    # The process end time is taken on a separate thread, as the caller may wait long after it.
+    # The same thread analyzes the samples.
+    def Start( self, commandLine ):
+        self.outputFile = tempfile.TemporaryFile()
+        if self.spectrogramAnalyzer is None:
+            self.process = subprocess.Popen( commandLine, stdin = subprocess.DEVNULL, stdout = self.outputFile, stderr = subprocess.STDOUT )
+        else:
+            self.process = subprocess.Popen( commandLine, stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = self.outputFile )
+        self.watcher = threading.Thread( target = self.WatchProcess, daemon = True )
+        self.watcher.start()
+
+    def WatchProcess( self ):
+        try:
+            if not self.spectrogramAnalyzer is None:
+                self.AnalyzeSamples()
+        except Exception as e:
+            self.error = e
+            self.process.kill()
+        self.process.wait()
+        self.endTime = perf_counter()
+
+    # If the analysis fails, the arrays saved keep the rows written until then
+    def AnalyzeSamples( self ):
+        blockSize = kSpectrogramHop * kSpectrogramBatch * 2
+        try:
+            with self.process.stdout:
+                while True:
+                    block = self.process.stdout.read( blockSize )
+                    if len( block ) == 0:
+                        break
+                    self.spectrogramAnalyzer.ProcessSamples( numpy.frombuffer( block, numpy.int16, len( block ) // 2 ) )
+            self.spectrogramAnalyzer.Finish()
+        finally:
+            self.spectrogramAnalyzer.Close()
+
+    def Wait( self ):
+        if self.done:
+            return
+        self.done = True
+        waitStart = perf_counter()
+        if not self.process is None:
+            self.watcher.join()
+            self.duration = self.endTime - self.startTime
+            self.outputFile.seek( 0 )
+            self.logger.PrintMessage( str( self.outputFile.read() ), False )
+            self.outputFile.close()
+            if self.process.returncode != 0:
+                self.logger.PrintMessage( "Unable to extract audio." )
+            if not self.error is None:
+                self.logger.PrintMessage( "Unable to analyze the audio spectrum: " + str( self.error ) )
+            elif not self.spectrogramAnalyzer is None:
+                LogAudioEvents( self.spectrogramAnalyzer, self.logger )
+        self.waitDuration = perf_counter() - waitStart
+
+        self.logger.PrintMessage( "Audio analysis done." )
+        self.logger.PrintMessage()
+
+
+def LogAudioEvents( spectrogramAnalyzer, logger ):
+    logger.PrintMessage( "Audio anomalies: %i narrowband, %i ultrasonic edge%s" % (len( spectrogramAnalyzer.events[ "narrowband" ] ), \
+        len( spectrogramAnalyzer.events[ "ultrasonic" ] ), \
+        "" if spectrogramAnalyzer.eventCount <= kMaxAudioEvents else ", %i more not kept" % (spectrogramAnalyzer.eventCount - kMaxAudioEvents)) )
+    for (kind, description) in (("narrowband", "Narrowband tone at %.0f Hz"), ("ultrasonic", "Energy above %.0f Hz")):
+        for (start, end, frequency, prominence) in spectrogramAnalyzer.events[ kind ]:
+            logger.PrintMessage( (description + ", from %.2f s to %s, %.1f dB above its surroundings") % \
+                (frequency, start, "the end" if end is None else "%.2f s" % end, prominence), False )
+
+
+def startAudioAnalysis( videoPathLocation, outputName, logger, args ):
     logger.PrintMessage( "Audio analysis starting" )
+    audioAnalysis = AudioAnalysis( logger )
 
     audioOutputFilePath = os.path.join( args.destFolder, outputName + ".mp3" )
 
     try:
-        # For now just extraction, and use a spectrum analysis app such as "Sonic Visualizer" to look at the data
-        stdout, stderr = ffmpeg.input( videoPathLocation ).output( audioOutputFilePath, f = "mp3", vcodec = "none" )\
-            .run( overwrite_output = True, capture_stdout = True, capture_stderr = True )
-        logger.PrintMessage( str( stdout ), False )
-        logger.PrintMessage( str( stderr ), False )
+        # Extraction, to use a spectrum analysis app such as "Sonic Visualizer" to look at the data, and optionally
+        # a spectrogram, from mono samples ffmpeg writes to its standard output.
+        # The ffmpeg messages go to a file rather than a pipe, which would block ffmpeg once full.
+        videoInput = ffmpeg.input( videoPathLocation )
+        outputs = videoInput.output( audioOutputFilePath, f = "mp3", vcodec = "none" )
+        if getattr( args, "audioSpectrogram", False ):
+            audioAnalysis.spectrogramAnalyzer = SpectrogramAnalyzer( os.path.join( args.destFolder, outputName ) )
+            outputs = ffmpeg.merge_outputs( outputs, videoInput.audio.output( "pipe:", f = "s16le", ac = 1, ar = kSpectrogramSampleRate ) )
+        audioAnalysis.Start( outputs.compile( overwrite_output = True ) )
 
     except:
-        logger.PrintMessage( "Unable to extract audio." )    
+        audioAnalysis.process = None
+        if not audioAnalysis.outputFile is None:
+            audioAnalysis.outputFile.close()
+        if not audioAnalysis.spectrogramAnalyzer is None:
+            audioAnalysis.spectrogramAnalyzer.Close()
+        logger.PrintMessage( "Unable to extract audio." )
+
+    return audioAnalysis
 
-    logger.PrintMessage( "Audio analysis done." )
-    logger.PrintMessage()
+
+def runAudioAnalysis( videoPathLocation, outputName, logger, args ):
+    startAudioAnalysis( videoPathLocation, outputName, logger, args ).Wait()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument( "videoFile", help="path to the video file to analyze" )
+    parser.add_argument( "--destFolder", type = str, default = ".",
+        help = "optional destination folder for results of analysis. Default: current working directory" )
+    parser.add_argument( "--audioSpectrogram", action = "store_true",
+        help = "also save a spectrogram and band energies of the audio, and detect narrowband and ultrasonic anomalies" )
 
     args = parser.parse_args()
-    runAudioAnalysis( args.videoFile, videoAnalysisHelpers.Logger() )
+    runAudioAnalysis( args.videoFile, os.path.splitext( os.path.basename( args.videoFile ) )[ 0 ], videoAnalysisHelpers.Logger(), args )
@@ -7,33 +7,55 @@
 #      19.01.2022 voicua: Created "processVideos.py" to run analysis on a directory
 
 import os, sys
+import concurrent.futures
 import tempfile
 import shutil
+import time
 from time import perf_counter
 import argparse, shlex
-
-import ffmpeg
+import json
+import sqlite3
 
 import audioAnalyze
 import videoAnalyzeRateOfChange
 import videoAnalysisHelpers as vh
 
 kTempLogFilePrefix = "temp_logfile_"
+kAnalysisCacheFileName = "analysisCache.sqlite"
+kStagingFolder = "/dev/shm"     # RAM-backed folder the source files are copied to, when available
+kStagingBudget = 4096           # MiB of source files copied ahead of their analysis
+
+# Sessions (time segments) are finalized once the source files they cover span kSessionDuration seconds,
+# after an aborted file, or once their output lasts kSessionOutputLength seconds (see SessionComplete)
+kSessionDuration = 10 * 60
+kSessionOutputLength = 5 * 60
+
+# Arguments which change the output of an analysis, and constants of videoAnalyzeRateOfChange which decide the triggers,
+# with its version. A file is analyzed again when they differ from the recorded ones.
+kAnalysisParameters = ( "luminanceMethod", "videoDecoder", "analysisWidth", "grayOutput", "highlightDiffs", "onlyDiffs", \
+    "seekSkipThreshold", "tileGrid", "coarseScreening", "rewindFrames", "skipPolicy" )
+kAnalysisConstants = ( "kAnalyzerVersion", "kLuminanceDiffThreshold", "kMotionDerivativeThreshold", "kMinChange", \
+    "kTileMinChangeRatio", "kScreeningMargin" )
 
 
 def WithinRange( v1, v2, r ):
     return abs( v2 - v1 ) <= r
 
-def AnalyzeTimeline( videosList ):
+def AnalyzeTimeline( videosList, metadataStore ):
     expectedCreationTime = 0
     for f in videosList:
         # Check if current start time fits expected range
         if expectedCreationTime > 0:
             if not WithinRange( expectedCreationTime, f[ 1 ], 1 ):
                 print( f[ 0 ] + " started with delay of " + str( f[ 1 ] - expectedCreationTime ) + " seconds" )
-        videoMeta = ffmpeg.probe( f[ 0 ] )[ "streams" ]
+        try:
+            videoMeta = metadataStore.Get( f[ 0 ] )
+        except Exception as e:
+            print( f[ 0 ] + " duration unknown: " + str( e ) )
+            expectedCreationTime = 0
+            continue
 
-        duration = videoMeta[ 0 ][ 'duration' ]
+        duration = videoMeta.duration
         expectedCreationTime = f[ 1 ] + duration
 
 
@@ -102,6 +124,182 @@ class DelayedMoveOperation:
         self.filePaths.clear()
 
 
+# Analyses of the source files, in a SQLite database in the destination folder, by content fingerprint
+# (see vh.GetFileFingerprint): renamed files are still found, and files are analyzed again only when the analysis
+# parameters change. Like DelayedMoveOperation, results are recorded only when the output of their session is saved.
+# Fingerprints are kept by path, size and modification time: only new, renamed or modified files are read.
+class AnalysisCache:
+    def __init__( self, destFolder, args ):
+        self.connection = sqlite3.connect( os.path.join( destFolder, kAnalysisCacheFileName ) )
+        self.connection.execute( "CREATE TABLE IF NOT EXISTS analyses ( fingerprint TEXT, fileName TEXT, fileSize INTEGER, " \
+            "status TEXT, parameters TEXT, output TEXT, analysisTime TEXT, PRIMARY KEY ( fingerprint, parameters ) )" )
+        self.connection.execute( "CREATE TABLE IF NOT EXISTS fingerprints ( path TEXT PRIMARY KEY, fileSize INTEGER, " \
+            "modificationTime REAL, fingerprint TEXT )" )
+        parameters = { p: videoAnalyzeRateOfChange.ArgValue( args, p, None ) for p in kAnalysisParameters }
+        parameters.update( { c: getattr( videoAnalyzeRateOfChange, c ) for c in kAnalysisConstants } )
+        self.parameters = json.dumps( parameters, sort_keys = True )
+        self.fingerprints = {}
+        self.pendingResults = []
+
+    # Fingerprints are also kept by file name in memory, as the files are moved once analyzed
+    def GetFingerprint( self, fileName ):
+        if not fileName in self.fingerprints:
+            fileStats = os.stat( fileName )
+            key = (os.path.abspath( fileName ), fileStats.st_size, fileStats.st_mtime)
+            row = self.connection.execute( "SELECT fingerprint FROM fingerprints WHERE path = ? AND fileSize = ? AND modificationTime = ?", \
+                key ).fetchone()
+            if row is None:
+                row = (vh.GetFileFingerprint( fileName ),)
+                with self.connection:
+                    self.connection.execute( "INSERT OR REPLACE INTO fingerprints VALUES ( ?, ?, ?, ? )", key + row )
+            self.fingerprints[ fileName ] = row[ 0 ]
+        return self.fingerprints[ fileName ]
+
+    # Status of the analysis of the file with the current parameters ("analyzed" or "aborted"), None if not analyzed
+    def GetStatus( self, fileName ):
+        row = self.connection.execute( "SELECT status FROM analyses WHERE fingerprint = ? AND parameters = ?", \
+            (self.GetFingerprint( fileName ), self.parameters) ).fetchone()
+        return None if row is None else row[ 0 ]
+
+    # Absolute paths of the outputs of the recorded analyses, with any parameters
+    def GetOutputPaths( self ):
+        return set( [ os.path.abspath( row[ 0 ] ) for row in \
+            self.connection.execute( "SELECT DISTINCT output FROM analyses WHERE output IS NOT NULL" ) ] )
+
+    def AddResult( self, fileStats, analysisAborted ):
+        self.pendingResults.append( (fileStats, "aborted" if analysisAborted else "analyzed") )
+
+    def Cancel( self ):
+        self.pendingResults.clear()
+
+    # Records the pending results, with the output of their session (None if it was removed)
+    def Commit( self, outputPath ):
+        analysisTime = vh.GetFormattedFileTime( time.time() )
+        with self.connection:
+            for (fileStats, status) in self.pendingResults:
+                self.connection.execute( "INSERT OR REPLACE INTO analyses VALUES ( ?, ?, ?, ?, ?, ?, ? )", \
+                    (self.GetFingerprint( fileStats[ 0 ] ), fileStats[ 0 ], fileStats[ 2 ], status, self.parameters, \
+                        outputPath, analysisTime) )
+        self.pendingResults.clear()
+
+    def Close( self ):
+        self.connection.close()
+
+
+# Copies the source files to a RAM-backed folder on a separate thread, so reading the next file from potentially slow
+# media overlaps the analysis of the current one. At most budgetBytes are staged at once: a file which does not fit
+# is copied once the files before it are released, and a file larger than the budget is read in place.
+# readingAccumulator measures the copies, exposedAccumulator the time spent waiting for them.
+class SourceFileStager:
+    def __init__( self, budgetBytes, folder = None ):
+        if folder is None and os.path.isdir( kStagingFolder ):
+            folder = kStagingFolder
+        self.folder = folder
+        self.budgetBytes = 0
+        if budgetBytes > 0:
+            self.budgetBytes = min( budgetBytes, shutil.disk_usage( tempfile.gettempdir() if folder is None else folder ).free )
+        self.stagedBytes = 0
+        self.copies = {}    # source file name -> (future of the staged file path, file size)
+        self.executor = concurrent.futures.ThreadPoolExecutor( max_workers = 1 )
+        self.readingAccumulator = videoAnalyzeRateOfChange.RunningTimeAccumulator()
+        self.exposedAccumulator = videoAnalyzeRateOfChange.RunningTimeAccumulator()
+
+    # Starts copying the file, if it fits in the budget. Files are copied in the order they are staged.
+    def Stage( self, fileStats ):
+        if fileStats[ 0 ] in self.copies or self.stagedBytes + fileStats[ 2 ] > self.budgetBytes:
+            return
+        self.stagedBytes += fileStats[ 2 ]
+        self.copies[ fileStats[ 0 ] ] = (self.executor.submit( self.CopyFile, fileStats ), fileStats[ 2 ])
+
+    # True if the file is being copied, and Acquire would wait for it
+    def CopyPending( self, fileStats ):
+        return fileStats[ 0 ] in self.copies and not self.copies[ fileStats[ 0 ] ][ 0 ].done()
+
+    # Returns the path to analyze the file from, and the reason it is read in place (None if it was staged):
+    # its staged copy, once copied, or the file itself if it could not be staged
+    def Acquire( self, fileStats ):
+        self.exposedAccumulator.OnStartTimer( fileStats[ 2 ] )
+        self.Stage( fileStats )
+        filePath = fileStats[ 0 ]
+        inPlaceReason = None
+        if fileStats[ 0 ] in self.copies:
+            try:
+                filePath = self.copies[ fileStats[ 0 ] ][ 0 ].result()
+            except OSError as e:
+                # e.g. the staging folder is full: release the budget, and read in place
+                self.Release( fileStats )
+                inPlaceReason = "copying failed (%s)" % e
+        elif self.budgetBytes <= 0:
+            inPlaceReason = "staging is disabled"
+        else:
+            inPlaceReason = "the file does not fit in the staging budget (%i MiB)" % (self.budgetBytes // (1024 * 1024))
+        self.exposedAccumulator.OnStopTimer()
+        return (filePath, inPlaceReason)
+
+    def Release( self, fileStats ):
+        if not fileStats[ 0 ] in self.copies:
+            return
+        (copy, fileSize) = self.copies.pop( fileStats[ 0 ] )
+        self.stagedBytes -= fileSize
+        if not copy.cancel() and copy.exception() is None:
+            os.remove( copy.result() )
+
+    # Waits for the copies in progress and removes all the staged files
+    def Close( self ):
+        for fileName in list( self.copies ):
+            self.Release( (fileName, 0, 0) )
+        self.executor.shutdown( wait = True )
+
+    # Time spent copying the files, and the part of it the analysis did not wait for
+    def OverlappedDuration( self ):
+        return max( 0.0, self.readingAccumulator.accumulator - self.exposedAccumulator.accumulator )
+
+    # "Private" methods:
+
+    # Runs on the staging thread. A partial copy is removed.
+    def CopyFile( self, fileStats ):
+        stagedFile = tempfile.NamedTemporaryFile( suffix = os.path.splitext( fileStats[ 0 ] )[ 1 ], dir = self.folder, delete = False )
+        stagedFile.close()
+        self.readingAccumulator.OnStartTimer( fileStats[ 2 ] )
+        try:
+            shutil.copy( fileStats[ 0 ], stagedFile.name )
+        except:
+            os.remove( stagedFile.name )
+            raise
+        finally:
+            self.readingAccumulator.OnStopTimer()
+        return stagedFile.name
+
+
+# Sessions are named after the time of their first file. A file analyzed again with other parameters does not overwrite
+# the output of its previous analysis.
+def GetSessionName( args, fileTime ):
+    sessionName = "Analysis " + vh.GetFormattedFileTime( fileTime )
+    suffix = 1
+    while os.path.isfile( os.path.join( args.destFolder, sessionName + '_ROC_analyzed.mp4' ) ):
+        suffix += 1
+        sessionName = "Analysis %s (%i)" % (vh.GetFormattedFileTime( fileTime ), suffix)
+    return sessionName
+
+
+# The span of a session is measured on the timeline of the source files (see AnalyzeTimeline), from the start of its first
+# file to the end of the last one, so a session covers the same files whatever the number of jobs and the analysis speed.
+def SessionComplete( sessionStartTime, fileStats, metadataStore, analysisAborted, rateOfChangeAnalyzer ):
+    try:
+        fileEndTime = fileStats[ 1 ] + metadataStore.Get( fileStats[ 0 ] ).duration
+    except Exception:
+        fileEndTime = fileStats[ 1 ]
+    return fileEndTime - sessionStartTime > kSessionDuration or analysisAborted or \
+        rateOfChangeAnalyzer.GetOutputLength() > kSessionOutputLength
+
+
+# Output of a saved session: its video file, or for a few frames the prefix of its image files
+def GetSessionOutputPath( rateOfChangeAnalyzer ):
+    if os.path.isfile( rateOfChangeAnalyzer.kRocAnalyzedFilePath ):
+        return rateOfChangeAnalyzer.kRocAnalyzedFilePath
+    return os.path.join( rateOfChangeAnalyzer.args.destFolder, rateOfChangeAnalyzer.videoAnalysisName + '_ROC_analyzed_frame_' )
+
+
 def runProcessVideos( args ):
 
     #
@@ -122,13 +320,12 @@ def runProcessVideos( args ):
     # This in turn enables the user to restart the process on a previously interrupted run.
     #
 
-    allSourceVideos = [ f for f in os.listdir() if IsVideoFile( f ) ]
-
-    rocPreviousResults = [ f for f in os.listdir( args.destFolder ) if IsVideoFileWithName( args.destFolder, f, "_ROC_analyzed" ) ]
-    # initialize the list with all the originals found in the folder
-    tobeAnalyzedVideos = list( set( allSourceVideos ) - set( rocPreviousResults ) )
-
-    alreadyAnalyzedOriginals = []
+    # initialize the list with all the originals found in the folder. The outputs of previous analyses may be in the
+    # same folder (see --destFolder).
+    cacheTimerStart = perf_counter()
+    analysisCache = AnalysisCache( args.destFolder, args )
+    previousOutputs = analysisCache.GetOutputPaths()
+    tobeAnalyzedVideos = [ f for f in os.listdir() if IsVideoFile( f ) and not os.path.abspath( f ) in previousOutputs ]
 
     '''
     # TODO-Pri3: figure out if I still need this feature.
@@ -141,13 +338,12 @@ def runProcessVideos( args ):
             alreadyAnalyzedOriginals.append( origName )
     '''
 
-    # Remove originals with existing results, even if incomplete analysis, to avoid stealth overwriting of the results
-    # Previous results must be explicitly removed by the user
-    for f in rocPreviousResults:
-        origName = f[ :f.find( "_ROC_analyzed" ) ]
-        alreadyAnalyzedOriginals.append( origName )
-
-    alreadyAnalyzedOriginals = set( alreadyAnalyzedOriginals )
+    # Remove originals with existing results, even if the analysis was aborted, to avoid stealth overwriting of the results.
+    # Aborted analyses are run again with --reanalyzeAborted, other previous results must be removed from the analysis cache.
+    skippedStatuses = [ "analyzed" ] if videoAnalyzeRateOfChange.FlagEnabled( args, "reanalyzeAborted" ) else [ "analyzed", "aborted" ]
+    alreadyAnalyzedOriginals = set( [ f for f in tobeAnalyzedVideos if analysisCache.GetStatus( f ) in skippedStatuses ] )
+    jobLogger.PrintMessage( "Checked %i originals against the analysis cache in %.2f s" % \
+        (len( tobeAnalyzedVideos ), perf_counter() - cacheTimerStart) )
 
     if len( alreadyAnalyzedOriginals ) > 0:
         print( "Found previous analysis, skipping the following %i originals:" % len( alreadyAnalyzedOriginals ) )
@@ -181,25 +377,56 @@ def runProcessVideos( args ):
     jobLogger.PrintMessage( "A total of %i videos to analyze, %s" % \
         (len( tobeAnalyzedVideos ), vh.FormatMemSize( jobSizeBytes )) )
 
-    #AnalyzeTimeline( tobeAnalyzedVideos )
+    # Probe all the files at once, the analyses and the timeline check find their metadata in the store
+    probeTimerStart = perf_counter()
+    metadataStore = vh.VideoMetadataStore( os.path.join( args.destFolder, vh.kVideoMetadataFileName ) )
+    probeFailures = metadataStore.ProbeAll( [ f[ 0 ] for f in tobeAnalyzedVideos ] )
+    jobLogger.PrintMessage( "Probed the metadata of %i video files in %.2f s" % (len( tobeAnalyzedVideos ), perf_counter() - probeTimerStart) )
+    for (f, e) in probeFailures:
+        jobLogger.PrintMessage( "Cannot probe %s: %s" % (f, str( e )) )
+
+    AnalyzeTimeline( tobeAnalyzedVideos, metadataStore )
 
     #
     # Run analysis
     #
 
-    diskReadingAccumulator = videoAnalyzeRateOfChange.RunningTimeAccumulator()
+    jobMetrics = vh.JobMetrics( args.destFolder )
+    jobMetrics.SetGauge( "remaining_bytes", jobSizeBytes )
+    jobStartTime = perf_counter()
+
+    jobs = videoAnalyzeRateOfChange.ArgValue( args, "jobs", 1 )
+    if jobs > 1:
+        runParallelAnalysis( args, tobeAnalyzedVideos, jobSizeBytes, jobLogger, jobs, analysisCache, jobMetrics, metadataStore )
+    else:
+        runSequentialAnalysis( args, tobeAnalyzedVideos, jobSizeBytes, jobLogger, analysisCache, jobMetrics, metadataStore )
+    analysisCache.Close()
+    metadataStore.Close()
+
+    jobMetrics.Export( dict( event = "job", duration = perf_counter() - jobStartTime, filesScheduled = len( tobeAnalyzedVideos ), \
+        counters = jobMetrics.counters ) )
+
+    jobLogger.PrintMessage( "" )
+    jobLogger.PrintMessage( "All done." )
+
+
+def runSequentialAnalysis( args, tobeAnalyzedVideos, jobSizeBytes, jobLogger, analysisCache, jobMetrics, metadataStore ):
     jobStartTime = perf_counter()
     totalSourceProcessed = 0
 
     moveToAnalyzed = DelayedMoveOperation( "AnalyzedVideos" )
     moveToAborted = DelayedMoveOperation( "AbortedVideos" )
-    memoryCopy = None
+    sourceStager = SourceFileStager( videoAnalyzeRateOfChange.ArgValue( args, "stagingBudget", kStagingBudget ) * 1024 * 1024 )
+    audioDuration = 0.0
+    audioWaitDuration = 0.0
+    profiler = vh.AnalysisProfiler() if videoAnalyzeRateOfChange.FlagEnabled( args, "profile" ) else None
 
     # initialize analyzer
     count = 1
     rateOfChangeAnalyzer = None
 
-    for a in tobeAnalyzedVideos:
+    for (i, a) in enumerate( tobeAnalyzedVideos ):
+        audioAnalysis = None
         try:
             print( "" )
             print( "" )
@@ -214,43 +441,62 @@ def runProcessVideos( args ):
             algPerformanceResults = videoAnalyzeRateOfChange.AlgorithmPerformanceResults()
 
             #
-            # Copy file to memory, to avoid reading multiple times from potentially slow media
+            # Copy file to memory, to avoid reading multiple times from potentially slow media.
+            # The next file is copied while this one is analyzed.
             #
 
-            jobLogger.PrintMessage( "Copying video file to memory..." )
-            diskReadingAccumulator.OnStartTimer( a[ 2 ] )
-            memoryCopy = tempfile.NamedTemporaryFile( suffix = '.' + os.path.splitext( a[ 0 ] )[1], delete = False )
-            shutil.copy( a[ 0 ], memoryCopy.name )
-            diskReadingAccumulator.OnStopTimer()
-            jobLogger.PrintMessage( "Done copying, at %s." % diskReadingAccumulator.FormatAsMiBPerf( True ) )
-            jobLogger.PrintMessage( memoryCopy.name )
+            sourceStager.Stage( a )
+            if i + 1 < len( tobeAnalyzedVideos ):
+                sourceStager.Stage( tobeAnalyzedVideos[ i + 1 ] )
+            copyPending = sourceStager.CopyPending( a )
+            if copyPending:
+                jobLogger.PrintMessage( "Copying video file to memory..." )
+            (stagedPath, inPlaceReason) = sourceStager.Acquire( a )
+            if not inPlaceReason is None:
+                jobLogger.PrintMessage( "Reading the file in place: %s." % inPlaceReason )
+            elif copyPending:
+                jobLogger.PrintMessage( "Done copying, waited %.2f s." % sourceStager.exposedAccumulator.lastTaskDuration )
+            jobLogger.PrintMessage( stagedPath )
 
             #
-            # audio analysis
+            # audio analysis, in a separate process while the rate of change is analyzed
             #
 
-            audioAnalyze.runAudioAnalysis( memoryCopy.name, vh.GetFormattedFileTime( a[ 1 ] ), logger, args )
+            audioAnalysis = audioAnalyze.startAudioAnalysis( stagedPath, vh.GetFormattedFileTime( a[ 1 ] ), logger, args )
 
             #
             # rate of change analysis
             #
 
             if rateOfChangeAnalyzer is None:
-                sessionName = "Analysis " + vh.GetFormattedFileTime( a[ 1 ] )
-                saveTimerStart = perf_counter()
+                sessionName = GetSessionName( args, a[ 1 ] )
+                sessionStartTime = a[ 1 ]
                 rateOfChangeAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( args, sessionName )
+                rateOfChangeAnalyzer.metadataStore = metadataStore
 
+            if not profiler is None:
+                profiler.StartFile( os.path.join( args.destFolder, a[ 0 ] ), vh.GetFormattedFileStats( a ) )
+            analysisTimerStart = perf_counter()
             try:
-                rateOfChangeAnalyzer.AddVideoFileToAnalysis( memoryCopy.name, logger, algPerformanceResults )
+                rateOfChangeAnalyzer.AddVideoFileToAnalysis( stagedPath, logger, algPerformanceResults, sourceName = a[ 0 ], \
+                    profiler = profiler )
             except Exception as e:
                 jobLogger.PrintMessage( str( e ) )
                 jobLogger.PrintMessage( "Exception thrown during ROC processing, aborting this file" )
                 algPerformanceResults.analysisAborted = True
+            analysisDuration = perf_counter() - analysisTimerStart
+            if not profiler is None:
+                profiler.FinishFile()
 
             if algPerformanceResults.analysisAborted:
                 moveToAborted.AddFile( a[ 0 ] )
             else:
                 moveToAnalyzed.AddFile( a[ 0 ] )
+            analysisCache.AddResult( a, algPerformanceResults.analysisAborted )
+
+            audioAnalysis.Wait()
+            audioDuration += audioAnalysis.duration
+            audioWaitDuration += audioAnalysis.waitDuration
 
             # All phases done with current file
             logger.Close()
@@ -260,15 +506,16 @@ def runProcessVideos( args ):
             # Session(time segment) management and cleanup
             #
 
-            if perf_counter() - saveTimerStart > 10 * 60 or \
-                    algPerformanceResults.analysisAborted or rateOfChangeAnalyzer.GetOutputLength() > 5 * 60:
-                
+            if SessionComplete( sessionStartTime, a, metadataStore, algPerformanceResults.analysisAborted, rateOfChangeAnalyzer ):
+
                 if moveToAnalyzed.GetCount() == 0:
                     # No need to keep output, all files were aborted
                     rateOfChangeAnalyzer.RemoveOutput()
+                    analysisCache.Commit( None )
                 else:
                     # Keep output. If last file was aborted, partial analysis may still be in the output. That's ok.
                     rateOfChangeAnalyzer.FinishAnalysis()
+                    analysisCache.Commit( GetSessionOutputPath( rateOfChangeAnalyzer ) )
 
                 rateOfChangeAnalyzer = None
                 moveToAnalyzed.Commit()
@@ -286,9 +533,13 @@ def runProcessVideos( args ):
             totalSourceProcessed += a[ 2 ]
             currentTime = perf_counter()
             jobRunningTimePerf = totalSourceProcessed / (1024.0 * 1024.0 * ( currentTime - jobStartTime ) )
-            dataReadPerf = totalSourceProcessed / (1024.0 * 1024.0 * diskReadingAccumulator.accumulator )
 
-            jobLogger.PrintMessage( "Reading source data at %.2f MiB/s" % dataReadPerf )
+            jobLogger.PrintMessage( "Reading source data at %s, %.2f s of %.2f s overlapped with the analysis" % \
+                (sourceStager.readingAccumulator.FormatAsMiBPerf(), sourceStager.OverlappedDuration(), sourceStager.readingAccumulator.accumulator) )
+            RecordFileMetrics( jobMetrics, a, algPerformanceResults, jobSizeBytes - totalSourceProcessed, \
+                dict( stagingWait = sourceStager.exposedAccumulator.lastTaskDuration, analysis = analysisDuration, \
+                    audio = audioAnalysis.duration, audioWait = audioAnalysis.waitDuration ) )
+            jobLogger.PrintMessage( "Extracting audio for %.2f s, of which %.2f s waited for after the analysis" % (audioDuration, audioWaitDuration) )
             jobLogger.PrintMessage( "Processing source data at a rate of %.2f MiB/s" % jobRunningTimePerf )
             if jobSizeBytes - totalSourceProcessed > 0:
                 jobLogger.PrintMessage( "Remaining time to finish: %.2f min" % \
@@ -300,21 +551,307 @@ def runProcessVideos( args ):
             break
 
         finally:
-            if not memoryCopy is None:
-                memFileName = memoryCopy.name
-                memoryCopy.close()
-                os.remove( memFileName )
-
+            if not audioAnalysis is None:
+                audioAnalysis.Wait()
+            sourceStager.Release( a )
 
+    sourceStager.Close()
+    if not profiler is None:
+        profiler.Close()
 
     if not rateOfChangeAnalyzer is None:
         #TODO-Pri0 voicua: add a transaction class with Commit/Cancel semantics
         moveToAnalyzed.Commit()
         moveToAborted.Commit()
         rateOfChangeAnalyzer.FinishAnalysis()
+        analysisCache.Commit( GetSessionOutputPath( rateOfChangeAnalyzer ) )
+
+
+# Adds the results of one source file to the job metrics, and exports them
+def RecordFileMetrics( jobMetrics, fileStats, algPerformanceResults, remainingBytes, fileStageDurations ):
+    jobMetrics.AddCounter( "files_analyzed_total" )
+    if algPerformanceResults.analysisAborted:
+        jobMetrics.AddCounter( "files_aborted_total" )
+    jobMetrics.AddCounter( "source_bytes_total", fileStats[ 2 ] )
+    jobMetrics.AddCounter( "frames_processed_total", algPerformanceResults.totalFramesProcessed )
+    jobMetrics.AddCounter( "frames_skipped_total", algPerformanceResults.totalFramesSkipped )
+    jobMetrics.AddCounter( "frames_triggered_total", algPerformanceResults.totalFramesTriggered )
+    jobMetrics.MergeStageLatencies( algPerformanceResults.stageLatencies )
+    for (stage, duration) in fileStageDurations.items():
+        jobMetrics.ObserveFileStage( stage, duration )
+    jobMetrics.SetGauge( "analysis_peak_resident_memory_bytes", \
+        max( jobMetrics.gauges[ "analysis_peak_resident_memory_bytes" ], algPerformanceResults.peakMemoryUsage ) )
+    jobMetrics.SetGauge( "remaining_bytes", remainingBytes )
+
+    jobMetrics.Export( dict( event = "file", file = fileStats[ 0 ], fileTime = fileStats[ 1 ], fileSize = fileStats[ 2 ], \
+        aborted = algPerformanceResults.analysisAborted, skipPolicy = algPerformanceResults.skipPolicy, \
+        framesProcessed = algPerformanceResults.totalFramesProcessed, framesSkipped = algPerformanceResults.totalFramesSkipped, \
+        framesTriggered = algPerformanceResults.totalFramesTriggered, algorithmFPS = algPerformanceResults.algorithmFPS, \
+        peakMemoryUsage = algPerformanceResults.peakMemoryUsage, fileStages = fileStageDurations, \
+        stageLatencies = dict( (stage, h.AsDict()) for (stage, h) in algPerformanceResults.stageLatencies.items() ) ) )
+
+
+def FinalizeSession( rateOfChangeAnalyzer, moveToAnalyzed, moveToAborted, analysisCache ):
+    if moveToAnalyzed.GetCount() == 0:
+        # No need to keep output, all files were aborted
+        rateOfChangeAnalyzer.RemoveOutput()
+        analysisCache.Commit( None )
+    else:
+        rateOfChangeAnalyzer.FinishAnalysis()
+        analysisCache.Commit( GetSessionOutputPath( rateOfChangeAnalyzer ) )
+    moveToAnalyzed.Commit()
+    moveToAborted.Commit()
+
+
+# Results of one source file analyzed by a worker process, to be added to a session by the parent process
+class VideoFileJobResult:
+    def __init__( self, fileStats ):
+        self.fileStats = fileStats
+        self.algPerformanceResults = None
+        self.spoolPath = None
+        self.baseState = None   # state the analysis ended with, and its triggers (see ReconcileVideoFileJob)
+        self.triggers = []
+        self.diskReadingDuration = 0.0
+        self.analysisDuration = 0.0
+        self.audioDuration = 0.0
+        self.audioWaitDuration = 0.0
+
+
+# Runs in a worker process: audio extraction and ROC analysis of one source file, from a fresh base of comparison.
+# Output frames are spooled to a temporary file, instead of being written to a session output.
+# The workers share the staging budget: a file which does not fit in its share is read in place.
+def AnalyzeVideoFileJob( a, args ):
+    result = VideoFileJobResult( a )
+
+    tempLoggingFilePath = os.path.join( args.destFolder, kTempLogFilePrefix + a[ 0 ] + ".txt" )
+    logger = vh.Logger( tempLoggingFilePath )
+    logger.PrintMessage( "Running analysis for " + vh.GetFormattedFileStats( a ) )
+
+    result.algPerformanceResults = videoAnalyzeRateOfChange.AlgorithmPerformanceResults()
+    sourceStager = None
+    audioAnalysis = None
+    rateOfChangeAnalyzer = None
+    metadataStore = None
+
+    try:
+        stagingBudget = videoAnalyzeRateOfChange.ArgValue( args, "stagingBudget", kStagingBudget ) * 1024 * 1024
+        sourceStager = SourceFileStager( stagingBudget // videoAnalyzeRateOfChange.ArgValue( args, "jobs", 1 ) )
+        (stagedPath, inPlaceReason) = sourceStager.Acquire( a )
+        if not inPlaceReason is None:
+            logger.PrintMessage( "Reading the file in place: %s." % inPlaceReason )
+        result.diskReadingDuration = sourceStager.readingAccumulator.accumulator
+
+        analysisTimerStart = perf_counter()
+        audioAnalysis = audioAnalyze.startAudioAnalysis( stagedPath, vh.GetFormattedFileTime( a[ 1 ] ), logger, args )
+
+        # files are already analyzed in parallel, their time ranges are not
+        fileArgs = argparse.Namespace( **vars( args ) )
+        fileArgs.rangeJobs = 1
+        rateOfChangeAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( fileArgs, a[ 0 ] )
+        rateOfChangeAnalyzer.outputSpoolPath = os.path.join( args.destFolder, \
+            videoAnalyzeRateOfChange.kTempFilePrefix + a[ 0 ] + ".spool" )
+        metadataStore = vh.VideoMetadataStore( os.path.join( args.destFolder, vh.kVideoMetadataFileName ) )
+        rateOfChangeAnalyzer.metadataStore = metadataStore
+        # worker processes are reused between files, the growth since the profiling started is per file too
+        profiler = None
+        if videoAnalyzeRateOfChange.FlagEnabled( args, "profile" ):
+            profiler = vh.AnalysisProfiler()
+            profiler.StartFile( os.path.join( args.destFolder, a[ 0 ] ), vh.GetFormattedFileStats( a ) )
+        try:
+            rateOfChangeAnalyzer.AddVideoFileToAnalysis( stagedPath, logger, result.algPerformanceResults, sourceName = a[ 0 ], \
+                profiler = profiler )
+        except Exception as e:
+            logger.PrintMessage( str( e ) )
+            logger.PrintMessage( "Exception thrown during ROC processing, aborting this file" )
+            result.algPerformanceResults.analysisAborted = True
+        if not profiler is None:
+            profiler.FinishFile()
+            profiler.Close()
+        rateOfChangeAnalyzer.FinishAnalysis()
+        if os.path.isfile( rateOfChangeAnalyzer.outputSpoolPath ):
+            result.spoolPath = rateOfChangeAnalyzer.outputSpoolPath
+        result.baseState = rateOfChangeAnalyzer.GetBaseState()
+        result.triggers = rateOfChangeAnalyzer.rangeTriggers
+        audioAnalysis.Wait()
+        result.audioDuration = audioAnalysis.duration
+        result.audioWaitDuration = audioAnalysis.waitDuration
+        result.analysisDuration = perf_counter() - analysisTimerStart
+
+    except Exception as e:
+        # As in the sequential analysis, the file is aborted, and the other files go on. Nothing of it is output.
+        logger.PrintMessage( str( e ) )
+        logger.PrintMessage( "Exception thrown during processing, aborting this file" )
+        result.algPerformanceResults.analysisAborted = True
+        result.spoolPath = None
+        if not rateOfChangeAnalyzer is None:
+            rateOfChangeAnalyzer.RemoveOutput()
+            if os.path.isfile( rateOfChangeAnalyzer.outputSpoolPath ):
+                os.remove( rateOfChangeAnalyzer.outputSpoolPath )
+
+    finally:
+        if not audioAnalysis is None:
+            audioAnalysis.Wait()
+        if not sourceStager is None:
+            sourceStager.Close()
+        if not metadataStore is None:
+            metadataStore.Close()
+        logger.Close()
+        os.rename( tempLoggingFilePath, os.path.join( args.destFolder, a[ 0 ] + ".txt" ) )
+
+    return result
+
+
+# Continues a session with the analysis of a worker process, which started from a fresh base of comparison. As for the
+# seams of time ranges (see AddVideoFileToAnalysisInRanges), the start of the file is analyzed again from the state the
+# previous file ended with, until it triggers on a frame and coefficient the worker also triggered on: from there on,
+# the worker's analysis is the sequential one. Returns the spooled outputs, as (spool path, first frame index taken from it).
+# The results of the job are updated to the reconciled analysis.
+def ReconcileVideoFileJob( args, result, baseState, metadataStore, logger, rateOfChangeAnalyzer ):
+    a = result.fileStats
+    seamSpoolPath = os.path.join( args.destFolder, videoAnalyzeRateOfChange.kTempFilePrefix + a[ 0 ] + "_seam.spool" )
+    (seamPerformanceResults, seamBaseState, seamLastFrameIndex, _, syncFrameIndex) = videoAnalyzeRateOfChange.AnalyzeVideoRangeJob( \
+        args, a[ 0 ], (0, None), seamSpoolPath, baseState, set( result.triggers ), metadataStore.Get( a[ 0 ] ) )
+
+    if syncFrameIndex is None:
+        # never synchronized, or aborted: the analysis from the previous file replaces the worker's
+        logger.PrintMessage( "Frames analyzed again to reconcile with the previous file: %i" % seamLastFrameIndex )
+        seamPerformanceResults.totalFramesInVideoFile = result.algPerformanceResults.totalFramesInVideoFile
+        result.algPerformanceResults = seamPerformanceResults
+        result.baseState = seamBaseState
+        return [ (seamSpoolPath, 0) ]
+
+    logger.PrintMessage( "Frames analyzed again to reconcile with the previous file: %i" % syncFrameIndex )
+    result.algPerformanceResults.totalFramesTriggered = len( [ t for t in result.triggers if t[ 0 ] >= syncFrameIndex ] )
+    rateOfChangeAnalyzer.AddRangePerformanceResults( result.algPerformanceResults, seamPerformanceResults )
+    return [ (seamSpoolPath, 0), (result.spoolPath, syncFrameIndex) ]
+
+
+# Analyzes several source files at once in worker processes. The results are added to the sessions in chronological
+# order, with the session rules of the sequential analysis, and reconciled with the state the previous file of
+# the session ended with: the sessions and their frames are the ones of a sequential analysis.
+def runParallelAnalysis( args, tobeAnalyzedVideos, jobSizeBytes, jobLogger, jobs, analysisCache, jobMetrics, metadataStore ):
+    jobStartTime = perf_counter()
+    totalSourceProcessed = 0
+    diskReadingDuration = 0.0
+    audioDuration = 0.0
+    audioWaitDuration = 0.0
 
-    jobLogger.PrintMessage( "" )
-    jobLogger.PrintMessage( "All done." )
+    moveToAnalyzed = DelayedMoveOperation( "AnalyzedVideos" )
+    moveToAborted = DelayedMoveOperation( "AbortedVideos" )
+
+    count = 1
+    rateOfChangeAnalyzer = None
+    sessionStartTime = 0
+    sessionBaseState = None
+
+    # Largest files first, so the batch does not end waiting for a large file started last
+    scheduleOrder = sorted( tobeAnalyzedVideos, key = lambda x: x[ 2 ], reverse = True )
+    jobLogger.PrintMessage( "Analyzing with %i worker processes" % jobs )
+
+    with concurrent.futures.ProcessPoolExecutor( max_workers = jobs ) as executor:
+        futures = {}
+        for a in scheduleOrder:
+            futures[ a[ 0 ] ] = executor.submit( AnalyzeVideoFileJob, a, args )
+
+        for a in tobeAnalyzedVideos:
+            try:
+                try:
+                    result = futures[ a[ 0 ] ].result()
+                except Exception as e:
+                    # the job failed outside of the analysis, e.g. its worker process died: only this file is aborted
+                    jobLogger.PrintMessage( str( e ) )
+                    jobLogger.PrintMessage( "Exception thrown by the analysis job of %s, aborting this file" % a[ 0 ] )
+                    result = VideoFileJobResult( a )
+                    result.algPerformanceResults = videoAnalyzeRateOfChange.AlgorithmPerformanceResults()
+                    result.algPerformanceResults.analysisAborted = True
+                algPerformanceResults = result.algPerformanceResults
+
+                print( "" )
+                print( "-----------------------%i/%i--------------------------" % (count, len( tobeAnalyzedVideos )) )
+                jobLogger.PrintMessage( "Analysis done for " + vh.GetFormattedFileStats( a ) )
+
+                #
+                # Add the frames detected in this file to the current session
+                #
+
+                spoolOutputs = [ (result.spoolPath, 0) ]
+                if rateOfChangeAnalyzer is None:
+                    sessionName = GetSessionName( args, a[ 1 ] )
+                    sessionStartTime = a[ 1 ]
+                    rateOfChangeAnalyzer = videoAnalyzeRateOfChange.RateOfChangeAnalyzer( args, sessionName )
+                elif not algPerformanceResults.analysisAborted:
+                    # a file of another resolution is aborted there, as in the sequential analysis
+                    try:
+                        spoolOutputs = ReconcileVideoFileJob( args, result, sessionBaseState, metadataStore, jobLogger, rateOfChangeAnalyzer )
+                    except Exception as e:
+                        jobLogger.PrintMessage( str( e ) )
+                        jobLogger.PrintMessage( "Exception thrown while reconciling %s with the previous file, aborting this file" % a[ 0 ] )
+                        result.algPerformanceResults.analysisAborted = True
+                        spoolOutputs = []
+                    algPerformanceResults = result.algPerformanceResults
+                sessionBaseState = result.baseState
+
+                try:
+                    for (spoolPath, firstFrameIndex) in spoolOutputs:
+                        if not spoolPath is None:
+                            rateOfChangeAnalyzer.AddSpooledFrames( spoolPath, firstFrameIndex, a[ 0 ] )
+                finally:
+                    for spoolPath in set( [ result.spoolPath ] + [ o[ 0 ] for o in spoolOutputs ] ):
+                        if not spoolPath is None and os.path.isfile( spoolPath ):
+                            os.remove( spoolPath )
+
+                if algPerformanceResults.analysisAborted:
+                    moveToAborted.AddFile( a[ 0 ] )
+                else:
+                    moveToAnalyzed.AddFile( a[ 0 ] )
+                analysisCache.AddResult( a, algPerformanceResults.analysisAborted )
+
+                #
+                # Session(time segment) management
+                #
+
+                if SessionComplete( sessionStartTime, a, metadataStore, algPerformanceResults.analysisAborted, rateOfChangeAnalyzer ):
+                    FinalizeSession( rateOfChangeAnalyzer, moveToAnalyzed, moveToAborted, analysisCache )
+                    rateOfChangeAnalyzer = None
+                    jobLogger.PrintMessage( "Finalizing current session at %i" % count )
+
+                count += 1
+
+                #
+                # Perf counters
+                #
+
+                totalSourceProcessed += a[ 2 ]
+                diskReadingDuration += result.diskReadingDuration
+                audioDuration += result.audioDuration
+                audioWaitDuration += result.audioWaitDuration
+                currentTime = perf_counter()
+                jobRunningTimePerf = totalSourceProcessed / (1024.0 * 1024.0 * ( currentTime - jobStartTime ) )
+                # files whose job failed may not have been read
+                dataReadPerf = totalSourceProcessed / (1024.0 * 1024.0 * max( diskReadingDuration, 1e-6 ) )
+
+                jobLogger.PrintMessage( "Reading source data at %.2f MiB/s (per worker)" % dataReadPerf )
+                RecordFileMetrics( jobMetrics, a, algPerformanceResults, jobSizeBytes - totalSourceProcessed, \
+                    dict( read = result.diskReadingDuration, analysis = result.analysisDuration, \
+                        audio = result.audioDuration, audioWait = result.audioWaitDuration ) )
+                jobLogger.PrintMessage( "Extracting audio for %.2f s, of which %.2f s waited for after the analysis" % (audioDuration, audioWaitDuration) )
+                jobLogger.PrintMessage( "Processing source data at a rate of %.2f MiB/s" % jobRunningTimePerf )
+                if jobSizeBytes - totalSourceProcessed > 0:
+                    jobLogger.PrintMessage( "Remaining time to finish: %.2f min" % \
+                        float( (( jobSizeBytes - totalSourceProcessed ) / totalSourceProcessed ) * ( currentTime - jobStartTime ) / 60.0) )
+
+            except Exception as e:
+                jobLogger.PrintMessage( str( e ) )
+                jobLogger.PrintMessage( "Exception thrown during processing, finalizing" )
+                for f in futures.values():
+                    f.cancel()
+                break
+
+    if not rateOfChangeAnalyzer is None:
+        moveToAnalyzed.Commit()
+        moveToAborted.Commit()
+        rateOfChangeAnalyzer.FinishAnalysis()
+        analysisCache.Commit( GetSessionOutputPath( rateOfChangeAnalyzer ) )
 
 
 if __name__ == "__main__":
@@ -324,10 +861,62 @@ if __name__ == "__main__":
         help = "optional destination folder for results of analysis. Default: current working directory" )
     parser.add_argument( "--verboseRunningTime", action = "store_true",
         help = "enables display of running time performance split per phases of the algorithm" )
+    parser.add_argument( "--luminanceMethod", choices = [ videoAnalyzeRateOfChange.kLuminanceMethodFixedPoint, videoAnalyzeRateOfChange.kLuminanceMethodPIL ],
+        default = videoAnalyzeRateOfChange.kLuminanceMethodPIL,
+        help = "luminance calculation used for frame preparation. Default: %(default)s" )
+    parser.add_argument( "--videoDecoder", choices = [ videoAnalyzeRateOfChange.kVideoDecoderImageIO, videoAnalyzeRateOfChange.kVideoDecoderFFmpegPipe ],
+        default = videoAnalyzeRateOfChange.kVideoDecoderImageIO, help = "video decoding backend. Default: %(default)s" )
+    parser.add_argument( "--analysisWidth", type = int, default = 0,
+        help = "with the ffmpegpipe decoder, frames are scaled by the decoder to this width. Default: source width" )
+    parser.add_argument( "--grayOutput", action = "store_true",
+        help = "with the ffmpegpipe decoder, skip decoding RGB frames and output the gray analysis frames" )
+    parser.add_argument( "--seekSkipThreshold", type = int, default = videoAnalyzeRateOfChange.kMinimumSeekSkip,
+        help = "with the ffmpegpipe decoder, frame skips of at least this many frames restart the decoder at the target frame, " \
+            "instead of decoding the skipped frames. 0 disables seeking. Default: %(default)s" )
+    parser.add_argument( "--prefetchFrames", type = int, nargs = "?", const = videoAnalyzeRateOfChange.kPrefetchCapacity, default = 0,
+        help = "decode frames ahead on a separate thread, in a ring of the given size. Default size: %i" % videoAnalyzeRateOfChange.kPrefetchCapacity )
+    parser.add_argument( "--jobs", type = int, default = 1,
+        help = "number of source files analyzed at once, in worker processes. Default: %(default)s" )
+    parser.add_argument( "--rangeJobs", type = int, default = 1,
+        help = "number of time ranges of a video file analyzed in parallel, in worker processes. Default: %(default)s" )
+    parser.add_argument( "--tileGrid", type = int, nargs = 2, metavar = ("COLUMNS", "ROWS"), default = None,
+        help = "also trigger on the rate of change of every tile of a grid, catching local motion. Default: whole frame only" )
+    parser.add_argument( "--coarseScreening", type = int, nargs = "?", const = videoAnalyzeRateOfChange.kScreeningFactor, default = 0,
+        help = "compare frames at full resolution only if a comparison on planes decimated by the given factor flags them. " \
+            "Default factor: %i" % videoAnalyzeRateOfChange.kScreeningFactor )
+    parser.add_argument( "--rewindFrames", type = int, nargs = "?", const = videoAnalyzeRateOfChange.kRewindCapacity, default = 0,
+        help = "keep the last frames read in a ring of the given size, to go back to the start of the motion after a frame skip. " \
+            "Default size: %i" % videoAnalyzeRateOfChange.kRewindCapacity )
+    parser.add_argument( "--skipPolicy", choices = [ videoAnalyzeRateOfChange.kSkipPolicyFixed, videoAnalyzeRateOfChange.kSkipPolicyAdaptive ],
+        default = videoAnalyzeRateOfChange.kSkipPolicyFixed,
+        help = "how frames are skipped while nothing triggers. With --rewindFrames, the fixed policy analyzes the skipped frames " \
+            "again after a trigger, the adaptive policy bisects them. Default: %(default)s" )
+    parser.add_argument( "--encoderQueueFrames", type = int, default = videoAnalyzeRateOfChange.kEncoderQueueCapacity,
+        help = "output frames waiting to be encoded on a separate thread. 0 encodes on the analysis thread. Default: %(default)s" )
+    parser.add_argument( "--frameSpoolBudget", type = int, default = videoAnalyzeRateOfChange.kFrameSpoolBudget,
+        help = "MiB of detected frames kept in a memory-mapped file in the destination folder, before they are written. " \
+            "Default: %(default)s" )
+    parser.add_argument( "--compressFrames", action="store_true",
+        help = "keep the detected frames compressed in memory until they are written, instead of in a memory-mapped file" )
+    parser.add_argument( "--recordSignals", action="store_true",
+        help = "save per-frame signals of the analysis next to the output, to replay the trigger logic with other thresholds. " \
+            "Cannot be combined with --rangeJobs" )
+    parser.add_argument( "--profile", action = "store_true",
+        help = "write a report per video file next to its log: CPU profile of the frame loop, tracemalloc differences sampled " \
+            "every %i s, and the memory and object count growth over the file and since the job started" % vh.kProfileSampleInterval )
+    parser.add_argument( "--audioSpectrogram", action = "store_true",
+        help = "also save a spectrogram and band energies of the audio, and detect narrowband and ultrasonic anomalies" )
+    parser.add_argument( "--stagingBudget", type = int, default = kStagingBudget,
+        help = "MiB of source files copied to memory ahead of their analysis, while the previous file is analyzed. " \
+            "Larger files are read in place, 0 reads all files in place. Default: %(default)s" )
+    parser.add_argument( "--reanalyzeAborted", action="store_true",
+        help = "analyze again the source files whose previous analysis with the same parameters was aborted" )
     parser.add_argument( "--cont", action="store_true",
         help="ignores all other parameters and continues previous run from %s file" % CMDS_FILE_NAME )
 
     args = parser.parse_args()
+    if args.recordSignals and args.rangeJobs > 1:
+        parser.error( "--recordSignals cannot be combined with --rangeJobs: the signals of a file are recorded by a sequential analysis" )
 
     # continue previous run?
     if args.cont:
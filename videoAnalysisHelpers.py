@@ -6,12 +6,29 @@
 #      04.02.2022 voicua: Created "videoAnalysisHelpers.py" to contain common constructs.
 
 import os
+import io
+import sys
+import struct
 import time
+import hashlib
+import json
+import bisect
+import fractions
+import platform
+import calendar
+import sqlite3
+import concurrent.futures
+import psutil
+import ffmpeg
+import numpy
 
 
 import tracemalloc
+import cProfile
+import pstats
 from collections import defaultdict
 import gc
+from time import perf_counter
 
 
 class Logger:
@@ -45,6 +62,299 @@ def GetFormattedFileStats( f ):
         FormatMemSize( f[ 2 ] )
 
 
+# Identifies the content of a file without reading all of it: a hash of its size and of kFingerprintSampleCount blocks
+# spread evenly over the file, the first and last blocks included. Small files are hashed entirely.
+kFingerprintSampleCount = 16
+kFingerprintSampleSize = 64 * 1024
+
+def GetFileFingerprint( filePath ):
+    fileSize = os.path.getsize( filePath )
+    fingerprint = hashlib.blake2b( str( fileSize ).encode( 'ascii' ), digest_size = 16 )
+    with open( filePath, 'rb' ) as f:
+        if fileSize <= kFingerprintSampleCount * kFingerprintSampleSize:
+            fingerprint.update( f.read() )
+        else:
+            for i in range( kFingerprintSampleCount ):
+                f.seek( i * (fileSize - kFingerprintSampleSize) // (kFingerprintSampleCount - 1) )
+                fingerprint.update( f.read( kFingerprintSampleSize ) )
+    return fingerprint.hexdigest()
+
+
+# Writes a NumPy array file row by row, when the number of rows is not known in advance. The header is written
+# again with the final shape when the file is closed, padded to the size it was given for any number of rows.
+class StreamingArrayWriter:
+    kHeaderSize = 128
+
+    def __init__( self, filePath, dtype, rowShape ):
+        self.file = open( filePath, 'wb' )
+        self.dtype = numpy.dtype( dtype )
+        self.rowShape = tuple( rowShape )
+        self.rowCount = 0
+        # large enough for the header of any number of rows, in blocks of 64 bytes as numpy aligns the data
+        longestHeader = len( numpy.lib.format.magic( 1, 0 ) ) + 2 + len( self.HeaderText( sys.maxsize ) ) + 1
+        self.headerSize = max( self.kHeaderSize, (longestHeader + 63) // 64 * 64 )
+        self.file.write( self.Header() )
+
+    def AppendRows( self, rows ):
+        self.file.write( numpy.ascontiguousarray( rows, self.dtype ).tobytes() )
+        self.rowCount += len( rows )
+
+    def Close( self ):
+        if self.file.closed:
+            return
+        self.file.seek( 0 )
+        self.file.write( self.Header() )
+        self.file.close()
+
+    def HeaderText( self, rowCount ):
+        return "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % \
+            (numpy.lib.format.dtype_to_descr( self.dtype ), (rowCount,) + self.rowShape)
+
+    def Header( self ):
+        header = self.HeaderText( self.rowCount )
+        prefix = numpy.lib.format.magic( 1, 0 )
+        header += ' ' * (self.headerSize - len( prefix ) - 2 - len( header ) - 1) + '\n'
+        return prefix + struct.pack( '<H', len( header ) ) + header.encode( 'latin1' )
+
+
+# Upper bounds of the latency histogram buckets, in seconds: powers of 2 from 10 us to about 22 min, so the same buckets
+# fit per frame stages and per file stages.
+kLatencyBucketBounds = [ 1e-5 * 2 ** i for i in range( 28 ) ]
+
+class LatencyHistogram:
+    def __init__( self ):
+        self.bucketCounts = [ 0 ] * (len( kLatencyBucketBounds ) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def Observe( self, duration ):
+        self.bucketCounts[ bisect.bisect_left( kLatencyBucketBounds, duration ) ] += 1
+        self.count += 1
+        self.sum += duration
+
+    def Merge( self, other ):
+        self.bucketCounts = [ c + o for (c, o) in zip( self.bucketCounts, other.bucketCounts ) ]
+        self.count += other.count
+        self.sum += other.sum
+
+    # Upper bound of the bucket holding the q quantile; None if nothing was observed, or if it's past the last bound
+    def Quantile( self, q ):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulativeCount = 0
+        for (i, c) in enumerate( self.bucketCounts[ : -1 ] ):
+            cumulativeCount += c
+            if cumulativeCount >= rank:
+                return kLatencyBucketBounds[ i ]
+        return None
+
+    def AsDict( self ):
+        return { "count": self.count, "sum": self.sum, \
+            "p50": self.Quantile( 0.5 ), "p90": self.Quantile( 0.9 ), "p99": self.Quantile( 0.99 ), \
+            "buckets": self.bucketCounts }
+
+
+# Metrics of a whole job: counters, latency histograms per stage and memory gauges, never reset.
+# Exported to destFolder after every file, as a JSON line per file, and as a Prometheus text file with the job totals
+# (rewritten atomically, so it can be scraped with the node exporter textfile collector).
+kMetricsFileName = "processVideosMetrics"
+kMetricsPrefix = "roc_"
+
+kMetricsCounters = [
+    ("files_analyzed_total", "Source files analyzed, aborted ones included."),
+    ("files_aborted_total", "Source files the rate of change analysis aborted."),
+    ("source_bytes_total", "Bytes of the source files analyzed."),
+    ("frames_processed_total", "Frames analyzed by the rate of change algorithm."),
+    ("frames_skipped_total", "Frames skipped by the skip policy."),
+    ("frames_triggered_total", "Frames found interesting and written to the output."),
+]
+
+kMetricsGauges = [
+    ("resident_memory_bytes", "Resident memory of the job process."),
+    ("peak_resident_memory_bytes", "Peak resident memory of the job process, sampled after every file."),
+    ("analysis_peak_resident_memory_bytes", "Peak resident memory of the processes analyzing a file."),
+    ("remaining_bytes", "Bytes of the source files still to be analyzed."),
+]
+
+class JobMetrics:
+    def __init__( self, destFolder ):
+        self.jsonLinesPath = os.path.join( destFolder, kMetricsFileName + ".jsonl" )
+        self.prometheusPath = os.path.join( destFolder, kMetricsFileName + ".prom" )
+        self.hostName = platform.node()
+        self.counters = dict( (name, 0) for (name, _) in kMetricsCounters )
+        self.gauges = dict( (name, 0) for (name, _) in kMetricsGauges )
+        self.stageLatencies = defaultdict( LatencyHistogram )     # per frame stages
+        self.fileStageDurations = defaultdict( LatencyHistogram ) # per file stages
+
+    def AddCounter( self, name, value = 1 ):
+        self.counters[ name ] += value
+
+    def SetGauge( self, name, value ):
+        self.gauges[ name ] = value
+
+    def ObserveFileStage( self, stage, duration ):
+        self.fileStageDurations[ stage ].Observe( duration )
+
+    def MergeStageLatencies( self, stageLatencies ):
+        for (stage, histogram) in stageLatencies.items():
+            self.stageLatencies[ stage ].Merge( histogram )
+
+    def SampleMemory( self ):
+        rss = psutil.Process().memory_info().rss
+        self.gauges[ "resident_memory_bytes" ] = rss
+        self.gauges[ "peak_resident_memory_bytes" ] = max( self.gauges[ "peak_resident_memory_bytes" ], rss )
+
+    def AppendRecord( self, record ):
+        line = dict( time = time.time(), host = self.hostName )
+        line.update( record )
+        with open( self.jsonLinesPath, 'a' ) as f:
+            f.write( json.dumps( line ) + "\n" )
+
+    def FormatPrometheusHistograms( self, lines, name, helpText, histograms ):
+        lines.append( "# HELP %s%s %s" % (kMetricsPrefix, name, helpText) )
+        lines.append( "# TYPE %s%s histogram" % (kMetricsPrefix, name) )
+        for stage in sorted( histograms ):
+            h = histograms[ stage ]
+            cumulativeCount = 0
+            for (bound, c) in zip( kLatencyBucketBounds + [ "+Inf" ], h.bucketCounts ):
+                cumulativeCount += c
+                le = bound if bound == "+Inf" else "%g" % bound
+                lines.append( '%s%s_bucket{stage="%s",le="%s"} %i' % (kMetricsPrefix, name, stage, le, cumulativeCount) )
+            lines.append( '%s%s_sum{stage="%s"} %.6f' % (kMetricsPrefix, name, stage, h.sum) )
+            lines.append( '%s%s_count{stage="%s"} %i' % (kMetricsPrefix, name, stage, h.count) )
+
+    def WritePrometheusFile( self ):
+        lines = []
+        for (name, helpText) in kMetricsCounters:
+            lines.append( "# HELP %s%s %s" % (kMetricsPrefix, name, helpText) )
+            lines.append( "# TYPE %s%s counter" % (kMetricsPrefix, name) )
+            lines.append( "%s%s %i" % (kMetricsPrefix, name, self.counters[ name ]) )
+        for (name, helpText) in kMetricsGauges:
+            lines.append( "# HELP %s%s %s" % (kMetricsPrefix, name, helpText) )
+            lines.append( "# TYPE %s%s gauge" % (kMetricsPrefix, name) )
+            lines.append( "%s%s %i" % (kMetricsPrefix, name, self.gauges[ name ]) )
+        self.FormatPrometheusHistograms( lines, "stage_latency_seconds", "Duration of the per frame analysis stages.", self.stageLatencies )
+        self.FormatPrometheusHistograms( lines, "file_stage_seconds", "Duration of the per file job stages.", self.fileStageDurations )
+
+        tempPath = self.prometheusPath + ".tmp"
+        with open( tempPath, 'w' ) as f:
+            f.write( "\n".join( lines ) + "\n" )
+        os.replace( tempPath, self.prometheusPath )
+
+    def Export( self, record ):
+        self.SampleMemory()
+        self.AppendRecord( record )
+        self.WritePrometheusFile()
+
+
+# Exact value of an ffprobe frame rate ("30000/1001"), 0 if it is unknown ("0/0")
+def ParseFrameRate( frameRateText ):
+    frameRatePair = frameRateText.split( '/' )
+    if len( frameRatePair ) == 2 and int( frameRatePair[ 1 ] ) == 0:
+        return fractions.Fraction( 0 )
+    return fractions.Fraction( frameRateText )
+
+
+# Video file properties, from the ffprobe results of the file: first video stream, and container
+class VideoMetadata:
+    def __init__( self, probeResult ):
+        self.probeResult = probeResult
+        streams = probeResult[ "streams" ]
+        videoStreams = [ stream for stream in streams if stream.get( "codec_type" ) == "video" ]
+        stream = videoStreams[ 0 ] if len( videoStreams ) > 0 else streams[ 0 ]
+        containerInfo = probeResult.get( "format", {} )
+
+        self.width = stream[ "width" ]
+        self.height = stream[ "height" ]
+        self.frameRateText = stream[ "avg_frame_rate" ]
+        self.frameRate = float( ParseFrameRate( self.frameRateText ) )
+        # r_frame_rate is the lowest rate all the frame timestamps are multiples of. It is the average rate only if the
+        # frame rate is constant, which seeking by timestamp relies on (see GetSeekTimestamp in videoAnalyzeRateOfChange).
+        self.rFrameRateText = stream.get( "r_frame_rate", "0/0" )
+        self.constantFrameRate = self.frameRate > 0 and ParseFrameRate( self.rFrameRateText ) == ParseFrameRate( self.frameRateText )
+        self.durationText = stream.get( "duration", containerInfo.get( "duration", "0" ) )
+        self.duration = float( self.durationText )
+        # exact count from the container index, or from counting the packets when the container has no index (see ProbeVideoFile)
+        self.frameCount = int( stream.get( "nb_frames", stream.get( "nb_read_packets", 0 ) ) )
+        self.creationTime = None    # seconds since the epoch, UTC
+        for tags in (stream.get( "tags", {} ), containerInfo.get( "tags", {} )):
+            if "creation_time" in tags:
+                self.creationTime = calendar.timegm( time.strptime( tags[ "creation_time" ][ : 19 ], "%Y-%m-%dT%H:%M:%S" ) )
+
+
+def ProbeVideoFile( filePath ):
+    probeResult = ffmpeg.probe( filePath )
+    videoStreams = [ stream for stream in probeResult[ "streams" ] if stream.get( "codec_type" ) == "video" ]
+    if len( videoStreams ) > 0 and not "nb_frames" in videoStreams[ 0 ]:
+        # reads the whole file, but does not decode it
+        probeResult = ffmpeg.probe( filePath, count_packets = None )
+    return probeResult
+
+
+# Metadata of video files, in a SQLite store (storePath, in memory if None) keyed by path, size and modification time,
+# so a file is probed once across runs. ProbeAll probes the files not in the store concurrently: probing is mostly
+# waiting for ffprobe, and for the media the files are on.
+kVideoMetadataFileName = "videoMetadata.sqlite"
+kProbeWorkers = 8
+
+class VideoMetadataStore:
+    def __init__( self, storePath = None, maxWorkers = kProbeWorkers ):
+        self.maxWorkers = maxWorkers
+        self.connection = sqlite3.connect( ":memory:" if storePath is None else storePath, timeout = 30 )
+        self.connection.execute( "CREATE TABLE IF NOT EXISTS videoMetadata ( path TEXT PRIMARY KEY, fileSize INTEGER, " \
+            "modificationTime REAL, probeResult TEXT )" )
+
+    def GetKey( self, filePath ):
+        fileStats = os.stat( filePath )
+        return (os.path.abspath( filePath ), fileStats.st_size, fileStats.st_mtime)
+
+    def InsertRow( self, filePath, videoMetadata ):
+        self.connection.execute( "INSERT OR REPLACE INTO videoMetadata VALUES ( ?, ?, ?, ? )", \
+            self.GetKey( filePath ) + (json.dumps( videoMetadata.probeResult ),) )
+
+    def Add( self, filePath, videoMetadata ):
+        with self.connection:
+            self.InsertRow( filePath, videoMetadata )
+
+    # Metadata of the file from the store, None if it was not probed, or if the file changed since
+    def Lookup( self, filePath ):
+        if not os.path.isfile( filePath ):
+            return None
+        row = self.connection.execute( "SELECT probeResult FROM videoMetadata WHERE path = ? AND fileSize = ? AND modificationTime = ?", \
+            self.GetKey( filePath ) ).fetchone()
+        return None if row is None else VideoMetadata( json.loads( row[ 0 ] ) )
+
+    # Metadata of the file, probed if not in the store. Probing errors are raised.
+    def Get( self, filePath ):
+        videoMetadata = self.Lookup( filePath )
+        if videoMetadata is None:
+            videoMetadata = VideoMetadata( ProbeVideoFile( filePath ) )
+            self.Add( filePath, videoMetadata )
+        return videoMetadata
+
+    # Probes the files not in the store, then adds them in one transaction, so the store is not locked while probing.
+    # Returns the files which could not be probed, with the error.
+    def ProbeAll( self, filePaths ):
+        missingPaths = [ f for f in filePaths if self.Lookup( f ) is None ]
+        probed = []
+        failures = []
+        with concurrent.futures.ThreadPoolExecutor( max_workers = self.maxWorkers ) as executor:
+            futures = [ (f, executor.submit( ProbeVideoFile, f )) for f in missingPaths ]
+            for (f, future) in futures:
+                try:
+                    probed.append( (f, VideoMetadata( future.result() )) )
+                except Exception as e:
+                    failures.append( (f, e) )
+        with self.connection:
+            for (f, videoMetadata) in probed:
+                self.InsertRow( f, videoMetadata )
+        return failures
+
+    def Close( self ):
+        self.connection.close()
+
+
 class ObjectsTracker:
     def __init__( self ):
         self.before = None
@@ -68,10 +378,37 @@ class ObjectsTracker:
         else:
             self.before = self.after
 
+    # Types with more objects than at the baseline, largest growth first
+    def FormatStats( self, topCount = None ):
+        growth = [ (self.after[ k ] - self.before[ k ], k) for k in self.after if self.after[ k ] - self.before[ k ] > 0 ]
+        growth.sort( key = lambda x: x[ 0 ], reverse = True )
+        return [ "{0:60}{1:>15}".format( str( k ), str( g ) ) for (g, k) in growth[ : topCount ] ]
+
+    def PrintStats( self ):
+        for line in self.FormatStats():
+            print( line )
+
+
+# Memory allocated by Python and numpy, between StartTracking and TakeSnapshot: what is still allocated, and the peak.
+class AllocationTracker:
+    def __init__( self ):
+        self.before = 0
+        self.allocated = 0
+        self.peak = 0
+
+    def StartTracking( self ):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.before = tracemalloc.get_traced_memory()[ 0 ]
+
+    def TakeSnapshot( self ):
+        (current, peak) = tracemalloc.get_traced_memory()
+        self.allocated = current - self.before
+        self.peak = peak - self.before
+
     def PrintStats( self ):
-        for k in self.after:
-            if self.after[ k ] - self.before[ k ] > 0:
-                print( "{0:20}{1:15}".format( str( k ), str( self.after[ k ] - self.before[ k ] ) ) )
+        print( "Allocated: %i bytes, peak: %i bytes" % (self.allocated, self.peak) )
 
 
 def TraceMallocSnapshot():
@@ -81,3 +418,114 @@ def TraceMallocSnapshot():
     print("[ Top 10 allocations ]")
     for stat in top_stats[:10]:
         print(stat)
+
+
+# Profiling of analyses, enabled with --profile, to find where time goes and what keeps growing over long batches.
+# For every file, a report is written next to its log: memory samples taken every kProfileSampleInterval seconds of the
+# frame loop (top tracemalloc differences since the previous sample), the memory and object count growth over the file
+# and since the profiler was created, and the CPU profile of the frame loop (also saved in pstats format).
+# Tracing allocations slows down the analysis noticeably, the reports are for comparisons between profiled runs.
+kProfileSampleInterval = 60
+kProfileTopCount = 15
+kProfileReportSuffix = ".profile.txt"
+kProfileStatsSuffix = ".prof"
+
+class AnalysisProfiler:
+    def __init__( self, topCount = kProfileTopCount, sampleInterval = kProfileSampleInterval ):
+        self.topCount = topCount
+        self.sampleInterval = sampleInterval
+        self.reportPathName = None
+        self.reportPath = None
+        self.cpuProfile = None
+        self.startedTracing = not tracemalloc.is_tracing()
+        if self.startedTracing:
+            tracemalloc.start()
+        # objects are counted while the profiler holds only this snapshot, so its own objects do not show up in the growth
+        self.jobSnapshot = self.TakeSnapshot()
+        gc.collect()
+        self.jobObjects = ObjectsTracker()
+        self.jobObjects.StartTracking()
+        self.fileObjects = ObjectsTracker()
+        self.fileSnapshot = None
+        self.lastSnapshot = None
+        self.lastSampleTime = 0
+
+    def TakeSnapshot( self ):
+        return tracemalloc.take_snapshot().filter_traces( ( \
+            tracemalloc.Filter( False, tracemalloc.__file__ ), tracemalloc.Filter( False, "<frozen importlib._bootstrap*>" ) ) )
+
+    def WriteReport( self, lines ):
+        with open( self.reportPath, 'a' ) as f:
+            f.write( "\n".join( lines ) + "\n" )
+
+    def FormatSnapshotDiff( self, snapshot, baseSnapshot ):
+        stats = snapshot.compare_to( baseSnapshot, 'lineno' )
+        sizeDiff = sum( stat.size_diff for stat in stats )
+        return [ "Traced memory: %.2f MiB (%+.2f MiB)" % (tracemalloc.get_traced_memory()[ 0 ] / (1024.0 * 1024.0), sizeDiff / (1024.0 * 1024.0)) ] + \
+            [ "  " + str( stat ) for stat in stats[ : self.topCount ] ]
+
+    # The report and the CPU profile are written to reportPathName + kProfileReportSuffix and + kProfileStatsSuffix
+    def StartFile( self, reportPathName, title ):
+        self.reportPathName = reportPathName
+        self.reportPath = reportPathName + kProfileReportSuffix
+        gc.collect()
+        self.fileObjects.StartTracking()
+        self.cpuProfile = cProfile.Profile()
+        self.fileSnapshot = self.TakeSnapshot()
+        self.lastSnapshot = self.fileSnapshot
+        self.lastSampleTime = perf_counter()
+        with open( self.reportPath, 'w' ) as f:
+            f.write( "Profile of %s, started %s\n\n" % (title, time.strftime( '%Y.%m.%d %H:%M:%S' )) )
+
+    def EnableCpuProfile( self ):
+        if not self.cpuProfile is None:
+            self.cpuProfile.enable()
+
+    def DisableCpuProfile( self ):
+        if not self.cpuProfile is None:
+            self.cpuProfile.disable()
+
+    # Called from the frame loop; samples the memory every sampleInterval seconds, outside of the CPU profile
+    def Sample( self, label ):
+        currentTime = perf_counter()
+        if currentTime - self.lastSampleTime < self.sampleInterval:
+            return
+        self.DisableCpuProfile()
+        snapshot = self.TakeSnapshot()
+        self.WriteReport( [ "Memory sample at %s, RSS %s" % (label, FormatMemSize( psutil.Process().memory_info().rss )) ] + \
+            self.FormatSnapshotDiff( snapshot, self.lastSnapshot ) + [ "" ] )
+        self.lastSnapshot = snapshot
+        self.lastSampleTime = perf_counter()
+        self.EnableCpuProfile()
+
+    def FinishFile( self ):
+        self.DisableCpuProfile()
+        snapshot = self.TakeSnapshot()
+        lines = [ "Memory growth over the file, RSS %s" % FormatMemSize( psutil.Process().memory_info().rss ) ] + \
+            self.FormatSnapshotDiff( snapshot, self.fileSnapshot ) + [ "" ]
+        lines += [ "Memory growth since the profiling started" ] + self.FormatSnapshotDiff( snapshot, self.jobSnapshot ) + [ "" ]
+
+        # the frame loop is not profiled when the file is analyzed in ranges, by worker processes
+        cpuProfileReport = io.StringIO()
+        cpuProfileReport.write( "CPU profile of the frame loop\n" )
+        if len( self.cpuProfile.getstats() ) > 0:
+            pstats.Stats( self.cpuProfile, stream = cpuProfileReport ).sort_stats( pstats.SortKey.CUMULATIVE ).print_stats( 3 * self.topCount )
+            self.cpuProfile.dump_stats( self.reportPathName + kProfileStatsSuffix )
+        else:
+            cpuProfileReport.write( "Not profiled\n" )
+
+        self.cpuProfile = None
+        self.fileSnapshot = None
+        self.lastSnapshot = None
+        del snapshot
+        gc.collect()
+        objectCounts = ObjectsTracker.MakeDictionary()
+        self.fileObjects.after = objectCounts
+        self.jobObjects.after = objectCounts
+        lines += [ "Object count growth over the file" ] + self.fileObjects.FormatStats( self.topCount ) + [ "" ]
+        lines += [ "Object count growth since the profiling started" ] + self.jobObjects.FormatStats( self.topCount ) + [ "" ]
+        self.WriteReport( lines + [ cpuProfileReport.getvalue() ] )
+
+    def Close( self ):
+        if self.startedTracing:
+            tracemalloc.stop()
@@ -12,6 +12,14 @@
 
 import os
 import sys
+import math
+import functools
+import subprocess
+import concurrent.futures
+import threading
+import queue
+import tempfile
+import zlib
 from time import perf_counter
 import argparse
 
@@ -21,7 +29,6 @@ from PIL import Image
 import numpy
 
 import psutil
-#import profile
 #import gc
 
 #from decord import VideoReader
@@ -31,17 +38,67 @@ import psutil
 
 import videoAnalysisHelpers as vh
 
+kAnalyzerVersion = 1   # to be incremented by changes of the algorithm which change the output of an analysis
 kLuminanceDiffThreshold = 32
 kMotionDerivativeThreshold = 20.0 # percentage of change in modified pixel count
 kMinChange = 1500
+kTileMinChangeRatio = 4.0 # a tile of a grid of N tiles triggers from kTileMinChangeRatio * minChange / N changed pixels
 kTempFilePrefix = 'temp_ROC_'
 
-redMask = None
+kVideoDecoderImageIO = 'imageio'
+kVideoDecoderFFmpegPipe = 'ffmpegpipe'
+
+kSeamOverlapDuration = 5  # seconds analyzed before a time range starts, to establish its base of comparison
+
+kPrefetchCapacity = 8   # frames decoded ahead by the prefetching iterator, when enabled without a size
+kRewindCapacity = 32    # frames kept by the rewinding iterator, when enabled without a size. Covers the largest frame skip.
+kEncoderQueueCapacity = 16  # output frames waiting for the encoder thread. 0 writes the output on the analysis thread.
+kFrameSpoolBudget = 1000    # MiB of detected frames buffered before they are written to the output
+
+# Per-frame signals saved for replays of the trigger logic (see FrameSignalRecorder)
+kSignalFileSuffix = '.signals.npy'
+kSignalLuminanceThresholds = (16, 24, 32, 48, 64)   # changed pixels are counted at these luminance differences
+kSignalBlockRows = 4096     # rows kept in memory before they are written
+kSignalDtype = numpy.dtype( [ ('frameIndex', numpy.int64), ('timestamp', numpy.float64), ('baseIndex', numpy.int64), \
+    ('baseCoefficient', numpy.int64), ('earliestIndex', numpy.int64), \
+    ('changedPixels', numpy.int64, (len( kSignalLuminanceThresholds ),)), ('triggered', numpy.bool_) ] )
+
+# Index of the frames output by a session, saved next to its output (see DetectionIndex)
+kDetectionIndexSuffix = '_ROC_analyzed.index.npy'
+
+# Coarse screening: every frame is first compared on a plane decimated by this factor, in both directions.
+# Only the frames it flags as candidates are compared at full resolution. The candidate test uses the thresholds of the
+# full resolution test, scaled to the decimated plane and multiplied by kScreeningMargin, so it errs on the side of candidates.
+kScreeningFactor = 4
+kScreeningMargin = 0.5
+
+kSkipPolicyFixed = 'fixed'
+kSkipPolicyAdaptive = 'adaptive'
+
+# Changed pixels are highlighted by blending this color over them. Fully opaque by default.
+kHighlightColor = (255, 0, 0)
+kHighlightOpacity = 255
+
+kLuminanceMethodPIL = 'pil'
+kLuminanceMethodFixedPoint = 'fixedpoint'
+
+# ITU-R 601-2 luma weights in 16.16 fixed point. These are the weights PIL uses for convert( 'L' ),
+# so the fixed point kernel produces planes identical to the PIL path.
+# The weights are applied as float32 multiples of 2^-16: every product and partial sum stays below 2^24,
+# so the float32 arithmetic is exact, and the BLAS matrix-vector product does the per-pixel work.
+kLumaWeights = numpy.array( [ 19595, 38470, 7471 ], numpy.float32 ) / numpy.float32( 65536 )
+kLumaRounding = numpy.float32( 0.5 )
+kLumaBlockRows = 32     # rows converted per block, keeps the float32 scratch buffers in cache
 
 #TODO-Pri2 voicua: consider moving helper functions in corresponding helper units
 def FlagEnabled( args, flagName ):
     return (not args is None) and (flagName in args.__dict__) and args.__dict__[ flagName ]
 
+def ArgValue( args, argName, defaultValue ):
+    if args is None or not argName in args.__dict__ or args.__dict__[ argName ] is None:
+        return defaultValue
+    return args.__dict__[ argName ]
+
 
 def IsValueInInterval( point, thresholdAbsolute, valueToCheck ):
     return valueToCheck > point - thresholdAbsolute and valueToCheck < point + thresholdAbsolute
@@ -52,75 +109,185 @@ def IsValueInRelativeInterval( point, thresholdRelative, valueToCheck ):
     return IsValueInInterval( point, thresholdAbsolute, valueToCheck )
 
 
-def PrepareFrameForAnalysis( frameRawData ):
-    #TODO-Pri0 voicua: use aggregate (see python's "Panda") instead of Image to calculate Luminance
-    #   currently PrepareFrameForAnalysis is the most expensive operation 
+# Vectorized RGB -> luminance conversion, with integer weights. Keeps its intermediate planes between calls,
+# so converting a frame of the same resolution does not allocate.
+class FixedPointLuminanceKernel:
+    def __init__( self ):
+        self.blockPixels = None
+        self.blockLuminance = None
+
+    def Convert( self, frameRawData, out = None ):
+        height, width = frameRawData.shape[ 0:2 ]
+        blockSize = kLumaBlockRows * width
+        if self.blockPixels is None or len( self.blockPixels ) != blockSize:
+            self.blockPixels = numpy.empty( (blockSize, 3), numpy.float32 )
+            self.blockLuminance = numpy.empty( blockSize, numpy.float32 )
+        if out is None:
+            out = numpy.empty( (height, width), numpy.uint8 )
+
+        pixels = frameRawData.reshape( -1, 3 )
+        luminance = out.reshape( -1 )
+        for start in range( 0, len( pixels ), blockSize ):
+            end = min( start + blockSize, len( pixels ) )
+            blockPixels = self.blockPixels[ 0:end - start ]
+            blockLuminance = self.blockLuminance[ 0:end - start ]
+            numpy.copyto( blockPixels, pixels[ start:end ] )
+            numpy.matmul( blockPixels, kLumaWeights, out = blockLuminance )
+            numpy.add( blockLuminance, kLumaRounding, out = blockLuminance )
+            numpy.copyto( luminance[ start:end ], blockLuminance, casting = 'unsafe' )
+        return out
+
+
+# luminanceKernel = None selects the PIL path. Otherwise the kernel writes into out, if given.
+def PrepareFrameForAnalysis( frameRawData, luminanceKernel = None, out = None ):
+    if not luminanceKernel is None:
+        return luminanceKernel.Convert( frameRawData, out )
+
     img = Image.fromarray( frameRawData, 'RGB' )
     img = img.convert( 'L' )
-    return numpy.array( img, numpy.int16 )
+    if out is None:
+        return numpy.array( img, numpy.uint8 )
+    numpy.copyto( out, numpy.asarray( img ) )
+    return out
 
 
-def MotionDerivativeDetected( previousCoefficient, newCoefficient ):
+# minChange is given in changed pixels, at the resolution used for analysis.
+# With tile coefficients (see CalculateTileDifferenceCoefficients), a change in a single tile also triggers,
+# so local motion is detected without lowering minChange for the whole frame.
+def MotionDerivativeDetected( previousCoefficient, newCoefficient, minChange = kMinChange, \
+        previousTileCoefficients = None, newTileCoefficients = None, derivativeThreshold = kMotionDerivativeThreshold ):
     if previousCoefficient < 0:
         return True
 
-    if abs( newCoefficient - previousCoefficient ) < kMinChange:
+    if not previousTileCoefficients is None and not newTileCoefficients is None and \
+            TileMotionDerivativeDetected( previousTileCoefficients, newTileCoefficients, minChange, derivativeThreshold ):
+        return True
+
+    if abs( newCoefficient - previousCoefficient ) < minChange:
         return False
 
-    threshold = float( previousCoefficient * kMotionDerivativeThreshold / 100.0 )
+    threshold = float( previousCoefficient * derivativeThreshold / 100.0 )
     return (newCoefficient < previousCoefficient - threshold) or (newCoefficient > previousCoefficient + threshold)
 
 
-def AlphaMaskCalculation( diff ):
-    numpy.multiply( diff, 255, out = diff )
-    numpy.minimum( diff, 255, out = diff )
-
-    diff = numpy.reshape( diff, ( len( diff ), len( diff[ 0 ] ), 1 ) )
-    diff = numpy.tile( diff, 3 )
-
-    return diff
-
-
-def CalculateDifferenceCoefficient( baseComparison, newComparison, currentFrame = None, args = None ):
-    diff = (newComparison - baseComparison)
-    numpy.divide( diff, kLuminanceDiffThreshold, out = diff, casting = 'unsafe' )
-
-    diffCoefficient = numpy.count_nonzero( diff )
-
-    if FlagEnabled( args, "highlightDiffs" ):
-
-        # Use Alpha-Blending technique with alpha fully opaque to highlight the changed area.
-        diff = AlphaMaskCalculation( diff )
-        oneMinusDiff = numpy.subtract( 255, diff )
-
-        #print( "Width = " + str( len( currentFrame ) ) + ", Height = " + str( len( currentFrame[ 0 ] ) ) )
-        #print( "Channels = " + str( len( currentFrame[ 0 ][ 0 ] ) ) )
-        #print( currentFrame.dtype )
-
-        global redMask
-        if redMask is None:
-            colorRed = numpy.array( [ 255, 0, 0 ] )
-            redMask = numpy.tile( colorRed, (len( currentFrame ), len( currentFrame[ 0 ] ), 1) )
-
-        # do the alpha blending
-        numpy.multiply( diff, redMask, out = diff )
-        numpy.divide( diff, 255, out = diff, casting = 'unsafe' )
-
-        if FlagEnabled( args, "onlyDiffs" ):
-            numpy.multiply( currentFrame, 0, out = currentFrame )   # zero out the original image
+# Same policy as MotionDerivativeDetected, applied to every tile at once
+def TileMotionDerivativeDetected( previousTileCoefficients, newTileCoefficients, minChange = kMinChange, \
+        derivativeThreshold = kMotionDerivativeThreshold ):
+    tileMinChange = kTileMinChangeRatio * minChange / previousTileCoefficients.size
+    change = numpy.abs( newTileCoefficients - previousTileCoefficients )
+    triggered = numpy.logical_and( change >= tileMinChange, change * 100.0 > previousTileCoefficients * derivativeThreshold )
+    return bool( numpy.any( triggered ) )
+
+
+# Candidate test of the coarse screening, on coefficients calculated on planes decimated by screeningFactor.
+# minChange is given at the full analysis resolution.
+def ScreeningCandidateDetected( previousCoefficient, newCoefficient, minChange, screeningFactor, \
+        previousTileCoefficients = None, newTileCoefficients = None ):
+    screeningMinChange = kScreeningMargin * minChange / float( screeningFactor * screeningFactor )
+    return MotionDerivativeDetected( previousCoefficient, newCoefficient, screeningMinChange, \
+        previousTileCoefficients, newTileCoefficients, kScreeningMargin * kMotionDerivativeThreshold )
+
+
+# Changed pixel counts per tile, for a grid of tileGrid = (columns, rows) tiles, in one vectorized reduction.
+# When the frame size is not a multiple of the grid, the last row and column of tiles take the remaining pixels.
+def CalculateTileDifferenceCoefficients( changedPixels, tileGrid, out = None ):
+    (columns, rows) = tileGrid
+    (height, width) = changedPixels.shape[ 0:2 ]
+    changedPixels = changedPixels.view( numpy.uint8 )
+    if height % rows == 0 and width % columns == 0:
+        return numpy.sum( changedPixels.reshape( rows, height // rows, columns, width // columns ), axis = (1, 3), \
+            dtype = numpy.int32, out = out )
+    # reduce along the rows first, the contiguous axis
+    columnSums = numpy.add.reduceat( changedPixels, numpy.arange( columns ) * (width // columns), axis = 1, dtype = numpy.int32 )
+    return numpy.add.reduceat( columnSums, numpy.arange( rows ) * (height // rows), axis = 0, out = out )
+
+
+# Blends the highlight color over the changed pixels of an RGB frame, in place. Pixels are viewed as single 3 byte
+# elements, so the changed pixel mask applies to them directly, without being tiled over the channels.
+# A fully opaque highlight is a masked copy of the color. Otherwise the frame is blended in uint16, in buffers kept
+# per frame resolution, so the frames of a session may change resolution.
+class DiffOverlayRenderer:
+    def __init__( self, color = kHighlightColor, opacity = kHighlightOpacity ):
+        self.color = numpy.array( color, numpy.uint8 )
+        self.opacity = opacity
+        self.weightedColor = self.color.astype( numpy.uint16 ) * numpy.uint16( opacity ) + numpy.uint16( 127 )  # rounds the division
+        self.blendBuffers = {}  # frame shape -> (uint16 blend, uint8 blended frame)
+
+    @staticmethod
+    def PixelView( frame ):
+        return frame.view( numpy.dtype( (numpy.void, 3) ) )[ :, :, 0 ]
+
+    def Render( self, frame, changedPixels, onlyDiffs = False ):
+        if onlyDiffs:
+            frame.fill( 0 )    # zero out the original image
+        if not frame.flags.c_contiguous:
+            frame[ changedPixels ] = self.color if self.opacity >= 255 else self.Blend( frame )[ changedPixels ]
+            return frame
+
+        if self.opacity >= 255:
+            numpy.copyto( DiffOverlayRenderer.PixelView( frame ), DiffOverlayRenderer.PixelView( self.color.reshape( 1, 1, 3 ) )[ 0, 0 ], \
+                where = changedPixels )
         else:
-            numpy.multiply( oneMinusDiff, currentFrame, out = oneMinusDiff )
-            numpy.divide( oneMinusDiff, 255, out = currentFrame, casting = 'unsafe' )
-
-
-        numpy.add( currentFrame, diff, out = currentFrame, casting = 'unsafe' )
+            numpy.copyto( DiffOverlayRenderer.PixelView( frame ), DiffOverlayRenderer.PixelView( self.Blend( frame ) ), where = changedPixels )
+        return frame
+
+    # Returns the whole frame blended with the highlight color
+    def Blend( self, frame ):
+        if not frame.shape in self.blendBuffers:
+            self.blendBuffers[ frame.shape ] = (numpy.empty( frame.shape, numpy.uint16 ), numpy.empty( frame.shape, numpy.uint8 ))
+        (blendBuffer, blendedFrame) = self.blendBuffers[ frame.shape ]
+        numpy.multiply( frame, numpy.uint16( 255 - self.opacity ), out = blendBuffer )
+        numpy.add( blendBuffer, self.weightedColor, out = blendBuffer )
+        numpy.floor_divide( blendBuffer, numpy.uint16( 255 ), out = blendBuffer )
+        numpy.copyto( blendedFrame, blendBuffer, casting = 'unsafe' )
+        return blendedFrame
+
+
+# Planes used by CalculateDifferenceCoefficient, kept between calls. They are reallocated when the resolution
+# or the type of the comparison planes changes.
+class DifferenceScratchBuffers:
+    def __init__( self ):
+        self.difference = None
+        self.lower = None
+        self.changedPixels = None
+
+    def Acquire( self, comparison ):
+        if self.difference is None or self.difference.shape != comparison.shape or self.difference.dtype != comparison.dtype:
+            self.difference = numpy.empty_like( comparison )
+            self.lower = numpy.empty_like( comparison )
+            self.changedPixels = numpy.empty( comparison.shape, numpy.bool_ )
+        return (self.difference, self.lower, self.changedPixels)
+
+
+# A pixel changed if its luminance changed by at least kLuminanceDiffThreshold.
+# When given, tileCoefficients (rows x columns, int32) receives the per-tile coefficients.
+# With scratchBuffers, frames of the same resolution are compared without allocating; their changedPixels plane
+# holds the pixels which changed, until the next comparison (see DiffOverlayRenderer).
+def CalculateDifferenceCoefficient( baseComparison, newComparison, tileCoefficients = None, scratchBuffers = None ):
+    if scratchBuffers is None:
+        scratchBuffers = DifferenceScratchBuffers()
+    (difference, lower, changedPixels) = scratchBuffers.Acquire( newComparison )
+
+    # absolute difference as max - min, which stays in the range of unsigned planes
+    numpy.maximum( baseComparison, newComparison, out = difference )
+    numpy.minimum( baseComparison, newComparison, out = lower )
+    numpy.subtract( difference, lower, out = difference )
+    numpy.greater_equal( difference, kLuminanceDiffThreshold, out = changedPixels )
+
+    if tileCoefficients is None:
+        diffCoefficient = numpy.count_nonzero( changedPixels )
+    else:
+        CalculateTileDifferenceCoefficients( changedPixels, (tileCoefficients.shape[ 1 ], tileCoefficients.shape[ 0 ]), tileCoefficients )
+        diffCoefficient = int( tileCoefficients.sum() )
 
     return diffCoefficient
 
 
 # Looks like I am ending up duplicating the C++ constructs in Python, minus proper encapsulation
+# Optionally records every task duration into a histogram, which outlives the accumulator
 class RunningTimeAccumulator:
-    def __init__( self ):
+    def __init__( self, histogram = None ):
+        self.histogram = histogram
         self.accumulator = 0
         self.dataSize = 0.0
         self.lastTaskSize = 0.0
@@ -136,6 +303,8 @@ class RunningTimeAccumulator:
         stopTime = perf_counter()
         self.lastTaskDuration = (stopTime - self.startTime)
         self.accumulator += self.lastTaskDuration
+        if not self.histogram is None:
+            self.histogram.Observe( self.lastTaskDuration )
 
     def FormatAsMiBPerf( self, lastOnly = False ):
         if lastOnly:
@@ -148,6 +317,8 @@ class RunningTimeAccumulator:
             return "? MiB/s"
         return "%.2f MiB/s" % ( taskSize / (1024.0 * 1024.0 * taskDuration ) )
 
+kPerfCounterStages = [ "fetch", "prep", "roc", "output" ]
+
 class AlgorithmPerformanceResults:
     def __init__( self ):
         self.analysisAborted = False
@@ -157,34 +328,373 @@ class AlgorithmPerformanceResults:
         self.totalFramesProcessed = 0
         self.totalFramesSkipped = 0
         self.totalFramesTriggered = 0
+        self.totalFullResolutionDiffsAvoided = 0   # frames the coarse screening did not flag as candidates
+        self.totalFramesRewound = 0     # frames the skip policy stepped back over, after a trigger found after a skip
+        self.skipPolicy = kSkipPolicyFixed
         self.algorithmFPS = 0
+        self.peakMemoryUsage = 0        # resident memory of the analysis process, sampled with the perf counters
+        # latency of every task of the perf counters, kept across ResetPerfCounters
+        self.stageLatencies = dict( (stage, vh.LatencyHistogram()) for stage in kPerfCounterStages )
         self.ResetPerfCounters()
 
     def ResetPerfCounters( self ):
-        self.frameFetchingAccumulator = RunningTimeAccumulator()
-        self.framePrepAccumulator = RunningTimeAccumulator()
-        self.rocAnalysisAccumulator = RunningTimeAccumulator()
+        self.frameFetchingAccumulator = RunningTimeAccumulator( self.stageLatencies[ "fetch" ] )
+        self.framePrepAccumulator = RunningTimeAccumulator( self.stageLatencies[ "prep" ] )
+        self.rocAnalysisAccumulator = RunningTimeAccumulator( self.stageLatencies[ "roc" ] )
+        self.outputWritingAccumulator = RunningTimeAccumulator( self.stageLatencies[ "output" ] )  # time the analysis waited for the output encoder
+
+    def SampleMemoryUsage( self ):
+        self.peakMemoryUsage = max( self.peakMemoryUsage, psutil.Process().memory_info().rss )
+
+
+# Skips of at least this many frames restart the ffmpeg pipe at the target timestamp, instead of decoding
+# and discarding every skipped frame. Restarting costs a process start, and decoding from the previous key frame.
+# Measured with analyzeVideoBenchmark.py on 1080p, 1 second GOP: the pipe breaks even around 16 frames.
+# imageio seeks with set_image_index, which reuses its reader.
+kMinimumSeekSkip = 16
+
+# Seeking to the middle of the interval between the previous frame and the target frame lands exactly on
+# the target frame, for constant frame rate streams (ffmpeg seeks accurately, to the first frame at or after it).
+# Other streams have no exact mapping from frame index to timestamp: the iterators are not given their frame rate
+# (see VideoMetadata.constantFrameRate), so they skip by decoding and discarding frames, and land exactly.
+def GetSeekTimestamp( frameIndex, frameRate ):
+    return max( 0.0, (frameIndex - 0.5) / frameRate )
 
 
 class ImageIOVideoIterator:
-    def __init__( self, videoPathName ):
+    def __init__( self, videoPathName, frameRate = None ):
+        self.videoPathName = videoPathName
         self.videoReader = iio.get_reader( videoPathName )
         self.currentIndex = 0
+        self.frameRate = frameRate
 
     def ReadNextFrame( self ):
         nextFrame = self.videoReader.get_next_data()
         self.currentIndex += 1
         return nextFrame
 
+    # Returns the index of the next frame to be read. set_image_index seeks by timestamp, assuming a constant frame rate.
     def SkipFrames( self, count ):
+        if self.frameRate is None:
+            # imageio itself seeks by timestamp for long skips, so discard the frames here to land exactly
+            for i in range( count ):
+                self.ReadNextFrame()
+            return self.currentIndex
         self.videoReader.set_image_index( self.currentIndex + count )
             #no way to know how many were actually remaining in the stream
             #total frames calculations are approximate and for some streams unknown
         self.currentIndex += count
+        return self.currentIndex
 
     def CurrentIndex( self ):
         return self.currentIndex
 
+    # Luminance plane of the last frame read, if the decoder provides it. Otherwise it must be calculated from the frame.
+    def CurrentLuminancePlane( self ):
+        return None
+
+    # True if the returned frames are overwritten by the next read, and must be copied to be kept
+    def ReusesFrameBuffers( self ):
+        return False
+
+    def Close( self ):
+        self.videoReader.close()
+
+
+# Runs ffmpeg as a subprocess, which decodes and scales the frames, and converts them to gray8 for analysis.
+# Frame timestamps are passed through (no duplication), so the frame count after a seek is exact.
+# RGB frames, at the same resolution, are only decoded when needed for the output, and come through a second pipe.
+# Frames are read into the same preallocated buffers on every call.
+class FFmpegPipeVideoIterator:
+    def __init__( self, videoPathName, width, height, keepRgbFrames = True, frameRate = None, minimumSeekSkip = kMinimumSeekSkip ):
+        self.videoPathName = videoPathName
+        self.width = width
+        self.height = height
+        self.frameRate = frameRate
+        self.minimumSeekSkip = minimumSeekSkip
+        self.currentIndex = 0
+        self.lumaBuffer = numpy.empty( (height, width), numpy.uint8 )
+        self.rgbBuffer = None
+        if keepRgbFrames:
+            self.rgbBuffer = numpy.empty( (height, width, 3), numpy.uint8 )
+        self.process = None
+        self.rgbPipe = None
+        self.StartDecoder( 0 )
+
+    def StartDecoder( self, startIndex ):
+        inputArgs = {}
+        if startIndex > 0:
+            inputArgs[ 'ss' ] = '%.06f' % GetSeekTimestamp( startIndex, self.frameRate )
+        videoStream = ffmpeg.input( self.videoPathName, **inputArgs ).video.filter( 'scale', self.width, self.height )
+
+        rgbWriteFd = None
+        if not self.rgbBuffer is None:
+            rgbReadFd, rgbWriteFd = os.pipe()
+            splitStream = videoStream.filter_multi_output( 'split' )
+            outputs = ffmpeg.merge_outputs( \
+                splitStream[ 0 ].output( 'pipe:1', format = 'rawvideo', pix_fmt = 'gray', vsync = 'passthrough' ), \
+                splitStream[ 1 ].output( 'pipe:%i' % rgbWriteFd, format = 'rawvideo', pix_fmt = 'rgb24', vsync = 'passthrough' ) )
+        else:
+            outputs = videoStream.output( 'pipe:1', format = 'rawvideo', pix_fmt = 'gray', vsync = 'passthrough' )
+
+        passFds = () if rgbWriteFd is None else ( rgbWriteFd, )
+        self.process = subprocess.Popen( outputs.global_args( '-v', 'error', '-nostdin' ).compile(),
+            stdout = subprocess.PIPE, pass_fds = passFds )
+        if not rgbWriteFd is None:
+            os.close( rgbWriteFd )
+            self.rgbPipe = os.fdopen( rgbReadFd, 'rb' )
+
+    def StopDecoder( self ):
+        if self.process is None:
+            return
+        # the decoder may be blocked writing into a pipe, so stop it before closing the pipes
+        self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+        if not self.rgbPipe is None:
+            self.rgbPipe.close()
+            self.rgbPipe = None
+
+    def ReadFrameInto( pipe, buffer ):
+        view = memoryview( buffer ).cast( 'B' )
+        bytesRead = 0
+        while bytesRead < len( view ):
+            count = pipe.readinto( view[ bytesRead: ] )
+            if not count:
+                raise IndexError( "No more frames in the ffmpeg pipe" )
+            bytesRead += count
+
+    def ReadNextFrame( self ):
+        FFmpegPipeVideoIterator.ReadFrameInto( self.process.stdout, self.lumaBuffer )
+        if self.rgbBuffer is None:
+            nextFrame = self.lumaBuffer
+        else:
+            FFmpegPipeVideoIterator.ReadFrameInto( self.rgbPipe, self.rgbBuffer )
+            nextFrame = self.rgbBuffer
+        self.currentIndex += 1
+        return nextFrame
+
+    # Returns the index of the next frame to be read. When discarding, the landing index is known exactly:
+    # if the stream ends during the skip, IndexError is raised. Seeks assume a constant frame rate (see GetSeekTimestamp).
+    def SkipFrames( self, count ):
+        if self.frameRate is None or self.minimumSeekSkip <= 0 or count < self.minimumSeekSkip:
+            for i in range( count ):
+                self.ReadNextFrame()
+        else:
+            self.StopDecoder()
+            self.currentIndex += count
+            self.StartDecoder( self.currentIndex )
+        return self.currentIndex
+
+    def CurrentIndex( self ):
+        return self.currentIndex
+
+    def CurrentLuminancePlane( self ):
+        return self.lumaBuffer
+
+    def ReusesFrameBuffers( self ):
+        return True
+
+    def Close( self ):
+        self.StopDecoder()
+
+
+# Wraps another iterator. A producer thread decodes ahead into a fixed capacity ring of frames, while the analysis
+# consumes them. Decoding and numpy both release the GIL, so the two overlap on multi-core machines.
+# Skips drop the frames already decoded, and the rest of the skip is passed to the producer.
+# A returned frame stays valid until the next call to ReadNextFrame or SkipFrames.
+class PrefetchingVideoIterator:
+    def __init__( self, videoIter, capacity = kPrefetchCapacity ):
+        self.videoIter = videoIter
+        self.capacity = max( 2, capacity )
+        self.copyFrames = videoIter.ReusesFrameBuffers()
+
+        # Ring of decoded frames. Slots [firstSlot, firstSlot + filledSlots) are waiting to be consumed,
+        # heldSlot (always firstSlot - 1) is the frame returned by the last read.
+        self.slotFrames = [ None ] * self.capacity
+        self.slotLuminancePlanes = [ None ] * self.capacity
+        self.slotIndices = [ 0 ] * self.capacity
+        self.firstSlot = 0
+        self.filledSlots = 0
+        self.heldSlot = None
+
+        self.currentIndex = videoIter.CurrentIndex()
+        self.currentLuminancePlane = None
+        self.skipTarget = self.currentIndex
+        self.producerError = None
+        self.stopping = False
+
+        self.condition = threading.Condition()
+        self.producerThread = threading.Thread( target = self.ProducerLoop, daemon = True )
+        self.producerThread.start()
+
+    def ProducerLoop( self ):
+        while True:
+            with self.condition:
+                while not self.stopping and self.filledSlots + (0 if self.heldSlot is None else 1) >= self.capacity:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                slot = (self.firstSlot + self.filledSlots) % self.capacity
+                skipCount = self.skipTarget - self.videoIter.CurrentIndex()
+
+            try:
+                if skipCount > 0:
+                    self.videoIter.SkipFrames( skipCount )
+                frameIndex = self.videoIter.CurrentIndex()
+                self.StoreFrame( slot, self.videoIter.ReadNextFrame(), self.videoIter.CurrentLuminancePlane() )
+            except Exception as e:
+                with self.condition:
+                    self.producerError = e
+                    self.condition.notify_all()
+                return
+
+            with self.condition:
+                self.slotIndices[ slot ] = frameIndex
+                self.filledSlots += 1
+                self.condition.notify_all()
+
+    def StoreFrame( self, slot, frame, luminancePlane ):
+        if not self.copyFrames:
+            # the decoder returns a new frame on every read, no need to copy
+            self.slotFrames[ slot ] = frame
+            self.slotLuminancePlanes[ slot ] = luminancePlane
+            return
+        if self.slotFrames[ slot ] is None or self.slotFrames[ slot ].shape != frame.shape:
+            self.slotFrames[ slot ] = numpy.empty_like( frame )
+        numpy.copyto( self.slotFrames[ slot ], frame )
+        if luminancePlane is None:
+            self.slotLuminancePlanes[ slot ] = None
+        else:
+            if self.slotLuminancePlanes[ slot ] is None or self.slotLuminancePlanes[ slot ].shape != luminancePlane.shape:
+                self.slotLuminancePlanes[ slot ] = numpy.empty_like( luminancePlane )
+            numpy.copyto( self.slotLuminancePlanes[ slot ], luminancePlane )
+
+    # must be called with the condition acquired
+    def DropFramesBefore( self, frameIndex ):
+        while self.filledSlots > 0 and self.slotIndices[ self.firstSlot ] < frameIndex:
+            self.firstSlot = (self.firstSlot + 1) % self.capacity
+            self.filledSlots -= 1
+
+    def ReadNextFrame( self ):
+        with self.condition:
+            self.heldSlot = None
+            self.DropFramesBefore( self.currentIndex )
+            while self.filledSlots == 0:
+                if not self.producerError is None:
+                    raise self.producerError
+                self.condition.notify_all()
+                self.condition.wait()
+                self.DropFramesBefore( self.currentIndex )
+
+            slot = self.firstSlot
+            self.firstSlot = (slot + 1) % self.capacity
+            self.filledSlots -= 1
+            self.heldSlot = slot
+            self.currentIndex = self.slotIndices[ slot ] + 1
+            self.condition.notify_all()
+
+        self.currentLuminancePlane = self.slotLuminancePlanes[ slot ]
+        return self.slotFrames[ slot ]
+
+    # Returns the index of the next frame to be read
+    def SkipFrames( self, count ):
+        with self.condition:
+            self.heldSlot = None
+            self.currentIndex += count
+            self.DropFramesBefore( self.currentIndex )
+            self.skipTarget = max( self.skipTarget, self.currentIndex )
+            self.condition.notify_all()
+        return self.currentIndex
+
+    def CurrentIndex( self ):
+        return self.currentIndex
+
+    def CurrentLuminancePlane( self ):
+        return self.currentLuminancePlane
+
+    def ReusesFrameBuffers( self ):
+        return True
+
+    def Close( self ):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.producerThread.join()
+        self.videoIter.Close()
+
+# Wraps another iterator, and keeps the last frames read in a preallocated ring, so the analysis can step back.
+# Skips that fit in the ring decode the skipped frames into it, instead of seeking or discarding them;
+# after a Rewind, frames are returned from the ring until the position of the wrapped iterator is reached again.
+# A returned frame stays valid until the next call to ReadNextFrame or SkipFrames.
+class RewindingVideoIterator:
+    def __init__( self, videoIter, capacity = kRewindCapacity ):
+        self.videoIter = videoIter
+        self.capacity = max( 2, capacity )
+        self.ringFrames = None
+        self.ringLuminancePlanes = None
+        self.filledFrames = 0   # the ring holds the frames [headIndex - filledFrames, headIndex)
+        self.headIndex = videoIter.CurrentIndex()
+        self.currentIndex = self.headIndex
+
+    def ReadFrameIntoRing( self ):
+        frame = self.videoIter.ReadNextFrame()
+        luminancePlane = self.videoIter.CurrentLuminancePlane()
+        if self.ringFrames is None:
+            self.ringFrames = numpy.empty( (self.capacity, ) + frame.shape, frame.dtype )
+            if not luminancePlane is None:
+                self.ringLuminancePlanes = numpy.empty( (self.capacity, ) + luminancePlane.shape, luminancePlane.dtype )
+        slot = self.headIndex % self.capacity
+        numpy.copyto( self.ringFrames[ slot ], frame )
+        if not self.ringLuminancePlanes is None:
+            numpy.copyto( self.ringLuminancePlanes[ slot ], luminancePlane )
+        self.headIndex += 1
+        self.filledFrames = min( self.filledFrames + 1, self.capacity )
+
+    def ReadNextFrame( self ):
+        if self.currentIndex == self.headIndex:
+            self.ReadFrameIntoRing()
+        self.currentIndex += 1
+        return self.ringFrames[ (self.currentIndex - 1) % self.capacity ]
+
+    # Returns the index of the next frame to be read
+    def SkipFrames( self, count ):
+        targetIndex = self.currentIndex + count
+        if targetIndex - self.headIndex > self.capacity:
+            # nothing of the ring would remain
+            self.headIndex = self.videoIter.SkipFrames( targetIndex - self.headIndex )
+            self.filledFrames = 0
+            targetIndex = self.headIndex
+        while self.headIndex < targetIndex:
+            self.ReadFrameIntoRing()
+        self.currentIndex = targetIndex
+        return self.currentIndex
+
+    # Index of the earliest frame the iterator can step back to
+    def EarliestIndex( self ):
+        return self.headIndex - self.filledFrames
+
+    # Steps back by up to count frames, the next read returns an earlier frame again. Returns the number of frames rewound.
+    def Rewind( self, count ):
+        count = min( count, self.currentIndex - (self.headIndex - self.filledFrames) )
+        self.currentIndex -= count
+        return count
+
+    def CurrentIndex( self ):
+        return self.currentIndex
+
+    def CurrentLuminancePlane( self ):
+        if self.ringLuminancePlanes is None:
+            return None
+        return self.ringLuminancePlanes[ (self.currentIndex - 1) % self.capacity ]
+
+    def ReusesFrameBuffers( self ):
+        return True
+
+    def Close( self ):
+        self.videoIter.Close()
+
 '''
 class DecordVideoIterator:
     def __init__( self, videoPathName ):
@@ -223,8 +733,626 @@ class VidGearVideoIterator:
         return self.currentIndex
 '''
 
-def CreateVideoIterator( videoPathName ):
-    return ImageIOVideoIterator( videoPathName )
+# Path of the per-frame signals recorded for a video file, in the destination folder
+def GetSignalPath( args, videoPathName ):
+    return os.path.join( args.destFolder, os.path.basename( videoPathName ) + kSignalFileSuffix )
+
+# Resolution used by the analysis: the source resolution, unless a (smaller) analysis width is requested.
+# Only the ffmpeg pipe decoder is able to scale.
+def GetAnalysisResolution( args, sourceWidth, sourceHeight ):
+    analysisWidth = ArgValue( args, "analysisWidth", 0 )
+    if ArgValue( args, "videoDecoder", kVideoDecoderImageIO ) != kVideoDecoderFFmpegPipe or \
+            analysisWidth <= 0 or analysisWidth >= sourceWidth:
+        return (sourceWidth, sourceHeight)
+    analysisWidth -= analysisWidth % 2
+    analysisHeight = int( round( sourceHeight * analysisWidth / ( 2.0 * sourceWidth ) ) ) * 2
+    return (analysisWidth, analysisHeight)
+
+def CreateVideoIterator( videoPathName, args = None, analysisResolution = None, frameRate = None ):
+    videoIter = CreateDecodingVideoIterator( videoPathName, args, analysisResolution, frameRate )
+    prefetchFrames = ArgValue( args, "prefetchFrames", 0 )
+    if prefetchFrames > 0:
+        videoIter = PrefetchingVideoIterator( videoIter, prefetchFrames )
+    rewindFrames = ArgValue( args, "rewindFrames", 0 )
+    if rewindFrames > 0:
+        videoIter = RewindingVideoIterator( videoIter, rewindFrames )
+    return videoIter
+
+def CreateDecodingVideoIterator( videoPathName, args = None, analysisResolution = None, frameRate = None ):
+    if ArgValue( args, "videoDecoder", kVideoDecoderImageIO ) == kVideoDecoderFFmpegPipe:
+        # highlighting needs the color frames
+        keepRgbFrames = FlagEnabled( args, "highlightDiffs" ) or not FlagEnabled( args, "grayOutput" )
+        return FFmpegPipeVideoIterator( videoPathName, analysisResolution[ 0 ], analysisResolution[ 1 ], keepRgbFrames, \
+            frameRate, ArgValue( args, "seekSkipThreshold", kMinimumSeekSkip ) )
+    return ImageIOVideoIterator( videoPathName, frameRate )
+
+
+# Frame skip policies decide which frame the analysis reads next. They are told the result of every frame analyzed,
+# and, when the iterator is able to step back (see RewindingVideoIterator), they may step back into a skipped interval
+# after a trigger. Their state is part of the base state of the analysis (see GetBaseState).
+
+# Accelerate processing of the video, by skipping frames if there are no triggers detected for some time
+# This is an optimization, to compensate for the really slow Python algorithms/image libraries.
+# After a trigger found right after a skip, the skipped interval is analyzed again, frame by frame.
+class FixedStepSkipPolicy:
+    name = kSkipPolicyFixed
+
+    def __init__( self ):
+        self.kNumLoopsUntriggeredThreshold = 100
+        self.kFrameSkipStep = 8
+        self.kMaxFrameSkip = 30
+        self.frameSkip = 0
+        self.numLoopsUntriggered = 0 # currently, no triggering means there are no changes in the rate of changes
+        self.StartAnalysis( False )
+
+    # resuming is True when the analysis continues where the previous one, of a time range, ended
+    def StartAnalysis( self, resuming ):
+        self.lastFrameIndex = None   # index of the last frame analyzed
+        self.stepBackIndex = None    # index of the frame to step back to
+        if not resuming:
+            self.numLoopsUntriggered = 0
+
+    # Index of the frame to analyze next, given the index of the next frame of the iterator
+    def NextFrameIndex( self, currentIndex ):
+        if not self.stepBackIndex is None:
+            nextFrameIndex = self.stepBackIndex
+            self.stepBackIndex = None
+            return nextFrameIndex
+        return currentIndex + self.frameSkip
+
+    # earliestIndex is the index of the earliest frame the iterator can step back to.
+    # Returns False if the motion detected is not to be taken into account yet, because the policy steps back.
+    def OnFrameAnalyzed( self, frameIndex, motionDetected, earliestIndex ):
+        previousFrameIndex = self.lastFrameIndex
+        self.lastFrameIndex = frameIndex
+        if motionDetected and not previousFrameIndex is None and max( earliestIndex, previousFrameIndex + 1 ) < frameIndex:
+            # the base is unchanged, so the analysis triggers again, on this frame at the latest
+            self.stepBackIndex = max( earliestIndex, previousFrameIndex + 1 )
+            self.lastFrameIndex = self.stepBackIndex - 1
+            self.frameSkip = 0
+            self.numLoopsUntriggered = 0
+            return False
+
+        if motionDetected:
+            self.numLoopsUntriggered = 0
+            self.frameSkip = 0   # if we were skipping frames, no more. We found motion.
+        elif self.frameSkip < self.kMaxFrameSkip:
+            self.numLoopsUntriggered += 1
+            if self.numLoopsUntriggered > self.kNumLoopsUntriggeredThreshold:
+                # time to move faster through the video, only unchanged frames here
+                self.numLoopsUntriggered = 0
+                self.frameSkip += self.kFrameSkipStep
+        return True
+
+    # True while stepping back into a skipped interval, the analysis must not stop
+    def Searching( self ):
+        return False
+
+    def GetState( self ):
+        return (self.frameSkip, self.numLoopsUntriggered)
+
+    def SetState( self, state ):
+        (self.frameSkip, self.numLoopsUntriggered) = state
+
+
+# Doubles the frame skip after every quiet period, up to kMaxFrameSkip: longer skips would step over short motion
+# without landing on it. The length of the quiet period grows with the
+# recent trigger density (a moving average of the triggers per frame analyzed), so busy footage is skipped less eagerly.
+# After a trigger found right after a skip, bisects the skipped interval for the frame where the motion is first detected,
+# analyzing a logarithmic number of frames instead of all of them. Motion which starts and stops within the interval
+# may not be found, as with a linear search which only looks at the frames before the landing frame.
+class AdaptiveSkipPolicy( FixedStepSkipPolicy ):
+    name = kSkipPolicyAdaptive
+
+    def __init__( self ):
+        FixedStepSkipPolicy.__init__( self )
+        self.kMinQuietLoops = 20
+        self.kDensityQuietLoops = 800   # additional quiet frames needed, per unit of trigger density
+        self.kDensityDecay = 1.0 / 32.0
+        self.triggerDensity = 0.0
+
+    def StartAnalysis( self, resuming ):
+        FixedStepSkipPolicy.StartAnalysis( self, resuming )
+        self.searchLow = None      # during a bisection, the last frame known not to trigger
+        self.searchHigh = None     # and the first frame known to trigger
+
+    def NextFrameIndex( self, currentIndex ):
+        if not self.searchHigh is None:
+            if self.searchHigh - self.searchLow > 1:
+                return (self.searchLow + self.searchHigh) // 2
+            # found: analyze the first triggering frame again, for good
+            nextFrameIndex = self.searchHigh
+            self.lastFrameIndex = self.searchLow
+            self.searchLow = None
+            self.searchHigh = None
+            return nextFrameIndex
+        return currentIndex + self.frameSkip
+
+    def OnFrameAnalyzed( self, frameIndex, motionDetected, earliestIndex ):
+        if not self.searchHigh is None:
+            if motionDetected:
+                self.searchHigh = frameIndex
+                return False
+            self.searchLow = frameIndex
+            return True
+
+        previousFrameIndex = self.lastFrameIndex
+        self.lastFrameIndex = frameIndex
+        if motionDetected and not previousFrameIndex is None and max( earliestIndex - 1, previousFrameIndex ) + 1 < frameIndex:
+            self.searchLow = max( earliestIndex - 1, previousFrameIndex )
+            self.searchHigh = frameIndex
+            return False
+
+        self.triggerDensity += self.kDensityDecay * ((1.0 if motionDetected else 0.0) - self.triggerDensity)
+        if motionDetected:
+            self.numLoopsUntriggered = 0
+            self.frameSkip = 0
+        else:
+            self.numLoopsUntriggered += 1
+            if self.numLoopsUntriggered >= self.kMinQuietLoops + self.kDensityQuietLoops * self.triggerDensity:
+                self.numLoopsUntriggered = 0
+                self.frameSkip = min( self.kMaxFrameSkip, max( 1, 2 * self.frameSkip ) )
+        return True
+
+    def Searching( self ):
+        return not self.searchHigh is None
+
+    def GetState( self ):
+        return (self.frameSkip, self.numLoopsUntriggered, self.triggerDensity)
+
+    def SetState( self, state ):
+        (self.frameSkip, self.numLoopsUntriggered, self.triggerDensity) = state
+
+
+def CreateSkipPolicy( args ):
+    if ArgValue( args, "skipPolicy", kSkipPolicyFixed ) == kSkipPolicyAdaptive:
+        return AdaptiveSkipPolicy()
+    return FixedStepSkipPolicy()
+
+
+# Writes the output (a video, or images when only a few frames are detected) on a separate thread, so the analysis
+# does not stall while ffmpeg encodes. Frames are handed over in a bounded queue: when the encoder falls behind,
+# the analysis waits for a free slot, which bounds the memory held by pending frames.
+# With a capacity of 0, the output is written by the calling thread.
+class AsyncFrameEncoder:
+    def __init__( self, capacity = kEncoderQueueCapacity ):
+        self.videoWriter = None
+        self.videoFilePath = None
+        self.encoderError = None
+        self.cancelled = False
+        self.encoderThread = None
+        self.submittedCount = 0
+        self.completedCount = 0
+        self.completion = threading.Condition()
+        if capacity > 0:
+            self.taskQueue = queue.Queue( capacity )
+            self.encoderThread = threading.Thread( target = self.EncoderLoop, daemon = True )
+            self.encoderThread.start()
+
+    def OpenVideo( self, filePath, fps ):
+        self.videoFilePath = filePath
+        self.Submit( self.CreateVideoWriter, filePath, fps )
+
+    def AppendVideoFrame( self, frame ):
+        self.Submit( self.WriteVideoFrame, frame )
+
+    def WriteImage( self, filePath, frame ):
+        self.Submit( self.WriteImageFile, filePath, frame )
+
+    # Returns when the frames submitted so far are written
+    def WaitForPendingFrames( self ):
+        self.WaitForTasks( self.submittedCount )
+
+    # Returns when the first taskCount tasks submitted are done with (executed, or dropped after an error or a Cancel).
+    # A count taken with SubmittedCount marks the frames handed over until then.
+    def WaitForTasks( self, taskCount ):
+        with self.completion:
+            while self.completedCount < taskCount:
+                self.completion.wait()
+
+    def SubmittedCount( self ):
+        return self.submittedCount
+
+    # Waits for the pending frames to be written, and closes the video. Errors of the encoder thread are raised here,
+    # if not raised by an earlier call.
+    def Close( self ):
+        self.StopThread()
+        self.CloseVideoWriter()
+        if not self.encoderError is None:
+            raise self.encoderError
+
+    # Drops the pending frames, and closes the video
+    def Cancel( self ):
+        self.cancelled = True
+        self.StopThread()
+        self.CloseVideoWriter()
+
+# "Private" methods:
+
+    def Submit( self, task, *taskArgs ):
+        if not self.encoderError is None:
+            raise self.encoderError
+        self.submittedCount += 1
+        if self.encoderThread is None:
+            try:
+                task( *taskArgs )
+            finally:
+                self.CompleteTask()
+        else:
+            self.taskQueue.put( (task, taskArgs) )
+
+    def CompleteTask( self ):
+        with self.completion:
+            self.completedCount += 1
+            self.completion.notify_all()
+
+    def EncoderLoop( self ):
+        while True:
+            item = self.taskQueue.get()
+            if item is None:
+                self.taskQueue.task_done()
+                return
+            if not self.cancelled and self.encoderError is None:
+                (task, taskArgs) = item
+                try:
+                    task( *taskArgs )
+                except Exception as e:
+                    self.encoderError = e
+            self.CompleteTask()
+            self.taskQueue.task_done()
+
+    def StopThread( self ):
+        if self.encoderThread is None:
+            return
+        self.taskQueue.put( None )
+        self.encoderThread.join()
+        self.encoderThread = None
+
+    def CreateVideoWriter( self, filePath, fps ):
+        self.videoWriter = iio.get_writer( filePath, fps = fps )
+
+    def WriteVideoFrame( self, frame ):
+        self.videoWriter.append_data( DecodeFrame( frame ) )
+
+    def WriteImageFile( self, filePath, frame ):
+        iio.imwrite( filePath, DecodeFrame( frame ) )
+
+    def CloseVideoWriter( self ):
+        if not self.videoWriter is None:
+            self.videoWriter.close()
+            self.videoWriter = None
+
+
+# Detected frames waiting to be written, in fixed-size slots of a memory-mapped temporary file. The slots are sized
+# from the shape of the frames, and their number from a byte budget, so any resolution stays within the budget.
+# The pages of the file can be written back to disk by the system, instead of growing the process memory.
+# The slots are split in banks used in turn: frames are appended to one bank while the frames of the others
+# may still be read by the output encoder.
+class MappedFrameSpool:
+    kBankCount = 2
+
+    def __init__( self, budgetBytes, folder = None ):
+        self.budgetBytes = budgetBytes
+        self.folder = folder
+        self.spoolFile = None
+        self.slots = None
+        self.frameIndices = None
+        self.frameCount = 0
+        self.bankSlotCount = 0
+        self.bank = 0
+        self.bankReleases = []
+
+    def __len__( self ):
+        return self.frameCount
+
+    # Returns None until the first frame is appended
+    def SlotShape( self ):
+        return None if self.slots is None else self.slots.shape[ 1: ]
+
+    def Full( self ):
+        return not self.slots is None and self.frameCount >= self.bankSlotCount
+
+    # The frame is copied in the next slot of the current bank. The slots are allocated again when the frame shape
+    # changes, which requires an empty spool.
+    def Append( self, frameIndex, frame ):
+        if self.SlotShape() != frame.shape or self.slots.dtype != frame.dtype:
+            self.AllocateSlots( frame.shape, frame.dtype )
+        if self.frameCount == 0 and not self.bankReleases[ self.bank ] is None:
+            # the frames of the previous round may still be in use
+            self.bankReleases[ self.bank ]()
+            self.bankReleases[ self.bank ] = None
+        slot = self.bank * self.bankSlotCount + self.frameCount
+        numpy.copyto( self.slots[ slot ], frame )
+        self.frameIndices[ slot ] = frameIndex
+        self.frameCount += 1
+
+    # (frame index, frame) pairs. The frames are views of the slots of the current bank, valid until the bank is reused.
+    def Frames( self ):
+        firstSlot = self.bank * self.bankSlotCount
+        return [ (int( self.frameIndices[ i ] ), self.slots[ i ]) for i in range( firstSlot, firstSlot + self.frameCount ) ]
+
+    # Empties the spool, moving on to the next bank. releaseWait, if given, returns once the frames of the current bank
+    # are no longer used: it is called before the bank is reused.
+    def Clear( self, releaseWait = None ):
+        if self.frameCount == 0:
+            return
+        self.bankReleases[ self.bank ] = releaseWait
+        self.bank = (self.bank + 1) % len( self.bankReleases )
+        self.frameCount = 0
+
+    # The frames returned remain valid, until they are released
+    def Close( self ):
+        self.slots = None   # unmaps the file
+        self.frameCount = 0
+        self.bank = 0
+        self.bankReleases = []
+        if not self.spoolFile is None:
+            self.spoolFile.close()
+            self.spoolFile = None
+
+# "Private" methods:
+
+    def AllocateSlots( self, frameShape, dtype ):
+        if self.frameCount > 0:
+            raise ValueError( "The frame shape cannot change while frames are spooled" )
+        self.Close()
+        frameSize = int( numpy.prod( frameShape ) ) * numpy.dtype( dtype ).itemsize
+        slotCount = max( 1, self.budgetBytes // frameSize )
+        bankCount = min( self.kBankCount, slotCount )
+        self.bankSlotCount = slotCount // bankCount
+        self.bankReleases = [ None ] * bankCount
+        self.spoolFile = tempfile.TemporaryFile( prefix = kTempFilePrefix, dir = self.folder )
+        self.slots = numpy.memmap( self.spoolFile, dtype, 'w+', shape = (self.bankSlotCount * bankCount,) + tuple( frameShape ) )
+        self.frameIndices = numpy.zeros( self.bankSlotCount * bankCount, numpy.int64 )
+
+
+# A detected frame stored by CompressedFrameSpool: the difference with the previous frame stored (or the frame itself,
+# for the first frame after the spool is cleared), compressed with zlib. Decoding in the order the frames were stored
+# takes one decompression per frame: only the pixels of the last frame decoded are kept, to decode the next one.
+class CompressedFrame:
+    def __init__( self, data, shape, previous ):
+        self.data = data
+        self.shape = shape
+        self.previous = previous
+        self.pixels = None
+
+    def Decode( self ):
+        # frames to decode, back to a decoded frame or to the first frame of the chain
+        chain = [ self ]
+        while chain[ -1 ].pixels is None and not chain[ -1 ].previous is None:
+            chain.append( chain[ -1 ].previous )
+
+        pixels = None
+        for frame in reversed( chain ):
+            if not frame.pixels is None:
+                pixels = frame.pixels
+                continue
+            decompressed = numpy.frombuffer( zlib.decompress( frame.data ), numpy.uint8 ).reshape( frame.shape )
+            pixels = decompressed if pixels is None else numpy.add( pixels, decompressed )   # wraps around, as the difference did
+        for frame in chain[ 1: ]:
+            frame.pixels = None
+        self.pixels = pixels
+        return pixels
+
+def DecodeFrame( frame ):
+    if isinstance( frame, CompressedFrame ):
+        return frame.Decode()
+    return frame
+
+
+# Detected frames waiting to be written, compressed in memory (see CompressedFrame). Consecutive triggers are usually
+# similar frames, so their differences compress well. The byte budget applies to the compressed frames.
+# Has the interface of MappedFrameSpool; the frames returned are decoded when written (see DecodeFrame).
+class CompressedFrameSpool:
+    kCompressionLevel = 1
+
+    def __init__( self, budgetBytes ):
+        self.budgetBytes = budgetBytes
+        self.frames = []
+        self.spooledBytes = 0
+        self.previousFrame = None   # pixels of the last frame stored
+        self.difference = None
+
+    def __len__( self ):
+        return len( self.frames )
+
+    def SlotShape( self ):
+        return None if len( self.frames ) == 0 else self.frames[ -1 ][ 1 ].shape
+
+    def Full( self ):
+        return self.spooledBytes >= self.budgetBytes
+
+    def Append( self, frameIndex, frame ):
+        previous = None if len( self.frames ) == 0 else self.frames[ -1 ][ 1 ]
+        if previous is None or previous.shape != frame.shape:
+            previous = None
+            self.previousFrame = numpy.empty_like( frame )
+            self.difference = numpy.empty_like( frame )
+            data = zlib.compress( numpy.ascontiguousarray( frame ), self.kCompressionLevel )
+        else:
+            numpy.subtract( frame, self.previousFrame, out = self.difference )
+            data = zlib.compress( self.difference, self.kCompressionLevel )
+        numpy.copyto( self.previousFrame, frame )
+        self.frames.append( (frameIndex, CompressedFrame( data, frame.shape, previous )) )
+        self.spooledBytes += len( data )
+
+    def Frames( self ):
+        return list( self.frames )
+
+    # The frames are not stored again after the spool is cleared, so they need not be released (see MappedFrameSpool)
+    def Clear( self, releaseWait = None ):
+        self.frames = []
+        self.spooledBytes = 0
+
+    def Close( self ):
+        self.Clear()
+        self.previousFrame = None
+        self.difference = None
+
+
+# Records a row of signals per frame analyzed, saved to a NumPy sidecar of the source file, to replay the trigger,
+# skip and abort rules with other thresholds without decoding the file again (see ReplayFrameSignals).
+# Frame indices follow the convention of the output (index of the frame + 1). A row holds:
+#   timestamp, in seconds
+#   baseIndex, baseCoefficient: the base of comparison and its coefficient (baseIndex 0 for a base from a previous file)
+#   earliestIndex: the earliest frame the skip policy could step back to
+#   changedPixels: the changed pixel counts against the base, at each of kSignalLuminanceThresholds.
+#       -1 for frames the coarse screening did not flag (not compared at full resolution)
+#   triggered: the frame triggered in the recorded analysis
+# Rows are written by blocks of kSignalBlockRows as the analysis goes, and the file is complete once closed.
+class FrameSignalRecorder:
+    def __init__( self, signalPath, frameRate ):
+        self.signalPath = signalPath
+        self.frameRate = frameRate
+        self.writer = vh.StreamingArrayWriter( signalPath, kSignalDtype, () )
+        self.signals = numpy.zeros( kSignalBlockRows, kSignalDtype )
+        self.count = 0      # rows of the block
+        self.aboveThreshold = None
+
+    # difference is the absolute luminance difference with the base, None if the frame was not compared.
+    # diffCoefficient, the changed pixel count at kLuminanceDiffThreshold, is not counted again.
+    def RecordFrame( self, frameIndex, baseIndex, baseCoefficient, earliestIndex, difference, diffCoefficient ):
+        # the last row recorded may still be marked as triggered, so a full block is written when the next row comes
+        if self.count == len( self.signals ):
+            self.WriteBlock()
+        row = self.count
+        self.signals[ 'frameIndex' ][ row ] = frameIndex
+        self.signals[ 'timestamp' ][ row ] = (frameIndex - 1) / self.frameRate
+        self.signals[ 'baseIndex' ][ row ] = baseIndex
+        self.signals[ 'baseCoefficient' ][ row ] = baseCoefficient
+        self.signals[ 'earliestIndex' ][ row ] = earliestIndex
+        self.signals[ 'changedPixels' ][ row ] = -1
+        self.signals[ 'triggered' ][ row ] = False
+        if not difference is None:
+            if self.aboveThreshold is None or self.aboveThreshold.shape != difference.shape:
+                self.aboveThreshold = numpy.empty( difference.shape, numpy.bool_ )
+            for (i, threshold) in enumerate( kSignalLuminanceThresholds ):
+                if threshold == kLuminanceDiffThreshold:
+                    self.signals[ 'changedPixels' ][ row, i ] = diffCoefficient
+                    continue
+                numpy.greater_equal( difference, threshold, out = self.aboveThreshold )
+                self.signals[ 'changedPixels' ][ row, i ] = numpy.count_nonzero( self.aboveThreshold )
+        self.count += 1
+
+    def MarkTriggered( self ):
+        self.signals[ 'triggered' ][ self.count - 1 ] = True
+
+    def Close( self ):
+        if self.count > 0:
+            self.WriteBlock()
+        self.writer.Close()
+
+    def WriteBlock( self ):
+        self.writer.AppendRows( self.signals[ :self.count ] )
+        self.count = 0
+
+
+# Runs the trigger, skip and abort rules of AddVideoFileToAnalysis on recorded signals (see FrameSignalRecorder),
+# with the given thresholds. luminanceThreshold is one of kSignalLuminanceThresholds.
+# The counts were recorded against the bases of the recorded analysis: once the replay triggers differently, frames are
+# compared to another base than the one recorded, until both trigger on the same frame again. The recorded counts are
+# used for them as an approximation. Frames the skip policy asks for but were not recorded take the signals of the next
+# recorded frame.
+# Returns the triggered frame indices, the number of approximated frames and whether the analysis would abort.
+def ReplayFrameSignals( signals, skipPolicy, minChange, luminanceThreshold = kLuminanceDiffThreshold, \
+        derivativeThreshold = kMotionDerivativeThreshold, warmUpFrameCount = 0 ):
+    triggeredFrames = []
+    approximatedFrames = 0
+    if len( signals ) == 0:
+        return (triggeredFrames, approximatedFrames, False)
+
+    column = kSignalLuminanceThresholds.index( luminanceThreshold )
+    recordedOrder = numpy.argsort( signals[ 'frameIndex' ], kind = 'stable' )
+    recordedIndices = signals[ 'frameIndex' ][ recordedOrder ]
+
+    # the base coefficient of a base from a previous file is only known at the recorded threshold
+    baseIndex = int( signals[ 'baseIndex' ][ 0 ] )
+    baseCoefficient = int( signals[ 'baseCoefficient' ][ 0 ] ) if luminanceThreshold == kLuminanceDiffThreshold else -1
+    currentIndex = int( signals[ 'frameIndex' ][ 0 ] ) - 1
+    firstIndex = currentIndex
+    prevTimeCompressionRatio = 0.0
+    skipPolicy.StartAnalysis( False )
+
+    while True:
+        requestedIndex = skipPolicy.NextFrameIndex( currentIndex )
+        if requestedIndex > currentIndex and currentIndex <= firstIndex + 1:
+            requestedIndex = currentIndex   # no skip before the second frame, as in AddVideoFileToAnalysis
+        position = int( numpy.searchsorted( recordedIndices, requestedIndex + 1 ) )
+        if position == len( recordedIndices ):
+            break
+
+        # a frame analyzed again after a rewind has a row per base it was compared to. A frame not recorded
+        # takes the signals of the next recorded frame.
+        recordedIndex = recordedIndices[ position ]
+        row = recordedOrder[ position ]
+        while position < len( recordedIndices ) and recordedIndices[ position ] == recordedIndex:
+            if signals[ 'baseIndex' ][ recordedOrder[ position ] ] == baseIndex:
+                row = recordedOrder[ position ]
+                break
+            position += 1
+        frameIndex = requestedIndex + 1
+        if recordedIndex != frameIndex or signals[ 'baseIndex' ][ row ] != baseIndex:
+            approximatedFrames += 1
+
+        coefficient = int( signals[ 'changedPixels' ][ row, column ] )
+        motionDetected = coefficient >= 0 and \
+            MotionDerivativeDetected( baseCoefficient, coefficient, minChange, None, None, derivativeThreshold )
+        currentIndex = frameIndex
+        if not skipPolicy.OnFrameAnalyzed( requestedIndex, motionDetected, min( int( signals[ 'earliestIndex' ][ row ] ), requestedIndex ) ):
+            continue
+
+        if motionDetected:
+            baseIndex = frameIndex
+            baseCoefficient = coefficient
+            triggeredFrames.append( frameIndex )
+
+        timeCompressionRatio = float( len( triggeredFrames ) ) / float( frameIndex )
+        if frameIndex > warmUpFrameCount:
+            if timeCompressionRatio > 0.95 or (timeCompressionRatio > 0.50 and timeCompressionRatio > prevTimeCompressionRatio):
+                return (triggeredFrames, approximatedFrames, True)
+            prevTimeCompressionRatio = timeCompressionRatio
+
+    return (triggeredFrames, approximatedFrames, False)
+
+
+# Maps the frames output by a session to their source: a row per frame, in output order, saved as a NumPy structured
+# array which can be memory-mapped (see LoadDetectionIndex). A row holds:
+#   frameIndex, timestamp: the frame in its source file (index of the frame + 1, as in the output), and its time in seconds
+#   diffCoefficient: the number of changed pixels which triggered the frame
+#   outputFrame: the position of the frame in the output video, or -1 for a frame written as an image
+#   sourceFile: the source file name, as given to the analysis
+class DetectionIndex:
+    def __init__( self ):
+        self.rows = []
+
+    def __len__( self ):
+        return len( self.rows )
+
+    def Append( self, sourceName, frameIndex, timestamp, diffCoefficient ):
+        self.rows.append( [ frameIndex, timestamp, diffCoefficient, -1, sourceName ] )
+
+    def Row( self, position ):
+        return self.rows[ position ]
+
+    def SetOutputFrame( self, position, outputFrame ):
+        self.rows[ position ][ 3 ] = outputFrame
+
+    def Clear( self ):
+        self.rows = []
+
+    def Save( self, indexPath ):
+        sourceNames = [ row[ 4 ].encode( 'utf-8' ) for row in self.rows ]
+        nameLength = max( [ 1 ] + [ len( n ) for n in sourceNames ] )
+        index = numpy.zeros( len( self.rows ), numpy.dtype( [ ('frameIndex', numpy.int64), ('timestamp', numpy.float64), \
+            ('diffCoefficient', numpy.int64), ('outputFrame', numpy.int64), ('sourceFile', 'S%i' % nameLength) ] ) )
+        for (i, row) in enumerate( self.rows ):
+            index[ i ] = tuple( row[ 0:4 ] ) + (sourceNames[ i ],)
+        numpy.save( indexPath, index )
+
+# Opens a saved detection index without reading it: rows of the output video are found by position,
+# index[ 'outputFrame' ] being their position in the index too when the session output is a single video.
+def LoadDetectionIndex( indexPath ):
+    return numpy.load( indexPath, mmap_mode = 'r' )
 
 
 class RateOfChangeAnalyzer:
@@ -233,47 +1361,113 @@ class RateOfChangeAnalyzer:
         self.videoAnalysisName = videoAnalysisName
         self.kRocTemporaryFilePath = os.path.join( args.destFolder, kTempFilePrefix + videoAnalysisName + ".mp4" )
         self.kRocAnalyzedFilePath = os.path.join( args.destFolder, videoAnalysisName + '_ROC_analyzed.mp4' )
+        self.kRocIndexFilePath = os.path.join( args.destFolder, videoAnalysisName + kDetectionIndexSuffix )
         self.detectedFrames = []
-        self.videoWriter = None
+        self.frameEncoder = None    # created with the first output written (see WriteVideoData)
         self.totalFrameOutputCount = 0
+        self.videoFrameOutputCount = 0
+
+        # Source of the output frames: the name of the file analyzed, the trigger (coefficient, timestamp) of its frames
+        # in the spool by frame index, and the index of the frames handed to the output
+        self.sourceName = None
+        self.pendingDetections = {}
+        self.detectionIndex = DetectionIndex()
+
+        # Persistent metadata store shared by the analyses of a job (see processVideos). Without one, files are probed.
+        self.metadataStore = None
+
+        # When set, output frames are appended to this spool file instead of being written,
+        # to be added to a session output by another process (see AddSpooledFrames)
+        self.outputSpoolPath = None
+
+        # Last analysis of a file, or of a time range of a file: triggers (frame index, coefficient), the frame the analysis
+        # synchronized on (see AddVideoFileToAnalysis), and the index of the frame following the last one analyzed
+        self.rangeTriggers = []
+        self.syncFrameIndex = None
+        self.lastFrameIndex = 0
 
         self.kWarmUpDuration = 2 * 60   # Amount of original video time before analysis can be aborted
-        kMaxMemoryBuffer = 1000 # in MiB
-        self.kMaxFramesToBuffer = int( (kMaxMemoryBuffer * 1024 * 1024) / (1920 * 1080 * 4) )
 
-        # Accelerate processing of the video, by skipping frames if there are no triggers detected for some time
-        # This is an optimization, to compensate for the really slow Python algorithms/image libraries.
-        self.kNumLoopsUntriggeredThreshold = 100
-        self.kMaxFrameSkip = 30
-        self.frameSkip = 0
+        # Detected frames of the current file, until it is known the analysis of the file is not aborted
+        frameSpoolBudget = ArgValue( args, "frameSpoolBudget", kFrameSpoolBudget ) * 1024 * 1024
+        if FlagEnabled( args, "compressFrames" ):
+            self.frameSpool = CompressedFrameSpool( frameSpoolBudget )
+        else:
+            self.frameSpool = MappedFrameSpool( frameSpoolBudget, args.destFolder )
+
+        self.skipPolicy = CreateSkipPolicy( args )
 
         self.baseFrame = None
         self.baseOfComparison = None
         self.baseDiffCoefficient = -1
 
-
-    def AddVideoFileToAnalysis( self, videoPathName, logger, algPerformanceResults = None ):
+        # Per-tile coefficients, when analyzing by tiles: two buffers, alternating with the base tile coefficients
+        self.tileGrid = ArgValue( args, "tileGrid", None )
+        self.baseTileCoefficients = None
+        self.tileCoefficientBuffers = []
+        if not self.tileGrid is None:
+            self.tileCoefficientBuffers = [ numpy.zeros( (self.tileGrid[ 1 ], self.tileGrid[ 0 ]), numpy.int32 ) for i in range( 2 ) ]
+
+        # Luminance planes are written in two uint8 buffers, alternating with the base of comparison,
+        # and compared in scratch buffers
+        self.differenceScratch = DifferenceScratchBuffers()
+        self.screeningScratch = DifferenceScratchBuffers()
+
+        # Changed pixels are highlighted on the frames kept for the output only
+        self.diffOverlayRenderer = None
+        if FlagEnabled( args, "highlightDiffs" ):
+            self.diffOverlayRenderer = DiffOverlayRenderer()
+        self.luminanceKernel = None
+        if ArgValue( args, "luminanceMethod", kLuminanceMethodPIL ) == kLuminanceMethodFixedPoint:
+            self.luminanceKernel = FixedPointLuminanceKernel()
+        self.comparisonBuffers = []
+
+        self.minChange = kMinChange
+
+        # Coarse screening (see kScreeningFactor): the base of comparison decimated, its coefficients, and buffers
+        # alternating with them, as for the full resolution analysis
+        self.screeningFactor = ArgValue( args, "coarseScreening", 0 )
+        self.baseScreening = None
+        self.baseScreeningCoefficient = -1
+        self.baseScreeningTileCoefficients = None
+        self.screeningBuffers = []
+        self.screeningTileCoefficientBuffers = []
+        if self.screeningFactor > 0 and not self.tileGrid is None:
+            self.screeningTileCoefficientBuffers = [ numpy.zeros( (self.tileGrid[ 1 ], self.tileGrid[ 0 ]), numpy.int32 ) for i in range( 2 ) ]
+
+
+    # frameRange = (first frame, end frame or None for end of file) restricts the analysis to a time range of the file.
+    # The analysis of a range stops at the first trigger found in syncTriggers, a set of (frame index, coefficient) pairs.
+    # sourceName is the file name recorded in the detection index, when the file analyzed is a copy of it.
+    # profiler, a vh.AnalysisProfiler started for this file, profiles the frame loop and samples the memory while it runs.
+    # videoMeta, the metadata of the file when already known, saves probing it.
+    def AddVideoFileToAnalysis( self, videoPathName, logger, algPerformanceResults = None, frameRange = None, syncTriggers = None, \
+            sourceName = None, profiler = None, videoMeta = None ):
         if algPerformanceResults is None:
             algPerformanceResults = AlgorithmPerformanceResults()
+        self.sourceName = videoPathName if sourceName is None else sourceName
 
         # Figure out disk locations first
         if not os.path.isfile( videoPathName ):
             print( 'File not found: ' + videoPathName )
+            algPerformanceResults.analysisAborted = True
             return
 
-        # Get video properties such as number of frames, duration, etc
-        videoMeta = ffmpeg.probe( videoPathName )[ "streams" ]
+        # Get video properties such as number of frames, duration, etc. A copy has the metadata of its source, which
+        # may already be in the metadata store.
+        if videoMeta is None:
+            metadataPath = sourceName if not sourceName is None and os.path.isfile( sourceName ) else videoPathName
+            videoMeta = self.GetVideoMetadata( metadataPath )
 
         logger.PrintMessage( "Adding %s to frame rate-of-change analysis" % os.path.basename( videoPathName ) )
-        logger.PrintMessage( 'Resolution: %ix%i' % (videoMeta[ 0 ][ 'width' ], videoMeta[ 0 ][ 'height' ]) )
-        logger.PrintMessage( 'Average Frame Rate: ' + videoMeta[ 0 ][ 'avg_frame_rate' ] )
-        logger.PrintMessage( 'Duration in seconds: ' + videoMeta[ 0 ][ 'duration' ] )
+        logger.PrintMessage( 'Resolution: %ix%i' % (videoMeta.width, videoMeta.height) )
+        logger.PrintMessage( 'Average Frame Rate: ' + videoMeta.frameRateText )
+        logger.PrintMessage( 'Duration in seconds: ' + videoMeta.durationText )
 
-        frameRatePair = videoMeta[ 0 ][ 'avg_frame_rate' ].split( '/' )
-        frameRate = float( frameRatePair[ 0 ] ) / float( frameRatePair[ 1 ] )
+        frameRate = videoMeta.frameRate
         kWarmUpFrameCount = frameRate * self.kWarmUpDuration
 
-        totalFrames = int( frameRate * float( videoMeta[ 0 ][ 'duration' ] ) )
+        totalFrames = int( frameRate * videoMeta.duration )
         logger.PrintMessage( 'Total frames: %i' % totalFrames )
         algPerformanceResults.totalFramesInVideoFile = totalFrames
         if algPerformanceResults.totalFramesInVideoFile == 0:
@@ -281,205 +1475,574 @@ class RateOfChangeAnalyzer:
             algPerformanceResults.analysisAborted = True
             return
 
-        # Initialize video iterator
-        videoIter = CreateVideoIterator( videoPathName )
-        if self.baseFrame is None:
-            self.baseFrame = videoIter.ReadNextFrame()
-            self.baseOfComparison = PrepareFrameForAnalysis( self.baseFrame )
-            self.baseDiffCoefficient = -1
-
-        totalNumFramesTriggered = 0
-        numLoopsUntriggered = 0 # currently, no triggering means there are no changes in the rate of changes
+        rangeJobs = ArgValue( self.args, "rangeJobs", 1 )
+        if frameRange is None and rangeJobs > 1:
+            self.AddVideoFileToAnalysisInRanges( videoPathName, logger, algPerformanceResults, totalFrames, rangeJobs, videoMeta )
+            return
 
-        # Time Compression statistics, used to abort analysis if the frames are changing all the time, in unpredictable ways
-        timeCompressionRatio = 0.0
-        prevTimeCompressionRatio = 0.0
-        analysisAborted = False
+        # A time range either resumes from the state the analysis had at its first frame (see GetBaseState), or starts
+        # kSeamOverlapDuration earlier to establish a base of comparison. Frames before the range only update the base,
+        # they are not output or counted.
+        rangeStart, rangeEnd = (0, None) if frameRange is None else frameRange
+        resumingRange = rangeStart > 0 and not self.baseFrame is None
+        firstFrameIndex = 0
+        if rangeStart > 0:
+            firstFrameIndex = rangeStart if resumingRange else max( 0, rangeStart - int( frameRate * kSeamOverlapDuration ) )
+        skipStartIndex = 0 if resumingRange else firstFrameIndex
+        self.skipPolicy.StartAnalysis( resumingRange )
+        self.rangeTriggers = []
+        self.syncFrameIndex = None
+
+        # Thresholds expressed in pixels scale with the analysis resolution
+        sourceWidth, sourceHeight = videoMeta.width, videoMeta.height
+        analysisResolution = GetAnalysisResolution( self.args, sourceWidth, sourceHeight )
+        if analysisResolution != (sourceWidth, sourceHeight):
+            logger.PrintMessage( 'Analysis resolution: %ix%i' % analysisResolution )
+        self.minChange = kMinChange * analysisResolution[ 0 ] * analysisResolution[ 1 ] / float( sourceWidth * sourceHeight )
+
+        # The base of comparison carried over from the previous file must have the same resolution
+        if not self.baseOfComparison is None and self.baseOfComparison.shape != (analysisResolution[ 1 ], analysisResolution[ 0 ]):
+            logger.PrintMessage( "Resolution differs from the previous file. Aborting file." )
+            algPerformanceResults.analysisAborted = True
+            return
 
-        currentDetectedFrames = []  # Buffer to keep detected frames, in case they need to be discarded
+        # Initialize video iterator. Without a frame rate, it cannot seek by timestamp.
+        seekFrameRate = frameRate
+        if not videoMeta.constantFrameRate:
+            logger.PrintMessage( 'Variable frame rate (%s real, %s average): skipping frames by decoding them' % \
+                (videoMeta.rFrameRateText, videoMeta.frameRateText) )
+            seekFrameRate = None
+        videoIter = CreateVideoIterator( videoPathName, self.args, analysisResolution, seekFrameRate )
+        signalRecorder = None
+        # the decoder may run in another process, and a prefetching thread: they are stopped however the analysis ends
+        try:
+            if firstFrameIndex > 0:
+                videoIter.SkipFrames( firstFrameIndex )
+            signalBaseIndex = 0
+            if self.baseFrame is None:
+                self.baseFrame = self.KeepFrame( videoIter, videoIter.ReadNextFrame() )
+                signalBaseIndex = videoIter.CurrentIndex()
+                self.baseOfComparison = self.PrepareComparison( self.baseFrame, videoIter.CurrentLuminancePlane() )
+                self.baseDiffCoefficient = -1
+                self.baseTileCoefficients = None
+                self.baseScreening = None
+                self.baseScreeningCoefficient = -1
+                self.baseScreeningTileCoefficients = None
+            if self.screeningFactor > 0 and self.baseScreening is None:
+                self.baseScreening = self.PrepareScreeningComparison( None, self.baseOfComparison )
+
+            totalNumFramesTriggered = 0
+
+            # Time Compression statistics, used to abort analysis if the frames are changing all the time, in unpredictable ways
+            timeCompressionRatio = 0.0
+            prevTimeCompressionRatio = 0.0
+            analysisAborted = False
+
+            self.frameSpool.Clear()
+            self.pendingDetections.clear()
+
+            # Signals are recorded for sequential analyses of whole files only
+            if FlagEnabled( self.args, "recordSignals" ) and frameRange is None:
+                signalRecorder = FrameSignalRecorder( GetSignalPath( self.args, self.sourceName ), frameRate )
+
+            timerStart = perf_counter()
+            frameIndexStarted = firstFrameIndex
+            framesProcessedPerSecond = 0
+
+            # With a rewinding iterator, the skip policy may step back into a skipped interval after a trigger.
+            # Frames analyzed again were counted as skipped, unless their analysis was left to the policy (tentativeFrames).
+            canRewind = isinstance( videoIter, RewindingVideoIterator )
+            furthestIndex = videoIter.CurrentIndex()
+            tentativeFrames = set()
+
+            if not profiler is None:
+                profiler.EnableCpuProfile()
+
+            while not (self.baseOfComparison is None):
 
-        timerStart = perf_counter()
-        frameIndexStarted = 0
-        framesProcessedPerSecond = 0
+                #
+                # Read the next frame. Skip some frames if we are in skipping mode (i.e. uninteresting portion of the video)
+                #
 
-        while not (self.baseOfComparison is None):
+                algPerformanceResults.frameFetchingAccumulator.OnStartTimer()
 
-            #
-            # Read the next frame. Skip some frames if we are in skipping mode (i.e. uninteresting portion of the video)
-            #
+                currentFrame = None
 
-            algPerformanceResults.frameFetchingAccumulator.OnStartTimer()
+                try:
+                    nextFrameIndex = self.skipPolicy.NextFrameIndex( videoIter.CurrentIndex() )
+                    if nextFrameIndex < videoIter.CurrentIndex():
+                        algPerformanceResults.totalFramesRewound += videoIter.Rewind( videoIter.CurrentIndex() - nextFrameIndex )
 
-            currentFrame = None
+                    elif nextFrameIndex > videoIter.CurrentIndex() and videoIter.CurrentIndex() > skipStartIndex + 1 and \
+                        nextFrameIndex < totalFrames:
 
-            try:
-                if self.frameSkip > 0 and videoIter.CurrentIndex() > 1 and \
-                    videoIter.CurrentIndex() + self.frameSkip < totalFrames:
+                        indexBeforeSkip = max( rangeStart, videoIter.CurrentIndex(), furthestIndex )
+                        landingIndex = videoIter.SkipFrames( nextFrameIndex - videoIter.CurrentIndex() )
+                        algPerformanceResults.totalFramesSkipped += max( 0, landingIndex - indexBeforeSkip )
+                        furthestIndex = max( furthestIndex, landingIndex )
 
-                    videoIter.SkipFrames( self.frameSkip )
-                    algPerformanceResults.totalFramesSkipped += self.frameSkip
+                    currentFrame = videoIter.ReadNextFrame()
 
-                currentFrame = videoIter.ReadNextFrame()
+                except Exception as e:
+                    logger.PrintMessage( str( e ) )
+                    logger.PrintMessage( "Exception thrown by video decoder attempting to read frame index %i" % videoIter.CurrentIndex() )
+                    # TODO-Pri1 voicua: what if the file support media was unplugged?
+                    logger.PrintMessage( "Assuming end of file. Ending analysis." )
 
-            except Exception as e:
-                logger.PrintMessage( str( e ) )
-                logger.PrintMessage( "Exception thrown by video decoder attempting to read frame index %i" % videoIter.CurrentIndex() )
-                # TODO-Pri1 voicua: what if the file support media was unplugged?
-                logger.PrintMessage( "Assuming end of file. Ending analysis." )
+                algPerformanceResults.frameFetchingAccumulator.OnStopTimer()
 
-            algPerformanceResults.frameFetchingAccumulator.OnStopTimer()
+                if currentFrame is None:
+                    break
+                frameInRange = videoIter.CurrentIndex() > rangeStart
+                frameIndex = videoIter.CurrentIndex() - 1
+                analyzedAgain = frameIndex < furthestIndex
+                furthestIndex = max( furthestIndex, videoIter.CurrentIndex() )
 
-            if currentFrame is None:
-                break
+                #
+                # Calculate differences between current frame and last base of comparison
+                #
 
-            #
-            # Calculate differences between current frame and last base of comparison
-            #
+                # With coarse screening, frames are compared at full resolution only when the screening flags them as candidates
+                motionDerivativeWasDetected = False
+                screeningCandidateDetected = True
+                if self.screeningFactor > 0:
+                    algPerformanceResults.framePrepAccumulator.OnStartTimer()
+                    currentScreening = self.PrepareScreeningComparison( currentFrame, videoIter.CurrentLuminancePlane() )
+                    algPerformanceResults.framePrepAccumulator.OnStopTimer()
+
+                    algPerformanceResults.rocAnalysisAccumulator.OnStartTimer()
+                    currentScreeningTileCoefficients = self.AcquireScreeningTileCoefficientBuffer()
+                    currentScreeningCoefficient = CalculateDifferenceCoefficient( \
+                        self.baseScreening, currentScreening, currentScreeningTileCoefficients, self.screeningScratch )
+                    screeningCandidateDetected = ScreeningCandidateDetected( self.baseScreeningCoefficient, currentScreeningCoefficient, \
+                        self.minChange, self.screeningFactor, self.baseScreeningTileCoefficients, currentScreeningTileCoefficients )
+                    algPerformanceResults.rocAnalysisAccumulator.OnStopTimer()
+                    if not screeningCandidateDetected and frameInRange:
+                        algPerformanceResults.totalFullResolutionDiffsAvoided += 1
+
+                if screeningCandidateDetected:
+                    algPerformanceResults.framePrepAccumulator.OnStartTimer()
+                    currentComparison = self.PrepareComparison( currentFrame, videoIter.CurrentLuminancePlane() )
+                    algPerformanceResults.framePrepAccumulator.OnStopTimer()
+
+                    algPerformanceResults.rocAnalysisAccumulator.OnStartTimer()
+                    currentTileCoefficients = self.AcquireTileCoefficientBuffer()
+                    currentDiffCoefficient = CalculateDifferenceCoefficient( \
+                        self.baseOfComparison, currentComparison, currentTileCoefficients, self.differenceScratch )
+                    motionDerivativeWasDetected = MotionDerivativeDetected( self.baseDiffCoefficient, currentDiffCoefficient, self.minChange, \
+                        self.baseTileCoefficients, currentTileCoefficients )
+                    algPerformanceResults.rocAnalysisAccumulator.OnStopTimer()
+
+                earliestIndex = videoIter.EarliestIndex() if canRewind else frameIndex
+                if not signalRecorder is None:
+                    signalRecorder.RecordFrame( videoIter.CurrentIndex(), signalBaseIndex, self.baseDiffCoefficient, earliestIndex, \
+                        self.differenceScratch.difference if screeningCandidateDetected else None, \
+                        currentDiffCoefficient if screeningCandidateDetected else -1 )
+                if not self.skipPolicy.OnFrameAnalyzed( frameIndex, motionDerivativeWasDetected, earliestIndex ):
+                    tentativeFrames.add( frameIndex )
+                    continue
+                if analyzedAgain and frameInRange and not frameIndex in tentativeFrames:
+                    algPerformanceResults.totalFramesSkipped -= 1
+                tentativeFrames = set( [ i for i in tentativeFrames if i > frameIndex ] )
+
+                if motionDerivativeWasDetected and frameInRange and not syncTriggers is None and \
+                        self.TriggerKey( videoIter.CurrentIndex(), currentDiffCoefficient, currentTileCoefficients ) in syncTriggers:
+                    self.syncFrameIndex = videoIter.CurrentIndex()
+                    break
 
-            algPerformanceResults.framePrepAccumulator.OnStartTimer()
-            currentComparison = PrepareFrameForAnalysis( currentFrame )
-            algPerformanceResults.framePrepAccumulator.OnStopTimer()
+                if motionDerivativeWasDetected:
+            
+                    #
+                    # We found a frame which triggered the motion detection heuristic
+                    #
+
+                    # TODO voicua: proper messaging
+                    # logger.PrintMessage( 'Number of changed pixel luminances: %i' % currentDiffCoefficient )
+
+                    self.baseDiffCoefficient = currentDiffCoefficient
+                    self.baseTileCoefficients = currentTileCoefficients
+                    self.baseFrame = self.KeepFrame( videoIter, currentFrame )
+                    signalBaseIndex = videoIter.CurrentIndex()
+                    if not signalRecorder is None:
+                        signalRecorder.MarkTriggered()
+                    if not self.diffOverlayRenderer is None:
+                        self.diffOverlayRenderer.Render( self.baseFrame, self.differenceScratch.changedPixels, FlagEnabled( self.args, "onlyDiffs" ) )
+                    self.baseOfComparison = currentComparison
+                    if self.screeningFactor > 0:
+                        self.baseScreening = currentScreening
+                        self.baseScreeningCoefficient = currentScreeningCoefficient
+                        self.baseScreeningTileCoefficients = currentScreeningTileCoefficients
+
+                    # Save the pixels for subsequent analysis
+                    if frameInRange:
+                        algPerformanceResults.outputWritingAccumulator.OnStartTimer()
+                        self.BufferDetectedFrame( videoIter.CurrentIndex(), self.baseFrame, currentDiffCoefficient, \
+                            (videoIter.CurrentIndex() - 1) / frameRate )
+                        algPerformanceResults.outputWritingAccumulator.OnStopTimer()
+                        totalNumFramesTriggered += 1
+                        self.rangeTriggers.append( self.TriggerKey( videoIter.CurrentIndex(), currentDiffCoefficient, currentTileCoefficients ) )
+        
 
-            algPerformanceResults.rocAnalysisAccumulator.OnStartTimer()
-            currentDiffCoefficient = CalculateDifferenceCoefficient( \
-                self.baseOfComparison, currentComparison, currentFrame, self.args )
-            motionDerivativeWasDetected = MotionDerivativeDetected( self.baseDiffCoefficient, currentDiffCoefficient )
-            algPerformanceResults.rocAnalysisAccumulator.OnStopTimer()
+                # Done processing of this frame
+                if not frameInRange:
+                    continue
+                algPerformanceResults.totalFramesProcessed += 1
 
-            if motionDerivativeWasDetected:
-            
                 #
-                # We found a frame which triggered the motion detection heuristic
+                # Inspect movie time compression performance, and skip this file if it cannot be analyzed by this algorithm
                 #
 
-                # TODO-Pri1 voicua: use an iterator wrapper to hold onto the last 100 frames or so.
-                # this will allow to jump back in time when analysis realizes it found some serious motion
-                # especially after the accelerated (skipping) mode
+                framesCovered = videoIter.CurrentIndex() - rangeStart
+                timeCompressionRatio = float( totalNumFramesTriggered ) / float( framesCovered )
+                if framesCovered > kWarmUpFrameCount:
+                    if timeCompressionRatio > 0.95 or (timeCompressionRatio > 0.50 and timeCompressionRatio > prevTimeCompressionRatio): 
+                        analysisAborted = True
+                        break
+                    prevTimeCompressionRatio = timeCompressionRatio
 
-                # TODO voicua: proper messaging
-                # logger.PrintMessage( 'Number of changed pixel luminances: %i' % currentDiffCoefficient )
+                if not rangeEnd is None and videoIter.CurrentIndex() >= rangeEnd and not self.skipPolicy.Searching():
+                    break
 
-                self.baseDiffCoefficient = currentDiffCoefficient
-                self.baseFrame = currentFrame
-                self.baseOfComparison = currentComparison
 
-                # Save the pixels for subsequent analysis
-                self.BufferDetectedFrame( currentDetectedFrames, videoIter.CurrentIndex(), self.baseFrame )
-        
-                # Update compression (detection) statistics
-                numLoopsUntriggered = 0
-                self.frameSkip = 0   # if we were skipping frames, no more. We found motion.
-                totalNumFramesTriggered += 1
-
-            elif self.frameSkip < self.kMaxFrameSkip:
-                numLoopsUntriggered += 1
-                if numLoopsUntriggered > self.kNumLoopsUntriggeredThreshold:
-                    # time to move faster through the video, only unchanged frames here
-                    numLoopsUntriggered = 0
-                    self.frameSkip += 8
-
-
-            # Done processing of this frame
-            algPerformanceResults.totalFramesProcessed += 1
-
-            #
-            # Inspect movie time compression performance, and skip this file if it cannot be analyzed by this algorithm
-            #
-
-            timeCompressionRatio = float( totalNumFramesTriggered ) / float( videoIter.CurrentIndex() )
-            if videoIter.CurrentIndex() > kWarmUpFrameCount:
-                if timeCompressionRatio > 0.95 or (timeCompressionRatio > 0.50 and timeCompressionRatio > prevTimeCompressionRatio): 
-                    analysisAborted = True
-                    break
-                prevTimeCompressionRatio = timeCompressionRatio
-
-
-            #
-            # Update algorithm running time performance statistics
-            #
-
-            currentPercentageDone = float( videoIter.CurrentIndex() ) / float( totalFrames)
-            currentTime = perf_counter()
-            if currentTime - timerStart > 10 or framesProcessedPerSecond == 0:
-                # recalculate statistics
-                timeSpanReference = currentTime - timerStart
-                framesProcessedPerSecond = int( (videoIter.CurrentIndex() - frameIndexStarted) / timeSpanReference )
-                if not self.args is None and self.args.verboseRunningTime:
-                    diskPercentage = int( 100.0 * algPerformanceResults.frameFetchingAccumulator.accumulator / timeSpanReference )
-                    prepPercentage = int( 100.0 * algPerformanceResults.framePrepAccumulator.accumulator / timeSpanReference )
-                    analysisPercentage = int( 100.0 * algPerformanceResults.rocAnalysisAccumulator.accumulator / timeSpanReference )
-                    logger.PrintMessage()
-                    logger.PrintMessage( "Algorithm FPS: %i (Frame fetching: %i%%, Frame preparation: %i%%, Analysis: %i%%)" \
-                        % (framesProcessedPerSecond, diskPercentage, prepPercentage, analysisPercentage) )
-                    print( "Total allocated memory: %s" % vh.FormatMemSize( psutil.Process().memory_info().rss ) )
+                #
+                # Update algorithm running time performance statistics
+                #
+
+                currentPercentageDone = float( videoIter.CurrentIndex() ) / float( totalFrames)
+                currentTime = perf_counter()
+                if currentTime - timerStart > 10 or framesProcessedPerSecond == 0:
+                    # recalculate statistics
+                    timeSpanReference = currentTime - timerStart
+                    # time spent waiting for the output encoder is not part of the analysis speed
+                    analysisTimeSpan = max( timeSpanReference - algPerformanceResults.outputWritingAccumulator.accumulator, 1e-6 )
+                    framesProcessedPerSecond = int( (videoIter.CurrentIndex() - frameIndexStarted) / analysisTimeSpan )
+                    algPerformanceResults.SampleMemoryUsage()
+                    if not profiler is None:
+                        profiler.Sample( "frame %i (%i%%)" % (videoIter.CurrentIndex(), 100 * currentPercentageDone) )
+                    if not self.args is None and self.args.verboseRunningTime:
+                        diskPercentage = int( 100.0 * algPerformanceResults.frameFetchingAccumulator.accumulator / timeSpanReference )
+                        prepPercentage = int( 100.0 * algPerformanceResults.framePrepAccumulator.accumulator / timeSpanReference )
+                        analysisPercentage = int( 100.0 * algPerformanceResults.rocAnalysisAccumulator.accumulator / timeSpanReference )
+                        outputPercentage = int( 100.0 * algPerformanceResults.outputWritingAccumulator.accumulator / timeSpanReference )
+                        logger.PrintMessage()
+                        logger.PrintMessage( "Algorithm FPS: %i (Frame fetching: %i%%, Frame preparation: %i%%, Analysis: %i%%, Output wait: %i%%)" \
+                            % (framesProcessedPerSecond, diskPercentage, prepPercentage, analysisPercentage, outputPercentage) )
+                        print( "Total allocated memory: %s" % vh.FormatMemSize( psutil.Process().memory_info().rss ) )
                     
-                # reset counters
-                timerStart = currentTime
-                frameIndexStarted = videoIter.CurrentIndex()
-                algPerformanceResults.ResetPerfCounters()
-
-            if self.frameSkip == 0:        
-                print( "Frames completed: %i (%i%%, speed=%ifps), ratio = %.2f            " \
-                    % (videoIter.CurrentIndex(), 100 * currentPercentageDone, framesProcessedPerSecond, timeCompressionRatio), end='\r' )
-            else:
-                print( "Frames completed: %i (%i%%, speed=%ifps), frameSkip = %i          " \
-                    % (videoIter.CurrentIndex(), 100 * currentPercentageDone, framesProcessedPerSecond, self.frameSkip), end='\r' )
+                    # reset counters
+                    timerStart = currentTime
+                    frameIndexStarted = videoIter.CurrentIndex()
+                    algPerformanceResults.ResetPerfCounters()
+
+                if self.skipPolicy.frameSkip == 0:
+                    print( "Frames completed: %i (%i%%, speed=%ifps), ratio = %.2f            " \
+                        % (videoIter.CurrentIndex(), 100 * currentPercentageDone, framesProcessedPerSecond, timeCompressionRatio), end='\r' )
+                else:
+                    print( "Frames completed: %i (%i%%, speed=%ifps), frameSkip = %i          " \
+                        % (videoIter.CurrentIndex(), 100 * currentPercentageDone, framesProcessedPerSecond, self.skipPolicy.frameSkip), end='\r' )
+
+            self.lastFrameIndex = videoIter.CurrentIndex()
+        finally:
+            if not profiler is None:
+                profiler.DisableCpuProfile()
+            videoIter.Close()
+            if not signalRecorder is None:
+                signalRecorder.Close()
+        algPerformanceResults.SampleMemoryUsage()
 
         # Update returned performance data
+        algPerformanceResults.skipPolicy = self.skipPolicy.name
         algPerformanceResults.totalFramesTriggered = totalNumFramesTriggered
         algPerformanceResults.algorithmFPS = framesProcessedPerSecond
 
         if analysisAborted:
-            currentDetectedFrames.clear()
+            self.frameSpool.Clear()
+            self.pendingDetections.clear()
             algPerformanceResults.analysisAborted = True
             logger.PrintMessage( 'Rate of Change algorithm cannot analyze this video file succesfully. Aborted.' )
             return
 
-        self.FlushVideoData( currentDetectedFrames )
+        self.FlushVideoData()
+        if not signalRecorder is None:
+            logger.PrintMessage( 'Frame signals saved to %s' % signalRecorder.signalPath )
 
         logger.PrintMessage( '' )
-        logger.PrintMessage( 'Number of frames processed: %i' % algPerformanceResults.totalFramesProcessed )
+        logger.PrintMessage( 'Number of frames processed: %i, skipped: %i (%s skip policy)' \
+            % (algPerformanceResults.totalFramesProcessed, algPerformanceResults.totalFramesSkipped, algPerformanceResults.skipPolicy) )
+        if self.screeningFactor > 0:
+            logger.PrintMessage( 'Full resolution comparisons avoided by the coarse screening: %i' \
+                % algPerformanceResults.totalFullResolutionDiffsAvoided )
+        if ArgValue( self.args, "rewindFrames", 0 ) > 0:
+            logger.PrintMessage( 'Frames stepped back over after a skip: %i' % algPerformanceResults.totalFramesRewound )
         logger.PrintMessage( 'Total number of frames found interesting: %i' % totalNumFramesTriggered )
         logger.PrintMessage( "Frame rate-of-change analysis done." )
 
 
 
+    # Splits the file in time ranges, analyzed in parallel by worker processes. The first range continues from the current
+    # state; the others are speculative: they re-establish a base of comparison over the kSeamOverlapDuration before them.
+    # Seams are then reconciled in order: a range is analyzed again, from the exact state and frame the previous range ended
+    # with, until it triggers on a frame and coefficient the speculative analysis also triggered on. From that trigger on both
+    # analyses have identical states, so the speculative results are kept. The detected frames are the ones of a sequential
+    # analysis; only the abort decision is taken per range.
+    def AddVideoFileToAnalysisInRanges( self, videoPathName, logger, algPerformanceResults, totalFrames, rangeCount, videoMeta ):
+        rangeSize = int( math.ceil( totalFrames / float( rangeCount ) ) )
+        frameRanges = [ (i * rangeSize, (i + 1) * rangeSize if i < rangeCount - 1 else None) for i in range( rangeCount ) ]
+        spoolPaths = [ os.path.join( self.args.destFolder, "%s%s_range%i.spool" % (kTempFilePrefix, self.videoAnalysisName, i) ) \
+            for i in range( rangeCount ) ]
+        seamSpoolPaths = [ os.path.join( self.args.destFolder, "%s%s_seam%i.spool" % (kTempFilePrefix, self.videoAnalysisName, i) ) \
+            for i in range( rangeCount ) ]
+        logger.PrintMessage( "Analyzing %i time ranges of %i frames in parallel" % (rangeCount, rangeSize) )
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor( max_workers = rangeCount ) as executor:
+                futures = [ executor.submit( AnalyzeVideoRangeJob, self.args, videoPathName, frameRanges[ i ], spoolPaths[ i ], \
+                    self.GetBaseState() if i == 0 else None, None, videoMeta ) for i in range( rangeCount ) ]
+                rangeResults = []
+                for (i, future) in enumerate( futures ):
+                    try:
+                        rangeResults.append( future.result() )
+                    except Exception as e:
+                        logger.PrintMessage( str( e ) )
+                        logger.PrintMessage( "Exception thrown during the analysis of time range %i" % i )
+                        algPerformanceResults.analysisAborted = True
+
+            # without all the ranges, the file cannot be reconciled: it is aborted like a failed sequential analysis
+            if algPerformanceResults.analysisAborted:
+                logger.PrintMessage( 'Rate of Change algorithm cannot analyze this video file succesfully. Aborted.' )
+                return
+
+            # (spool path, first frame index taken from it) in output order
+            rangeOutputs = [ (spoolPaths[ 0 ], 0) ]
+            self.AddRangePerformanceResults( algPerformanceResults, rangeResults[ 0 ][ 0 ] )
+            (baseState, lastFrameIndex) = rangeResults[ 0 ][ 1:3 ]
+            reconciledFrames = 0
+            for i in range( 1, rangeCount ):
+                (rangePerformanceResults, rangeBaseState, rangeLastFrameIndex, rangeTriggers, _) = rangeResults[ i ]
+                (seamPerformanceResults, seamBaseState, seamLastFrameIndex, _, syncFrameIndex) = AnalyzeVideoRangeJob( \
+                    self.args, videoPathName, (lastFrameIndex, frameRanges[ i ][ 1 ]), seamSpoolPaths[ i ], baseState, \
+                    set( rangeTriggers ), videoMeta )
+                self.AddRangePerformanceResults( algPerformanceResults, seamPerformanceResults )
+                rangeOutputs.append( (seamSpoolPaths[ i ], 0) )
+                if syncFrameIndex is None:
+                    # never synchronized: the analysis from the seam replaces the speculative one
+                    reconciledFrames += seamLastFrameIndex - lastFrameIndex
+                    (baseState, lastFrameIndex) = (seamBaseState, seamLastFrameIndex)
+                    continue
+
+                reconciledFrames += syncFrameIndex - lastFrameIndex
+                rangePerformanceResults.totalFramesTriggered = len( [ t for t in rangeTriggers if t[ 0 ] >= syncFrameIndex ] )
+                self.AddRangePerformanceResults( algPerformanceResults, rangePerformanceResults )
+                rangeOutputs.append( (spoolPaths[ i ], syncFrameIndex) )
+                (baseState, lastFrameIndex) = (rangeBaseState, rangeLastFrameIndex)
+            self.SetBaseState( baseState )
+            logger.PrintMessage( "Frames analyzed again to reconcile the time ranges: %i" % reconciledFrames )
+
+            if algPerformanceResults.analysisAborted:
+                logger.PrintMessage( 'Rate of Change algorithm cannot analyze this video file succesfully. Aborted.' )
+                return
+
+            for (spoolPath, firstFrameIndex) in rangeOutputs:
+                self.AddSpooledFrames( spoolPath, firstFrameIndex )
+
+        finally:
+            for spoolPath in spoolPaths + seamSpoolPaths:
+                if os.path.isfile( spoolPath ):
+                    os.remove( spoolPath )
+
+        logger.PrintMessage( '' )
+        logger.PrintMessage( 'Number of frames processed: %i, skipped: %i (%s skip policy)' \
+            % (algPerformanceResults.totalFramesProcessed, algPerformanceResults.totalFramesSkipped, algPerformanceResults.skipPolicy) )
+        if self.screeningFactor > 0:
+            logger.PrintMessage( 'Full resolution comparisons avoided by the coarse screening: %i' \
+                % algPerformanceResults.totalFullResolutionDiffsAvoided )
+        if ArgValue( self.args, "rewindFrames", 0 ) > 0:
+            logger.PrintMessage( 'Frames stepped back over after a skip: %i' % algPerformanceResults.totalFramesRewound )
+        logger.PrintMessage( 'Total number of frames found interesting: %i' % algPerformanceResults.totalFramesTriggered )
+        logger.PrintMessage( "Frame rate-of-change analysis done." )
+
+    def AddRangePerformanceResults( self, algPerformanceResults, rangePerformanceResults ):
+        algPerformanceResults.totalFramesProcessed += rangePerformanceResults.totalFramesProcessed
+        algPerformanceResults.totalFramesSkipped += rangePerformanceResults.totalFramesSkipped
+        algPerformanceResults.totalFramesTriggered += rangePerformanceResults.totalFramesTriggered
+        algPerformanceResults.totalFullResolutionDiffsAvoided += rangePerformanceResults.totalFullResolutionDiffsAvoided
+        algPerformanceResults.totalFramesRewound += rangePerformanceResults.totalFramesRewound
+        algPerformanceResults.skipPolicy = rangePerformanceResults.skipPolicy
+        algPerformanceResults.algorithmFPS = max( algPerformanceResults.algorithmFPS, rangePerformanceResults.algorithmFPS )
+        algPerformanceResults.analysisAborted |= rangePerformanceResults.analysisAborted
+        algPerformanceResults.peakMemoryUsage = max( algPerformanceResults.peakMemoryUsage, rangePerformanceResults.peakMemoryUsage )
+        for (stage, histogram) in rangePerformanceResults.stageLatencies.items():
+            algPerformanceResults.stageLatencies[ stage ].Merge( histogram )
+
+    # Metadata of the file, from the metadata store if any. Probing errors are raised.
+    def GetVideoMetadata( self, videoPathName ):
+        if self.metadataStore is None:
+            return vh.VideoMetadata( vh.ProbeVideoFile( videoPathName ) )
+        return self.metadataStore.Get( videoPathName )
+
+    # State carried over from one video file, or time range, to the next
+    # (the decimated base of comparison of the coarse screening is derived from the base of comparison)
+    def GetBaseState( self ):
+        return (self.baseFrame, self.baseOfComparison, self.baseDiffCoefficient, self.baseTileCoefficients, \
+            self.baseScreeningCoefficient, self.baseScreeningTileCoefficients, self.skipPolicy.GetState())
+
+    def SetBaseState( self, baseState ):
+        (self.baseFrame, self.baseOfComparison, self.baseDiffCoefficient, self.baseTileCoefficients, \
+            self.baseScreeningCoefficient, self.baseScreeningTileCoefficients, skipPolicyState) = baseState
+        self.skipPolicy.SetState( skipPolicyState )
+        self.baseScreening = None
+
+    # Identifies a trigger, and the state of the analysis after it (see AddVideoFileToAnalysisInRanges)
+    def TriggerKey( self, frameIndex, diffCoefficient, tileCoefficients ):
+        if tileCoefficients is None:
+            return (frameIndex, diffCoefficient)
+        return (frameIndex, diffCoefficient, tileCoefficients.tobytes())
+
     # returns the duration in seconds, of the output video
     def GetOutputLength( self ):
         return int( self.totalFrameOutputCount / 30 )
 
     def FinishAnalysis( self ):
         self.WriteVideoData()
-        if not self.videoWriter is None:
-            self.videoWriter.close()
-            os.rename( self.kRocTemporaryFilePath, self.kRocAnalyzedFilePath )
+        if not self.frameEncoder is None:
+            frameEncoder = self.frameEncoder
+            self.frameEncoder = None
+            frameEncoder.Close()
+            if not frameEncoder.videoFilePath is None:
+                os.rename( self.kRocTemporaryFilePath, self.kRocAnalyzedFilePath )
+        if self.outputSpoolPath is None and len( self.detectionIndex ) > 0:
+            self.detectionIndex.Save( self.kRocIndexFilePath )
+        self.frameSpool.Close()
+
+    # Adds to this analysis the output frames spooled by another analyzer, in their original order,
+    # starting with the frame index firstFrameIndex. sourceName is the file name recorded in the detection index,
+    # by default the file of the last analysis.
+    def AddSpooledFrames( self, spoolPath, firstFrameIndex = 0, sourceName = None ):
+        if not sourceName is None:
+            self.sourceName = sourceName
+        if not os.path.isfile( spoolPath ):
+            return
+        with open( spoolPath, 'rb' ) as spoolFile:
+            spoolSize = os.fstat( spoolFile.fileno() ).st_size
+            while spoolFile.tell() < spoolSize:
+                (frameIndex, diffCoefficient, timestamp) = numpy.load( spoolFile ).tolist()
+                frame = numpy.load( spoolFile )
+                if frameIndex < firstFrameIndex:
+                    continue
+                self.BufferDetectedFrame( int( frameIndex ), frame, int( diffCoefficient ), timestamp )
+        self.FlushVideoData()
 
 
 
 # "Private" methods:
 
-    def BufferDetectedFrame( self, currentDetectedFrames, indexInOriginalFile, framePixels ):
-        currentDetectedFrames.append( (indexInOriginalFile, framePixels) )
-        if len( currentDetectedFrames ) > self.kMaxFramesToBuffer:
-            self.FlushVideoData( currentDetectedFrames )
-
-    def FlushVideoData( self, incomingDetectedFrames ):
-        self.detectedFrames.extend( incomingDetectedFrames )
-        self.totalFrameOutputCount += len( incomingDetectedFrames )
-        incomingDetectedFrames.clear()
-        if len( self.detectedFrames ) < 30:
-            return
-        self.WriteVideoData()
-
+    def PrepareComparison( self, frame, luminancePlane = None ):
+        if not luminancePlane is None:
+            comparison = self.AcquireComparisonBuffer( luminancePlane.shape )
+            numpy.copyto( comparison, luminancePlane )
+            return comparison
+        if self.luminanceKernel is None:
+            return PrepareFrameForAnalysis( frame )
+        return PrepareFrameForAnalysis( frame, self.luminanceKernel, self.AcquireComparisonBuffer( frame.shape[ 0:2 ] ) )
+
+    # Decimated plane for the coarse screening. The luminance of the decimated frame is the decimated luminance plane,
+    # so only the sampled pixels are converted.
+    def PrepareScreeningComparison( self, frame, luminancePlane = None ):
+        if luminancePlane is None:
+            sampledFrame = numpy.ascontiguousarray( frame[ ::self.screeningFactor, ::self.screeningFactor ] )
+            if self.luminanceKernel is None:
+                return PrepareFrameForAnalysis( sampledFrame )
+            return PrepareFrameForAnalysis( sampledFrame, self.luminanceKernel, self.AcquireScreeningBuffer( sampledFrame.shape[ 0:2 ] ) )
+        sampledPlane = luminancePlane[ ::self.screeningFactor, ::self.screeningFactor ]
+        comparison = self.AcquireScreeningBuffer( sampledPlane.shape )
+        numpy.copyto( comparison, sampledPlane )
+        return comparison
+
+    def KeepFrame( self, videoIter, frame ):
+        if videoIter.ReusesFrameBuffers():
+            return frame.copy()
+        return frame
+
+    # Returns None when not analyzing by tiles
+    def AcquireTileCoefficientBuffer( self ):
+        for b in self.tileCoefficientBuffers:
+            if not b is self.baseTileCoefficients:
+                return b
+        return None
+
+    def AcquireScreeningTileCoefficientBuffer( self ):
+        for b in self.screeningTileCoefficientBuffers:
+            if not b is self.baseScreeningTileCoefficients:
+                return b
+        return None
+
+    def AcquireScreeningBuffer( self, shape ):
+        for b in self.screeningBuffers:
+            if b.shape == shape and not b is self.baseScreening:
+                return b
+        newBuffer = numpy.empty( shape, numpy.uint8 )
+        self.screeningBuffers = [ b for b in self.screeningBuffers if b is self.baseScreening ] + [ newBuffer ]
+        return newBuffer
+
+    # Returns a buffer which is not the current base of comparison. Only two buffers are kept alive.
+    def AcquireComparisonBuffer( self, shape ):
+        for b in self.comparisonBuffers:
+            if b.shape == shape and not b is self.baseOfComparison:
+                return b
+        newBuffer = numpy.empty( shape, numpy.uint8 )
+        self.comparisonBuffers = [ b for b in self.comparisonBuffers if b is self.baseOfComparison ] + [ newBuffer ]
+        return newBuffer
+
+    def BufferDetectedFrame( self, indexInOriginalFile, framePixels, diffCoefficient, timestamp ):
+        if len( self.frameSpool ) > 0 and self.frameSpool.SlotShape() != framePixels.shape:
+            self.FlushVideoData()
+        self.frameSpool.Append( indexInOriginalFile, framePixels )
+        self.pendingDetections[ indexInOriginalFile ] = (diffCoefficient, timestamp)
+        if self.frameSpool.Full():
+            self.FlushVideoData()
+
+    # Hands the spooled frames to the output, without copying them. The analysis goes on while they are encoded:
+    # the spool moves on to its next bank, and waits for the encoder only before reusing the slots of these frames.
+    # The frames left waiting for the choice of output format (too few frames to start a video) are copied out of the spool.
+    def FlushVideoData( self ):
+        for (frameIndex, frame) in self.frameSpool.Frames():
+            (diffCoefficient, timestamp) = self.pendingDetections.pop( frameIndex )
+            self.detectionIndex.Append( self.sourceName, frameIndex, timestamp, diffCoefficient )
+            self.detectedFrames.append( (frameIndex, frame) )
+        self.totalFrameOutputCount += len( self.frameSpool )
+        releaseWait = None
+        if len( self.detectedFrames ) >= 30:
+            self.WriteVideoData()
+            if not self.frameEncoder is None:
+                releaseWait = functools.partial( self.frameEncoder.WaitForTasks, self.frameEncoder.SubmittedCount() )
+        self.detectedFrames = [ (frameIndex, numpy.array( frame ) if isinstance( frame, numpy.memmap ) else frame) \
+            for (frameIndex, frame) in self.detectedFrames ]
+        self.frameSpool.Clear( releaseWait )
+        self.pendingDetections.clear()
+
+    # The frames waiting for the output are the last ones of the detection index
     def WriteVideoData( self ):
         if len( self.detectedFrames ) == 0:
             return
+        firstRow = len( self.detectionIndex ) - len( self.detectedFrames )
+
+        if not self.outputSpoolPath is None:
+            with open( self.outputSpoolPath, 'ab' ) as spoolFile:
+                for (i, (frameIndex, frame)) in enumerate( self.detectedFrames ):
+                    row = self.detectionIndex.Row( firstRow + i )
+                    numpy.save( spoolFile, numpy.array( [ frameIndex, row[ 2 ], row[ 1 ] ], numpy.float64 ) )
+                    numpy.save( spoolFile, DecodeFrame( frame ) )
+            self.detectedFrames.clear()
+            return
 
-        if self.videoWriter is None:
+        if self.frameEncoder is None:
+            self.frameEncoder = AsyncFrameEncoder( ArgValue( self.args, "encoderQueueFrames", kEncoderQueueCapacity ) )
+
+        if self.frameEncoder.videoFilePath is None:
             if len( self.detectedFrames ) < 10:
                 # Write pngs to disk.
                 for (frameIndex, frame) in self.detectedFrames:
-                    iio.imwrite( os.path.join( self.args.destFolder, \
+                    self.frameEncoder.WriteImage( os.path.join( self.args.destFolder, \
                         #TODO-Pri0 voicua: depending on the second analysis phase, think more about numbering here.
                         #   e.g. use file index in addition to frameIndex, or maybe an absolute time unit.
                         self.videoAnalysisName + '_ROC_analyzed_frame_' + str( frameIndex ) + '.png' ), frame )
@@ -488,24 +2051,77 @@ class RateOfChangeAnalyzer:
                 return
 
             if len( self.detectedFrames ) < 30:
-                self.videoWriter = iio.get_writer( self.kRocTemporaryFilePath, fps = 10 )
+                self.frameEncoder.OpenVideo( self.kRocTemporaryFilePath, 10 )
             else:
-                self.videoWriter = iio.get_writer( self.kRocTemporaryFilePath, fps = 30 )
+                self.frameEncoder.OpenVideo( self.kRocTemporaryFilePath, 30 )
 
-        for (frameIndex, frame) in self.detectedFrames:
-            self.videoWriter.append_data( frame )
+        for (i, (frameIndex, frame)) in enumerate( self.detectedFrames ):
+            self.frameEncoder.AppendVideoFrame( frame )
+            self.detectionIndex.SetOutputFrame( firstRow + i, self.videoFrameOutputCount )
+            self.videoFrameOutputCount += 1
         self.detectedFrames.clear()
 
     def RemoveOutput( self ):
+        if not self.frameEncoder is None:
+            self.frameEncoder.Cancel()
+            self.frameEncoder = None
+        self.frameSpool.Close()
         if os.path.isfile( self.kRocTemporaryFilePath ):
             os.remove( self.kRocTemporaryFilePath )
         if os.path.isfile( self.kRocAnalyzedFilePath ):
             os.remove( self.kRocAnalyzedFilePath )
+        self.detectionIndex.Clear()
+        if os.path.isfile( self.kRocIndexFilePath ):
+            os.remove( self.kRocIndexFilePath )
 
 
 # End class RateOfChangeAnalysis
 
 
+# Replays the trigger logic on the signals recorded for a video file (see ReplayFrameSignals), with the thresholds of args
+def ReplayVideoFileSignals( args, videoPathName, logger ):
+    signals = numpy.load( GetSignalPath( args, videoPathName ), mmap_mode = 'r' )
+
+    videoMeta = vh.VideoMetadata( vh.ProbeVideoFile( videoPathName ) )
+    frameRate = videoMeta.frameRate
+    sourceWidth, sourceHeight = videoMeta.width, videoMeta.height
+    analysisResolution = GetAnalysisResolution( args, sourceWidth, sourceHeight )
+    minChange = args.replayMinChange * analysisResolution[ 0 ] * analysisResolution[ 1 ] / float( sourceWidth * sourceHeight )
+
+    replayStart = perf_counter()
+    (triggeredFrames, approximatedFrames, analysisAborted) = ReplayFrameSignals( signals, CreateSkipPolicy( args ), minChange, \
+        args.replayLuminanceThreshold, args.replayDerivativeThreshold, frameRate * 2 * 60 )
+    replayDuration = perf_counter() - replayStart
+
+    recordedTriggers = set( signals[ 'frameIndex' ][ signals[ 'triggered' ] ].tolist() )
+    logger.PrintMessage( 'Replayed %i recorded frames in %.2f s: luminance threshold %i, min change %i, derivative threshold %.1f%%' \
+        % (len( signals ), replayDuration, args.replayLuminanceThreshold, args.replayMinChange, args.replayDerivativeThreshold) )
+    logger.PrintMessage( 'Frames found interesting: %i (recorded analysis: %i, in common: %i)' \
+        % (len( triggeredFrames ), len( recordedTriggers ), len( recordedTriggers.intersection( triggeredFrames ) )) )
+    logger.PrintMessage( 'Frames compared to another base than recorded, or not recorded: %i' % approximatedFrames )
+    if analysisAborted:
+        logger.PrintMessage( 'The analysis of this file would be aborted.' )
+
+
+# Runs in a worker process: analysis of one time range of a video file. Output frames are spooled to spoolPath.
+# Returns the performance results, the state at the end of the range, the index of the frame following the range,
+# the triggers found and the index of the frame the analysis synchronized on (see AddVideoFileToAnalysis).
+# videoMeta, the metadata of the file, saves probing it again in every worker.
+def AnalyzeVideoRangeJob( args, videoPathName, frameRange, spoolPath, baseState = None, syncTriggers = None, videoMeta = None ):
+    rangeArgs = argparse.Namespace( **vars( args ) )
+    rangeArgs.rangeJobs = 1
+    rocAnalyzer = RateOfChangeAnalyzer( rangeArgs, os.path.basename( videoPathName ) )
+    rocAnalyzer.outputSpoolPath = spoolPath
+    if not baseState is None:
+        rocAnalyzer.SetBaseState( baseState )
+
+    algPerformanceResults = AlgorithmPerformanceResults()
+    rocAnalyzer.AddVideoFileToAnalysis( videoPathName, vh.Logger(), algPerformanceResults, frameRange, syncTriggers, videoMeta = videoMeta )
+    rocAnalyzer.FinishAnalysis()
+    return (algPerformanceResults, rocAnalyzer.GetBaseState(), rocAnalyzer.lastFrameIndex, \
+        rocAnalyzer.rangeTriggers, rocAnalyzer.syncFrameIndex)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument( "videoFile", help = "path to the video file to analyze" )
@@ -517,18 +2133,77 @@ if __name__ == "__main__":
         help="if enabled highlights the pixel difference in the output" )
     parser.add_argument( "--onlyDiffs", action="store_true",
         help="if enabled only the differences are output" )
+    parser.add_argument( "--luminanceMethod", choices = [ kLuminanceMethodFixedPoint, kLuminanceMethodPIL ],
+        default = kLuminanceMethodPIL, help = "luminance calculation used for frame preparation. Default: %(default)s" )
+    parser.add_argument( "--videoDecoder", choices = [ kVideoDecoderImageIO, kVideoDecoderFFmpegPipe ],
+        default = kVideoDecoderImageIO, help = "video decoding backend. Default: %(default)s" )
+    parser.add_argument( "--analysisWidth", type = int, default = 0,
+        help = "with the ffmpegpipe decoder, frames are scaled by the decoder to this width. Default: source width" )
+    parser.add_argument( "--grayOutput", action = "store_true",
+        help = "with the ffmpegpipe decoder, skip decoding RGB frames and output the gray analysis frames" )
+    parser.add_argument( "--seekSkipThreshold", type = int, default = kMinimumSeekSkip,
+        help = "with the ffmpegpipe decoder, frame skips of at least this many frames restart the decoder at the target frame, " \
+            "instead of decoding the skipped frames. 0 disables seeking. Default: %(default)s" )
+    parser.add_argument( "--prefetchFrames", type = int, nargs = "?", const = kPrefetchCapacity, default = 0,
+        help = "decode frames ahead on a separate thread, in a ring of the given size. Default size: %i" % kPrefetchCapacity )
+    parser.add_argument( "--rangeJobs", type = int, default = 1,
+        help = "number of time ranges of a video file analyzed in parallel, in worker processes. Default: %(default)s" )
+    parser.add_argument( "--tileGrid", type = int, nargs = 2, metavar = ("COLUMNS", "ROWS"), default = None,
+        help = "also trigger on the rate of change of every tile of a grid, catching local motion. Default: whole frame only" )
+    parser.add_argument( "--coarseScreening", type = int, nargs = "?", const = kScreeningFactor, default = 0,
+        help = "compare frames at full resolution only if a comparison on planes decimated by the given factor flags them. " \
+            "Default factor: %i" % kScreeningFactor )
+    parser.add_argument( "--rewindFrames", type = int, nargs = "?", const = kRewindCapacity, default = 0,
+        help = "keep the last frames read in a ring of the given size, to go back to the start of the motion after a frame skip. " \
+            "Default size: %i" % kRewindCapacity )
+    parser.add_argument( "--skipPolicy", choices = [ kSkipPolicyFixed, kSkipPolicyAdaptive ], default = kSkipPolicyFixed,
+        help = "how frames are skipped while nothing triggers. With --rewindFrames, the fixed policy analyzes the skipped frames " \
+            "again after a trigger, the adaptive policy bisects them. Default: %(default)s" )
+    parser.add_argument( "--encoderQueueFrames", type = int, default = kEncoderQueueCapacity,
+        help = "output frames waiting to be encoded on a separate thread. 0 encodes on the analysis thread. Default: %(default)s" )
+    parser.add_argument( "--frameSpoolBudget", type = int, default = kFrameSpoolBudget,
+        help = "MiB of detected frames kept in a memory-mapped file in the destination folder, before they are written. " \
+            "Default: %(default)s" )
+    parser.add_argument( "--compressFrames", action="store_true",
+        help = "keep the detected frames compressed in memory until they are written, instead of in a memory-mapped file" )
+    parser.add_argument( "--recordSignals", action="store_true",
+        help = "save per-frame signals of the analysis next to the output, to replay the trigger logic with other thresholds. " \
+            "Cannot be combined with --rangeJobs" )
+    parser.add_argument( "--profile", action="store_true",
+        help = "write a CPU profile of the frame loop, and the memory and object count growth, next to the output. " \
+            "The frame loop is not profiled with --rangeJobs" )
+    parser.add_argument( "--replaySignals", action="store_true",
+        help = "instead of analyzing the video file, replay the trigger logic on its recorded signals" )
+    parser.add_argument( "--replayLuminanceThreshold", type = int, choices = kSignalLuminanceThresholds, default = kLuminanceDiffThreshold,
+        help = "luminance difference of a changed pixel, for the replay. Default: %(default)s" )
+    parser.add_argument( "--replayMinChange", type = int, default = kMinChange,
+        help = "minimum change of the changed pixel count, for the replay. Default: %(default)s" )
+    parser.add_argument( "--replayDerivativeThreshold", type = float, default = kMotionDerivativeThreshold,
+        help = "percentage of change of the changed pixel count, for the replay. Default: %(default)s" )
 
     args = parser.parse_args()
     if args.onlyDiffs:
         args.highlightDiffs = True
-
-    rocAnalyzer = RateOfChangeAnalyzer( args, os.path.basename( args.videoFile ) )
-    rocAnalyzer.AddVideoFileToAnalysis( args.videoFile, vh.Logger() )
-    rocAnalyzer.FinishAnalysis()
+    if args.recordSignals and args.rangeJobs > 1:
+        parser.error( "--recordSignals cannot be combined with --rangeJobs: the signals of a file are recorded by a sequential analysis" )
+
+    if args.replaySignals:
+        ReplayVideoFileSignals( args, args.videoFile, vh.Logger() )
+    else:
+        profiler = None
+        if args.profile:
+            profiler = vh.AnalysisProfiler()
+            profiler.StartFile( os.path.join( args.destFolder, os.path.basename( args.videoFile ) ), args.videoFile )
+        rocAnalyzer = RateOfChangeAnalyzer( args, os.path.basename( args.videoFile ) )
+        rocAnalyzer.AddVideoFileToAnalysis( args.videoFile, vh.Logger(), profiler = profiler )
+        rocAnalyzer.FinishAnalysis()
+        if not profiler is None:
+            profiler.FinishFile()
+            profiler.Close()
+            print( "Profile saved to %s" % profiler.reportPath )
 
 #TODO-Pri1 voicua: mark on the frame when there was a fast forward
 #TODO-Pri0 voicua: movement analysis (i.e. find objects with contiguous move, linear, accelerated, etc) 
 #   similar to the NASA programming contest some years ago
 # TODO-Pri0 voicua: noise detection + removal
-# TODO-Pri1 voicua: assign AI/heuristics calculated interestingness scores to analysis, to prioritize review/notifications, etc
-# TODO-Pri1 voicua: refine the roc algorithm by looking at the grid location, similar to the tile PSNR strategies
\ No newline at end of file
+# TODO-Pri1 voicua: assign AI/heuristics calculated interestingness scores to analysis, to prioritize review/notifications, etc
\ No newline at end of file